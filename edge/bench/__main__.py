@@ -0,0 +1,135 @@
+import argparse
+import json
+import sys
+from typing import List, Tuple
+from edge.bench.decode import DECODE_BACKENDS, run_decoders
+from edge.bench.runner import Scenario, environment, run_scenario
+from edge.bench.startup import run_startup
+from edge.utils.logs import configure_logging
+
+# totals compared between two runs, and whether higher is better
+COMPARED = (
+    ("fps", True),
+    ("detection_fps", True),
+    ("skipped_fps", False),
+    ("cpu_percent_per_camera", False),
+    ("pss_bytes", False),
+    ("shm_peak_bytes", False),
+    ("handoff_p50", False),
+    ("age_p50", False),
+)
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def compare(baseline: dict, current: dict) -> List[str]:
+    lines = []
+    previous = {s["name"]: s for s in baseline["scenarios"]}
+    for scenario in current["scenarios"]:
+        before = previous.get(scenario["name"])
+        if before is None:
+            continue
+        lines.append(scenario["name"])
+        for key, higher_is_better in COMPARED:
+            old, new = before["total"].get(key), scenario["total"].get(key)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            better = (change > 0) == higher_is_better
+            mark = "" if abs(change) < 5 else (" +" if better else " -")
+            lines.append(f"  {key:<24} {old:>12} -> {new:<12} {change:+6.1f}%{mark}")
+    return lines
+
+
+def compare_colocated(results: dict) -> List[str]:
+    # every colocated scenario against the same scenario split over processes
+    split = {"scenarios": [dict(s, name=s["name"] + "-colocated")
+                           for s in results["scenarios"] if not s["colocated"]]}
+    colocated = {"scenarios": [s for s in results["scenarios"] if s["colocated"]]}
+    return compare(split, colocated)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m edge.bench",
+        description="Benchmark the capture and motion detection pipeline "
+                    "without FFmpeg or cameras")
+    parser.add_argument("--source", nargs="+", default=["synthetic"],
+                        choices=("synthetic", "video"))
+    parser.add_argument("--cameras", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--resolutions", nargs="+", type=parse_resolution,
+                        default=[(320, 240), (640, 360)])
+    parser.add_argument("--fps", nargs="+", type=float, default=[5, 0],
+                        help="frames per second of each source, 0 for unlimited")
+    parser.add_argument("--workers", nargs="+", type=int, default=[0],
+                        help="motion workers of the pool mode, 0 for a detector per camera")
+    parser.add_argument("--colocated", action="store_true",
+                        help="run every scenario with the motion detection in the capturer "
+                             "process as well, and compare it with the split processes")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--startup", type=int, default=0, metavar="RUNS",
+                        help="time the camera process start methods instead, "
+                             "from start to the first processed frame")
+    parser.add_argument("--decode", nargs="*", choices=DECODE_BACKENDS, metavar="BACKEND",
+                        help="compare the decoding backends on the bundled video instead, "
+                             "all of them when none is given, for --duration seconds at "
+                             "the first of --resolutions")
+    args = parser.parse_args()
+
+    configure_logging(level="WARNING")
+    results = {"environment": environment(), "scenarios": []}
+    if args.startup:
+        results = {"environment": environment(), "startup": run_startup(args.startup)}
+        print(json.dumps(results, indent=2))
+        return
+    if args.decode is not None:
+        width, height = args.resolutions[0]
+        results = {"environment": environment(),
+                   "decode": run_decoders(args.duration, args.decode or DECODE_BACKENDS,
+                                          width=width, height=height)}
+        print(json.dumps(results, indent=2))
+        return
+    for source in args.source:
+        for cameras in args.cameras:
+            for width, height in args.resolutions:
+                for fps in args.fps:
+                    scenarios = [Scenario(
+                        source=source, cameras=cameras, width=width,
+                        height=height, fps=fps, duration=args.duration,
+                        warmup=args.warmup, workers=workers)
+                        for workers in args.workers]
+                    if args.colocated:
+                        scenarios.append(Scenario(
+                            source=source, cameras=cameras, width=width,
+                            height=height, fps=fps, duration=args.duration,
+                            warmup=args.warmup, colocated=True))
+                    for scenario in scenarios:
+                        print(f"running {scenario.name}", file=sys.stderr)
+                        result = run_scenario(scenario)
+                        print(json.dumps({result["name"]: result["total"]}),
+                              file=sys.stderr)
+                        results["scenarios"].append(result)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.colocated:
+        print("split processes -> colocated", file=sys.stderr)
+        print("\n".join(compare_colocated(results)), file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, results)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import importlib.util
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import time
+from typing import Dict, List
+from edge.bench.sources import DEFAULT_VIDEO
+from edge.config import CameraConfig
+from edge.streams.capture import PreRecordedProvider
+from edge.streams.pyav import PyAVProvider
+from edge.utils.frame import SharedMemoryFrameManager, frame_name
+from edge.utils.logs import configure_logging
+from edge.utils.metrics import ROLE_CAPTURER, MetricsRegistry, percentile
+
+DECODE_BACKENDS = ("ffmpeg", "pyav")
+
+
+def backend_error(backend: str) -> str:
+    # why a backend cannot run here, empty when it can
+    if backend == "ffmpeg" and shutil.which("ffmpeg") is None:
+        return "ffmpeg not found"
+    if backend == "pyav" and importlib.util.find_spec("av") is None:
+        return "PyAV not installed"
+    return ""
+
+
+def _cpu_seconds() -> float:
+    # the exited FFmpegs of the process included
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def bench_decoder(name: str, config: CameraConfig, metrics: MetricsRegistry,
+                  stop_event: mp.Event, results: mp.Queue) -> None:
+    configure_logging(level="WARNING")
+    frame_queue = mp.Queue(maxsize=2)
+    provider_args = dict(source_name=name, configs=config, stop_event=stop_event,
+                         frame_queue=frame_queue,
+                         metrics=metrics.camera(name, ROLE_CAPTURER))
+    if config.source.backend == "pyav":
+        provider = PyAVProvider(**provider_args)
+    else:
+        provider = PreRecordedProvider(**provider_args)
+    fm = SharedMemoryFrameManager()
+    cpu = _cpu_seconds()
+    start = time.monotonic()
+    provider.start()
+    # the detector of the camera, without the detection
+    while not stop_event.is_set():
+        try:
+            frame_time = frame_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        fm.get(name=frame_name(name, frame_time), shape=config.frame_shape_yuv)
+        fm.delete(name=frame_name(name, frame_time))
+    provider.join()
+    results.put((time.monotonic() - start, _cpu_seconds() - cpu))
+
+
+def run_decode(backend: str,
+               duration: float,
+               width: int = 640,
+               height: int = 360,
+               fps: int = 30,
+               path: str = DEFAULT_VIDEO) -> dict:
+    """
+    Decodes the bundled video with a backend in a capturer process of its
+    own for a duration, as fast as the backend goes, and reports the frames
+    per second, the CPU per frame and the latency of reading a frame. The
+    CPU of the FFmpeg subprocesses is counted with the pipe backend.
+    """
+    error = backend_error(backend)
+    if error:
+        return {"backend": backend, "error": error}
+    name = f"decode-{backend}"
+    config = CameraConfig(
+        source={"path": os.path.abspath(path), "backend": backend,
+                "ffmpeg": {"input_args": "mp4_generic"}},
+        detect={"width": width, "height": height, "fps": fps})
+    metrics = MetricsRegistry(cameras=[name])
+    stop_event = mp.Event()
+    results = mp.Queue()
+    proc = mp.Process(target=bench_decoder, name=f"capturer:{name}",
+                      args=(name, config, metrics, stop_event, results))
+    proc.start()
+    time.sleep(duration)
+    stop_event.set()
+    elapsed, cpu = results.get(timeout=30)
+    proc.join()
+    snapshot = metrics.snapshot()[name]
+    metrics.close()
+    frames = snapshot["counters"]["frames"]
+    read = snapshot["stages"]["read"]
+    return {
+        "backend": backend,
+        "width": width,
+        "height": height,
+        "duration": round(elapsed, 3),
+        "frames": int(frames),
+        "fps": round(frames / elapsed, 2),
+        "cpu_percent": round(100 * cpu / elapsed, 2),
+        "cpu_ms_per_frame": round(1000 * cpu / frames, 3) if frames else None,
+        "restarts": int(snapshot["counters"]["decode_restarts"]),
+        "read_latency": {
+            "mean": round(read["sum"] / read["count"], 6) if read["count"] else None,
+            "p50": percentile(read["buckets"], 0.5),
+            "p99": percentile(read["buckets"], 0.99),
+        },
+    }
+
+
+def run_decoders(duration: float, backends: List[str] = DECODE_BACKENDS,
+                 **kwargs) -> Dict[str, dict]:
+    return {backend: run_decode(backend, duration, **kwargs) for backend in backends}
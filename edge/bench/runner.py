@@ -0,0 +1,368 @@
+import multiprocessing as mp
+import os
+import queue
+import subprocess as sp
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+from edge.config import CameraConfig
+from edge.motion.default import DefaultMotionDetector
+from edge.stats import read_process_stats, read_shm_usage
+from edge.streams.capture import FrameCollector
+from edge.utils.frame import LocalFrameManager, SharedMemoryFrameManager, frame_name
+from edge.utils.logs import configure_logging
+from edge.utils.metrics import (ROLE_CAPTURER, ROLE_DETECTOR, STAGES,
+                                MetricsRegistry, percentile)
+from edge.utils.placement import assign_workers
+from edge.utils.trace import TraceRing
+from edge.video import (create_camera_detector, run_colocated_detector, run_detectors,
+                        run_worker_loop)
+
+# one frame out of this many is traced from its read to its motion result
+TRACE_EVERY = 5
+
+
+class Scenario:
+    def __init__(self,
+                 source: str,
+                 cameras: int,
+                 width: int,
+                 height: int,
+                 fps: float,
+                 duration: float,
+                 warmup: float,
+                 workers: int = 0,
+                 colocated: bool = False) -> None:
+        self.source = source
+        self.cameras = cameras
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.duration = duration
+        self.warmup = warmup
+        # motion workers of the pool mode, a detector per camera when zero
+        self.workers = workers
+        # the motion detection in a thread of the capturer, workers are ignored
+        self.colocated = colocated
+
+    @property
+    def name(self) -> str:
+        fps = int(self.fps) if self.fps else "max"
+        name = f"{self.source}-{self.cameras}x{self.width}x{self.height}@{fps}"
+        if self.colocated:
+            return f"{name}-colocated"
+        return f"{name}-w{self.workers}" if self.workers else name
+
+    def camera_config(self) -> CameraConfig:
+        return CameraConfig(
+            source={"path": f"bench:{self.source}"},
+            detect={"width": self.width, "height": self.height,
+                    "fps": int(self.fps) or 5},
+            colocated=self.colocated)
+
+    def source_command(self) -> List[str]:
+        return [sys.executable, "-m", "edge.bench.sources",
+                "--kind", self.source,
+                "--width", str(self.width),
+                "--height", str(self.height),
+                "--fps", str(self.fps)]
+
+
+def bench_capturer(name: str,
+                   config: CameraConfig,
+                   frame_queue: mp.Queue,
+                   metrics: MetricsRegistry,
+                   stop_event: mp.Event,
+                   command: List[str],
+                   source_pid: mp.Value,
+                   traces: Optional[TraceRing] = None) -> None:
+    # FrameCollector reading from a source process instead of FFmpeg
+    configure_logging(level="WARNING")
+    frame_size = config.frame_shape_yuv[0] * config.frame_shape_yuv[1]
+    process = sp.Popen(command, stdout=sp.PIPE, stderr=sp.DEVNULL,
+                       stdin=sp.DEVNULL, bufsize=frame_size * 10)
+    source_pid.value = process.pid
+    fm = SharedMemoryFrameManager()
+    detection = None
+    if config.colocated:
+        # as run_capturer does for a colocated camera
+        frame_queue = queue.Queue(maxsize=2)
+        fm = LocalFrameManager()
+        detection = threading.Thread(
+            target=run_colocated_detector,
+            args=(name, config, frame_queue, fm, metrics, stop_event, None, traces))
+        detection.start()
+    collector = FrameCollector(
+        ffmpeg_process=process,
+        source_name=name,
+        frame_shape=config.frame_shape_yuv,
+        frame_queue=frame_queue,
+        metrics=metrics.camera(name, ROLE_CAPTURER),
+        frame_manager=fm,
+        stop_event=stop_event,
+        trace=traces.camera(name) if traces is not None else None)
+    collector.run()
+    process.terminate()
+    process.wait()
+    if detection is not None:
+        detection.join()
+    fm.clean()
+
+
+def bench_detector(name: str,
+                   config: CameraConfig,
+                   frame_queue: mp.Queue,
+                   metrics: MetricsRegistry,
+                   stop_event: mp.Event,
+                   traces: Optional[TraceRing] = None) -> None:
+    configure_logging(level="WARNING")
+    camera_metrics = metrics.camera(name, ROLE_DETECTOR)
+    run_detectors(
+        camera_name=name,
+        config=config,
+        frame_queue=frame_queue,
+        stop_event=stop_event,
+        metrics=camera_metrics,
+        detector=DefaultMotionDetector(
+            frame_shape=config.frame_shape_yuv,
+            config=config.motion,
+            fps=config.detect.fps),
+        frame_shape=config.frame_shape_yuv,
+        frame_manager=SharedMemoryFrameManager(),
+        fps_counter=camera_metrics.rate("detection_fps"),
+        trace=traces.camera(name) if traces is not None else None)
+
+
+def bench_worker(name: str,
+                 cameras: Dict[str, CameraConfig],
+                 frame_queues: Dict[str, mp.Queue],
+                 metrics: MetricsRegistry,
+                 stop_event: mp.Event,
+                 traces: Optional[TraceRing] = None) -> None:
+    configure_logging(level="WARNING")
+    detectors = {camera: create_camera_detector(camera, config, metrics, traces=traces)
+                 for camera, config in cameras.items()}
+    run_worker_loop(name=name, detectors=detectors,
+                    frame_queues=frame_queues, stop_event=stop_event)
+    for detector in detectors.values():
+        detector.close()
+
+
+def read_pss(pid: int) -> Optional[int]:
+    # Proportional set size: shared pages are split between the processes
+    # mapping them, so that the sum over processes is the real footprint
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _sample(metrics: MetricsRegistry, pids: Dict[str, Dict[str, int]]) -> dict:
+    snapshot = metrics.snapshot()
+    processes = {
+        camera: {role: read_process_stats(pid) for role, pid in roles.items()}
+        for camera, roles in pids.items()
+    }
+    return {"time": time.monotonic(), "metrics": snapshot, "processes": processes}
+
+
+def _release_queued_frames(name: str, frame_queue: mp.Queue) -> None:
+    # frames still waiting for the detector have no owner anymore
+    while True:
+        try:
+            frame_time = frame_queue.get(timeout=0.1)
+        except (queue.Empty, OSError, ValueError):
+            return
+        try:
+            shm = shared_memory.SharedMemory(name=frame_name(name, frame_time))
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+
+
+def run_scenario(scenario: Scenario) -> dict:
+    names = [f"cam{i}" for i in range(scenario.cameras)]
+    config = scenario.camera_config()
+    metrics = MetricsRegistry(cameras=names)
+    traces = TraceRing(cameras=names, sample_every=TRACE_EVERY)
+    stop_event = mp.Event()
+    shm_baseline, _ = read_shm_usage()
+    procs = []
+    pids: Dict[str, Dict[str, int]] = {}
+    queues = {}
+    source_pids = {}
+    for name in names:
+        queues[name] = mp.Queue(maxsize=2)
+        source_pids[name] = mp.Value("i", 0)
+        capturer = mp.Process(
+            target=bench_capturer, name=f"capturer:{name}",
+            args=(name, config, queues[name], metrics, stop_event,
+                  scenario.source_command(), source_pids[name], traces))
+        capturer.start()
+        procs.append(capturer)
+        pids[name] = {"capturer": capturer.pid}
+        if scenario.workers or scenario.colocated:
+            continue
+        detector = mp.Process(
+            target=bench_detector, name=f"detector:{name}",
+            args=(name, config, queues[name], metrics, stop_event, traces))
+        detector.start()
+        procs.append(detector)
+        pids[name]["detector"] = detector.pid
+    assignment = assign_workers({name: config for name in names}, scenario.workers) \
+        if scenario.workers and not scenario.colocated else []
+    for i, cameras in enumerate(assignment):
+        if not cameras:
+            continue
+        worker = mp.Process(
+            target=bench_worker, name=f"worker-{i}",
+            args=(f"worker-{i}", {name: config for name in cameras},
+                  {name: queues[name] for name in cameras}, metrics, stop_event, traces))
+        worker.start()
+        procs.append(worker)
+        pids[f"worker-{i}"] = {"worker": worker.pid}
+
+    time.sleep(scenario.warmup)
+    for name in names:
+        pids[name]["source"] = source_pids[name].value
+    first = _sample(metrics, pids)
+    shm_peak = 0
+    pss_peak: Dict[str, Dict[str, int]] = {name: {} for name in pids}
+    deadline = first["time"] + scenario.duration
+    while time.monotonic() < deadline:
+        time.sleep(min(0.5, max(0, deadline - time.monotonic())))
+        shm_peak = max(shm_peak, read_shm_usage()[0] - shm_baseline)
+        for name, roles in pids.items():
+            for role, pid in roles.items():
+                pss = read_pss(pid)
+                if pss is not None:
+                    pss_peak[name][role] = max(pss_peak[name].get(role, 0), pss)
+    last = _sample(metrics, pids)
+
+    stop_event.set()
+    for proc in procs:
+        proc.join(timeout=10)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+    for name in names:
+        _release_queued_frames(name, queues[name])
+    metrics.close()
+    handoffs = _handoffs(traces)
+    traces.close()
+    return _summarize(scenario, first, last, shm_peak, pss_peak, handoffs)
+
+
+def _handoffs(traces: TraceRing) -> Dict[str, dict]:
+    # From publishing a frame to the detector picking it up, and from reading
+    # it to its motion result, over the last traced frames of each camera
+    spans: Dict[str, Dict[str, List[float]]] = {}
+    for record in traces.records():
+        points = record["points"]
+        if "detected" not in points:
+            continue
+        camera = spans.setdefault(record["camera"], {"handoff": [], "age": []})
+        camera["handoff"].append(points["picked_up"] - points["published"])
+        camera["age"].append(record["age"])
+    return {name: {span: {"p50": _quantile(values, 0.5), "p99": _quantile(values, 0.99)}
+                   for span, values in camera.items()}
+            for name, camera in spans.items()}
+
+
+def _quantile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 6)
+
+
+def _summarize(scenario: Scenario, first: dict, last: dict,
+               shm_peak: int, pss_peak: Dict[str, Dict[str, int]],
+               handoffs: Optional[Dict[str, dict]] = None) -> dict:
+    handoffs = handoffs or {}
+    elapsed = last["time"] - first["time"]
+    cameras = {}
+    for name in last["metrics"]:
+        before, after = first["metrics"][name], last["metrics"][name]
+        counters = {key: (after["counters"][key] - before["counters"][key]) / elapsed
+                    for key in ("frames", "skipped_frames", "detected_frames")}
+        cpu = {}
+        for role, stats in last["processes"][name].items():
+            start = first["processes"][name].get(role)
+            if stats is not None and start is not None:
+                cpu[role] = round(100 * (stats[1] - start[1]) / elapsed, 2)
+        latency = {}
+        for stage in STAGES:
+            buckets = [b - a for a, b in zip(before["stages"][stage]["buckets"],
+                                             after["stages"][stage]["buckets"])]
+            if not buckets or buckets[-1] == 0:
+                continue
+            latency[stage] = {"p50": percentile(buckets, 0.5),
+                              "p99": percentile(buckets, 0.99)}
+        cameras[name] = {
+            "fps": round(counters["frames"], 2),
+            "skipped_fps": round(counters["skipped_frames"], 2),
+            "detection_fps": round(counters["detected_frames"], 2),
+            "cpu_percent": cpu,
+            "pss_bytes": pss_peak.get(name, {}),
+            "latency": latency,
+            "handoff": handoffs.get(name, {}).get("handoff"),
+            "age": handoffs.get(name, {}).get("age"),
+        }
+    total = {
+        key: round(sum(c[key] for c in cameras.values()), 2)
+        for key in ("fps", "skipped_fps", "detection_fps")
+    }
+    # every pipeline process, the sources stand in for FFmpeg and are left out
+    cpu_total = 0.0
+    for name, roles in last["processes"].items():
+        for role, stats in roles.items():
+            start = first["processes"][name].get(role)
+            if role != "source" and stats is not None and start is not None:
+                cpu_total += 100 * (stats[1] - start[1]) / elapsed
+    total["cpu_percent"] = round(cpu_total, 2)
+    total["cpu_percent_per_camera"] = round(cpu_total / max(1, len(cameras)), 2)
+    total["pss_bytes"] = sum(pss for roles in pss_peak.values()
+                             for role, pss in roles.items() if role != "source")
+    total["processes"] = sum(1 for roles in last["processes"].values()
+                             for role in roles if role != "source")
+    total["shm_peak_bytes"] = shm_peak
+    # the worst camera
+    for span in ("handoff", "age"):
+        p50s = [c[span]["p50"] for c in cameras.values() if c[span]]
+        total[f"{span}_p50"] = max(p50s) if p50s else None
+    return {
+        "name": scenario.name,
+        "source": scenario.source,
+        "cameras": scenario.cameras,
+        "width": scenario.width,
+        "height": scenario.height,
+        "fps": scenario.fps,
+        "workers": scenario.workers,
+        "colocated": scenario.colocated,
+        "duration": round(elapsed, 3),
+        "total": total,
+        "per_camera": cameras,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return sp.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                      text=True, check=True).stdout.strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "time": time.time(),
+    }
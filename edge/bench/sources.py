@@ -0,0 +1,91 @@
+import argparse
+import sys
+import time
+from typing import List
+import numpy as np
+
+DEFAULT_VIDEO = "tests/src/video.mp4"
+# frames generated up front and looped, so producing them costs nothing
+LOOP_FRAMES = 50
+
+
+def synthetic_frames(width: int, height: int, count: int = LOOP_FRAMES) -> List[bytes]:
+    # YUV420p frames with a moving bright square on a noisy background
+    rng = np.random.default_rng(0)
+    frames = []
+    size = max(4, min(width, height) // 8)
+    for i in range(count):
+        frame = np.full((height * 3 // 2, width), 128, dtype=np.uint8)
+        luma = frame[:height]
+        luma[:] = rng.integers(60, 70, size=(height, width), dtype=np.uint8)
+        x = (i * width // count) % max(1, width - size)
+        y = (i * height // count) % max(1, height - size)
+        luma[y:y + size, x:x + size] = 230
+        frames.append(frame.tobytes())
+    return frames
+
+
+def video_frames(path: str, width: int, height: int, count: int = LOOP_FRAMES) -> List[bytes]:
+    # Decodes the clip once and converts it to the raw output of FFmpeg
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420).tobytes())
+    capture.release()
+    if not frames:
+        raise ValueError(f"unable to decode frames from {path}")
+    return frames
+
+
+def load_frames(kind: str, width: int, height: int, path: str = DEFAULT_VIDEO) -> List[bytes]:
+    if kind == "video":
+        return video_frames(path=path, width=width, height=height)
+    return synthetic_frames(width=width, height=height)
+
+
+def write_frames(out, frames: List[bytes], fps: float, duration: float) -> None:
+    # Writes frames like FFmpeg does with -f rawvideo pipe:, paced at fps
+    # or as fast as the reader consumes them when fps is 0
+    interval = 1 / fps if fps > 0 else 0
+    start = time.monotonic()
+    deadline = start + duration
+    i = 0
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if interval:
+            wait = start + i * interval - now
+            if wait > 0:
+                time.sleep(wait)
+        try:
+            out.write(frames[i % len(frames)])
+            out.flush()
+        except (BrokenPipeError, ValueError):
+            return
+        i += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Raw frame source standing in for FFmpeg")
+    parser.add_argument("--kind", choices=("synthetic", "video"), default="synthetic")
+    parser.add_argument("--path", default=DEFAULT_VIDEO)
+    parser.add_argument("--width", type=int, required=True)
+    parser.add_argument("--height", type=int, required=True)
+    parser.add_argument("--fps", type=float, default=0)
+    parser.add_argument("--duration", type=float, default=3600)
+    args = parser.parse_args()
+    frames = load_frames(kind=args.kind, width=args.width,
+                         height=args.height, path=args.path)
+    write_frames(sys.stdout.buffer, frames, fps=args.fps, duration=args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import multiprocessing as mp
+import statistics
+import subprocess as sp
+import sys
+import time
+from typing import Dict, List
+from edge.config import CameraConfig
+from edge.utils.frame import SharedMemoryFrameManager, frame_name
+from edge.utils.metrics import ROLE_DETECTOR, MetricsRegistry
+from edge.utils.processes import PRELOAD_MODULES, camera_process
+from edge.video import run_camera_processor
+
+# seconds from starting a detector process to its first processed frame,
+# what a crashed or reconfigured camera is blind for on top of the backoff
+STARTUP_TARGET = 0.2
+START_METHODS = ("fork", "spawn", "forkserver")
+
+_IMPORT_PROBE = ("import time; start = time.perf_counter(); "
+                 "import edge.capture, edge.video; print(time.perf_counter() - start)")
+
+
+def import_time() -> float:
+    # the imports of the camera processes in a fresh interpreter
+    out = sp.run([sys.executable, "-c", _IMPORT_PROBE], capture_output=True,
+                 text=True, check=True).stdout
+    return float(out.strip())
+
+
+def _first_frame(context, name: str, config: CameraConfig, metrics: MetricsRegistry,
+                 timeout: float) -> float:
+    frame_queue = context.Queue(maxsize=2)
+    frames = SharedMemoryFrameManager()
+    frame_time = time.time()
+    shape = config.frame_shape_yuv
+    frames.create(frame_name(name, frame_time), shape[0] * shape[1])
+    # the detector deletes the frame once processed
+    frames.shm_store.clear()
+    frame_queue.put(frame_time)
+    detected = metrics.camera(name, ROLE_DETECTOR)
+    before = detected.get("detected_frames")
+    proc = camera_process(target=run_camera_processor, name=f"detector:{name}",
+                          args=(name, config, frame_queue, metrics),
+                          log_level="WARNING", context=context)
+    start = time.monotonic()
+    proc.start()
+    deadline = start + timeout
+    while detected.get("detected_frames") == before and time.monotonic() < deadline:
+        time.sleep(0.001)
+    elapsed = time.monotonic() - start
+    proc.terminate()
+    proc.join()
+    return elapsed
+
+
+def run_startup(runs: int,
+                methods: List[str] = START_METHODS,
+                timeout: float = 10.0) -> dict:
+    """
+    Times every start method from starting a detector process to its first
+    processed frame, with the modules preloaded by the fork server. The
+    first start of each method is reported apart from the runs.
+    """
+    name = "startup"
+    config = CameraConfig(detect={"width": 320, "height": 240, "fps": 5})
+    metrics = MetricsRegistry(cameras=[name])
+    results: Dict[str, dict] = {}
+    for method in methods:
+        context = mp.get_context(method)
+        if method == "forkserver":
+            context.set_forkserver_preload(list(PRELOAD_MODULES))
+        # the first start also waits for the fork server to preload
+        first = _first_frame(context, name, config, metrics, timeout)
+        times = [_first_frame(context, name, config, metrics, timeout) for _ in range(runs)]
+        results[method] = {
+            "first": round(first, 4),
+            "runs": runs,
+            "p50": round(statistics.median(times), 4),
+            "max": round(max(times), 4),
+            "met_target": max(times) <= STARTUP_TARGET,
+        }
+    metrics.close()
+    return {"target": STARTUP_TARGET, "import_time": round(import_time(), 4),
+            "methods": results}
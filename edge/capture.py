@@ -1,39 +1,124 @@
-from edge.config import CameraConfig
+from typing import Dict, Optional
+from edge.config import CameraConfig, DecoderBackendEnum
 import multiprocessing as mp
 from loguru import logger
+import queue
 import signal
-from edge.streams.capture import PreRecordedProvider
+import threading
+from edge.streams.capture import PreRecordedProvider, SharedDecoderProvider
+from edge.streams.api import StreamProviderAPI
+from edge.streams.pyav import PyAVProvider
+from edge.streams.replay import ReplayProvider
+from edge.utils.configs import ConfigChannel
+from edge.utils.frame import LocalFrameManager
+from edge.utils.metrics import ROLE_CAPTURER, MetricsRegistry
+from edge.utils.placement import CameraPlacement
+from edge.utils.profiling import Profiler
+from edge.utils.trace import TraceRing
+from edge.video import run_colocated_detector
 
 
 def run_capturer(
         name: str,
         config: CameraConfig,
         frame_queue: mp.Queue,
-        camera_fps: mp.Value,
-        skipped_fps: mp.Value,
-        ffmpeg_pid: mp.Value):
+        metrics: MetricsRegistry,
+        traces: Optional[TraceRing] = None,
+        channel: Optional[ConfigChannel] = None,
+        placement: Optional[CameraPlacement] = None,
+        event_queue: Optional[mp.Queue] = None,
+        detector_channel: Optional[ConfigChannel] = None):
+    placement = placement or CameraPlacement()
+    # before any thread is started, they inherit it
+    placement.capturer.apply()
     logger.info("Capturer process started")
 
     exit_signal = mp.Event()
 
-    capturer = PreRecordedProvider(
+    frame_manager = None
+    detection = None
+    if config.colocated:
+        # the frames are handed to the detection thread in this process
+        # instead of the shared memory and the queue to a detector process,
+        # OpenCV releases the GIL while it detects
+        frame_queue = queue.Queue(maxsize=2)
+        frame_manager = LocalFrameManager()
+        detection = threading.Thread(
+            target=run_colocated_detector,
+            name=f"detector:{name}",
+            args=(name, config, frame_queue, frame_manager, metrics, exit_signal,
+                  event_queue, traces, detector_channel))
+    provider_args = dict(
         source_name=name,
         configs=config,
         stop_event=exit_signal,
         frame_queue=frame_queue,
-        camera_fps=camera_fps,
-        skipped_fps=skipped_fps,
-        ffmpeg_pid=ffmpeg_pid,
+        metrics=metrics.camera(name, ROLE_CAPTURER),
+        trace=traces.camera(name) if traces is not None else None,
+        frame_manager=frame_manager,
     )
+    # a camera with a recording to replay does not need FFmpeg
+    if config.replay.path:
+        capturer = ReplayProvider(**provider_args)
+    elif config.source.backend == DecoderBackendEnum.pyav:
+        capturer = PyAVProvider(**provider_args)
+    else:
+        capturer = PreRecordedProvider(placement=placement.ffmpeg, **provider_args)
+    if detection is not None:
+        detection.start()
+    _run_provider(name, capturer, exit_signal, channel)
+    if detection is not None:
+        exit_signal.set()
+        detection.join()
+
+
+def run_shared_capturer(
+        name: str,
+        cameras: Dict[str, CameraConfig],
+        frame_queues: Dict[str, mp.Queue],
+        metrics: MetricsRegistry,
+        traces: Optional[TraceRing] = None,
+        channel: Optional[ConfigChannel] = None,
+        placement: Optional[CameraPlacement] = None):
+    # Captures the frames of several cameras from the FFmpeg they share
+    placement = placement or CameraPlacement()
+    placement.capturer.apply()
+    logger.info(f"Shared capturer process started for {', '.join(cameras)}")
+
+    exit_signal = mp.Event()
+    capturer = SharedDecoderProvider(
+        source_name=name,
+        metrics={camera: metrics.camera(camera, ROLE_CAPTURER) for camera in cameras},
+        stop_event=exit_signal,
+        configs=cameras,
+        frame_queues=frame_queues,
+        traces={camera: traces.camera(camera) for camera in cameras}
+        if traces is not None else None,
+        placement=placement.ffmpeg)
+    _run_provider(name, capturer, exit_signal, channel)
+
 
+def _run_provider(name: str,
+                  capturer: StreamProviderAPI,
+                  exit_signal: mp.Event,
+                  channel: Optional[ConfigChannel]) -> None:
     def on_exit(_, __):
         exit_signal.set()
         logger.info("Capturer process exiting")
 
     signal.signal(signal.SIGINT, on_exit)
     signal.signal(signal.SIGTERM, on_exit)
+    signal.signal(signal.SIGHUP, lambda _, __: capturer.restart())
+    Profiler(name=f"capturer:{name}").install()
 
     capturer.start()
-    capturer.join()
+    while capturer.is_alive():
+        if channel is None:
+            capturer.join(timeout=1.0)
+            continue
+        update = channel.wait(timeout=1.0)
+        if update is not None:
+            logger.info(f"Applying the new configuration of {name}")
+            capturer.update_config(update)
 
     logger.info("Capturer process exited")
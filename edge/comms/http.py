@@ -0,0 +1,101 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+from loguru import logger
+from edge.config import HttpConfig
+from edge.stats import StatsCollector
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    collector: StatsCollector = None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        try:
+            if url.path == "/metrics":
+                self._send(200, PROMETHEUS_CONTENT_TYPE,
+                           self.collector.metrics())
+            elif url.path == "/trace":
+                self._send_trace(parse_qs(url.query))
+            elif url.path == "/health":
+                healthy, cameras = self.collector.health()
+                body = json.dumps(
+                    {"healthy": healthy, "cameras": cameras}).encode()
+                self._send(200 if healthy else 503, "application/json", body)
+            else:
+                self._send(404, "text/plain", b"not found\n")
+        except Exception as e:
+            logger.error(f"Unable to serve {self.path}: {e}")
+            self._send(500, "text/plain", b"internal error\n")
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != "/profile":
+            self._send(404, "text/plain", b"not found\n")
+            return
+        query = parse_qs(url.query)
+        try:
+            output = self.collector.processor.profile(
+                camera=query.get("camera", [None])[0],
+                role=query.get("role", ["detector"])[0],
+                mode=query.get("mode", ["sample"])[0],
+                duration=float(query.get("duration", [10])[0]))
+        except (KeyError, ValueError) as e:
+            self._send(400, "text/plain", f"{e}\n".encode())
+            return
+        except Exception as e:
+            logger.error(f"Unable to serve {self.path}: {e}")
+            self._send(500, "text/plain", b"internal error\n")
+            return
+        self._send(202, "application/json",
+                   json.dumps({"output": output}).encode())
+
+    def _send_trace(self, query) -> None:
+        traces = self.collector.processor.traces
+        if traces is None:
+            self._send(404, "text/plain", b"tracing is disabled\n")
+            return
+        camera = query.get("camera", [None])[0]
+        if query.get("format", ["json"])[0] == "chrome":
+            body = traces.chrome_trace(camera=camera)
+        else:
+            body = traces.records(camera=camera)
+        self._send(200, "application/json", json.dumps(body).encode())
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # scrapes every second would flood the log
+        return
+
+
+class StatsServer(threading.Thread):
+    # Serves /metrics, /health, /trace and /profile from the parent process
+    def __init__(self, config: HttpConfig, collector: StatsCollector) -> None:
+        threading.Thread.__init__(self, name="http:stats")
+        self.daemon = True
+        handler = type("Handler", (StatsRequestHandler,),
+                       {"collector": collector})
+        self.server = ThreadingHTTPServer((config.host, config.port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def run(self) -> None:
+        logger.info(f"Stats server listening on port {self.port}")
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        logger.info("Stats server stopped")
@@ -0,0 +1,169 @@
+from collections import deque
+import json
+import threading
+from typing import Any, Deque, Dict, Optional, Tuple, Union
+from loguru import logger
+import paho.mqtt.client as mqtt
+from edge.config import CameraMqttConfig, EventMqttConfig, MqttDropPolicyEnum
+
+
+class MqttPublisher(threading.Thread):
+    """
+    Publishes events and camera states to the MQTT broker from a
+    dedicated thread, so that the detection loop never waits on the network.
+
+    Camera states (motion, fps, ...) are latest-value topics: only the most
+    recent value per (camera, key) is kept and older updates are coalesced.
+    Tracked object events are queued in a bounded queue and are always sent
+    before pending states. When the event queue is full, events are dropped
+    according to the configured drop policy instead of blocking the caller.
+    """
+
+    def __init__(self,
+                 config: Union[EventMqttConfig, CameraMqttConfig],
+                 client_id: Optional[str] = None,
+                 batch_size: int = 100,
+                 client: Optional[mqtt.Client] = None) -> None:
+        threading.Thread.__init__(self, name=f"mqtt:{config.host}")
+        self.daemon = True
+        self.config = config
+        self.topic_prefix = config.topic_prefix
+        self.batch_size = batch_size
+        self.drop_policy = config.drop_policy
+        self.events: Deque[Tuple[str, bytes]] = deque()
+        self.max_queued = config.max_queued
+        self.states: Dict[Tuple[str, str], bytes] = {}
+        self.dropped = 0
+        self.published = 0
+        self.connected = threading.Event()
+        self.stop_event = threading.Event()
+        self.cond = threading.Condition()
+        if client is None:
+            client = mqtt.Client(
+                callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                client_id=client_id or config.client_id)
+            if config.user:
+                client.username_pw_set(config.user, config.password)
+        # bound the client's own outbound buffer, our queues absorb the rest
+        client.max_queued_messages_set(batch_size)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        self.client = client
+
+    def publish_state(self, camera: str, key: str, value: Any) -> None:
+        payload = self._encode(value)
+        with self.cond:
+            self.states[(camera, key)] = payload
+            self.cond.notify()
+
+    def publish_event(self, event: Any, topic: str = "events") -> bool:
+        payload = self._encode(event)
+        with self.cond:
+            if len(self.events) >= self.max_queued:
+                self.dropped += 1
+                if self.drop_policy == MqttDropPolicyEnum.drop_newest:
+                    return False
+                self.events.popleft()
+            self.events.append((topic, payload))
+            self.cond.notify()
+        return True
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.events) + len(self.states)
+
+    def run(self) -> None:
+        logger.info(
+            f"MQTT publisher connecting to {self.config.host}:{self.config.port}")
+        self.client.connect_async(self.config.host, self.config.port)
+        self.client.loop_start()
+        while not self.stop_event.is_set():
+            if not self.connected.wait(timeout=1.0):
+                continue
+            with self.cond:
+                while not self.events and not self.states \
+                        and not self.stop_event.is_set():
+                    self.cond.wait(timeout=1.0)
+                batch = self._take_batch()
+            requeue = self._send(batch)
+            if requeue:
+                self._requeue(requeue)
+                # the client buffer is full, give the network thread some air
+                self.stop_event.wait(timeout=0.05)
+        self.client.disconnect()
+        self.client.loop_stop()
+        logger.info("MQTT publisher stopped")
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify()
+
+    def _take_batch(self):
+        batch = []
+        # tracked object events first, latest-value states with what is left
+        while self.events and len(batch) < self.batch_size:
+            topic, payload = self.events.popleft()
+            batch.append((None, topic, payload))
+        while self.states and len(batch) < self.batch_size:
+            state, payload = next(iter(self.states.items()))
+            del self.states[state]
+            batch.append((state, f"{state[0]}/{state[1]}", payload))
+        return batch
+
+    def _send(self, batch):
+        for i, (state, topic, payload) in enumerate(batch):
+            is_event = state is None
+            info = self.client.publish(
+                topic=f"{self.topic_prefix}/{topic}",
+                payload=payload,
+                qos=1 if is_event else 0,
+                retain=not is_event)
+            # paho keeps a QoS 1 message while disconnected and sends it on
+            # reconnect, queueing it again would publish it twice
+            if info.rc == mqtt.MQTT_ERR_SUCCESS or \
+                    (is_event and info.rc == mqtt.MQTT_ERR_NO_CONN):
+                self.published += 1
+                continue
+            if info.rc != mqtt.MQTT_ERR_QUEUE_SIZE:
+                logger.error(
+                    f"MQTT publisher failed to publish to {topic}: {mqtt.error_string(info.rc)}")
+                if is_event:
+                    self.dropped += 1
+                    continue
+            # the client buffer is full, or a state that is not kept by paho
+            return batch[i:]
+        return []
+
+    def _requeue(self, batch) -> None:
+        with self.cond:
+            for state, topic, payload in reversed(batch):
+                if state is None:
+                    if len(self.events) >= self.max_queued:
+                        self.dropped += 1
+                        continue
+                    self.events.appendleft((topic, payload))
+                else:
+                    # a newer value may have arrived in the meantime
+                    self.states.setdefault(state, payload)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties) -> None:
+        if reason_code.is_failure:
+            logger.error(f"MQTT publisher unable to connect: {reason_code}")
+            return
+        logger.info("MQTT publisher connected")
+        self.connected.set()
+        with self.cond:
+            self.cond.notify()
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties) -> None:
+        logger.warning(f"MQTT publisher disconnected: {reason_code}")
+        self.connected.clear()
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, str):
+            return value.encode()
+        return json.dumps(value).encode()
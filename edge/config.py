@@ -1,13 +1,15 @@
 from typing import List, Dict, Self, Tuple, Union, Optional
 from enum import Enum
-from pydantic import BaseModel, Field, ValidationInfo,  field_validator, ConfigDict
+from pydantic import BaseModel, Field, PrivateAttr, ValidationInfo,  field_validator, ConfigDict
 from edge.ffmpeg import get_ffmpeg_argument_list, parse_preset_hardware_acceleration_scale, parse_preset_input, parse_preset_hardware_acceleration_decode
-from yaml import load, CLoader as Loader
 import json
 
 FFMPEG_DEFAULT_GLOBAL_ARGS = ["-hide_banner",
                               "-loglevel", "warning", "-threads", "2"]
 
+# detect size of a camera without one whose stream could not be probed
+DEFAULT_DETECT_SIZE = (1280, 720)
+
 FFMPEG_DEFAULT_OUTPUTS_ARGS = ["-threads",
                                "2",
                                "-f",
@@ -26,7 +28,9 @@ class FfmpegConfig(BaseModel):
         title="Global FFMPEG arguments")
     hwaccel_args: Union[str, List[str]] = Field(
         default="",
-        title="FFMPEG Hardware Acceleration Arguments")
+        title="FFMPEG Hardware Acceleration Arguments",
+        description="The hardware acceleration preset, auto for the first preset "
+                    "that decodes on this box according to the cached probe")
     input_args: Union[str, List[str]] = Field(
         default="",
         title="FFMPEG Input Arguments")
@@ -39,11 +43,21 @@ class FfmpegConfig(BaseModel):
         description="The interval between FFMPEG retries connecting to the camera")
 
 
+class DecoderBackendEnum(str, Enum):
+    ffmpeg = "ffmpeg"
+    pyav = "pyav"
+
+
 class CameraInput(EdgeBaseModel):
     path: str = Field(
         default="",
         title="Input Path",
         description="The path to the camera input")
+    backend: DecoderBackendEnum = Field(
+        default=DecoderBackendEnum.ffmpeg,
+        title="Decoder Backend",
+        description="Decode with an FFmpeg subprocess writing to a pipe, or in the "
+                    "capturer process with PyAV, which must then be installed")
     ffmpeg: FfmpegConfig = Field(
         default_factory=FfmpegConfig,
         title="FFMPEG Configuration",
@@ -95,6 +109,11 @@ class DetectConfig(EdgeBaseModel):
         description="The configuration for stationary objects")
 
 
+class MqttDropPolicyEnum(str, Enum):
+    drop_oldest = "drop_oldest"
+    drop_newest = "drop_newest"
+
+
 class EventMqttConfig(EdgeBaseModel):
     enabled: bool = Field(
         default=False,
@@ -124,6 +143,15 @@ class EventMqttConfig(EdgeBaseModel):
         default="",
         title="Password",
         description="The password for the MQTT connection")
+    max_queued: int = Field(
+        default=1000,
+        ge=1,
+        title="Max Queued Events",
+        description="The maximum number of events waiting to be published")
+    drop_policy: MqttDropPolicyEnum = Field(
+        default=MqttDropPolicyEnum.drop_oldest,
+        title="Drop Policy",
+        description="Which events are dropped when the outbound queue is full")
 
     @field_validator("password")
     def user_requires_pass(cls, v, info: ValidationInfo):
@@ -161,6 +189,15 @@ class CameraMqttConfig(EdgeBaseModel):
         default="",
         title="Password",
         description="The password for the MQTT connection")
+    max_queued: int = Field(
+        default=1000,
+        ge=1,
+        title="Max Queued Events",
+        description="The maximum number of events waiting to be published")
+    drop_policy: MqttDropPolicyEnum = Field(
+        default=MqttDropPolicyEnum.drop_oldest,
+        title="Drop Policy",
+        description="Which events are dropped when the outbound queue is full")
 
     @field_validator("password")
     def user_requires_pass(cls, v, info: ValidationInfo):
@@ -174,6 +211,328 @@ class DatabaseConfig(EdgeBaseModel):
         default="",
         title="Database Path",
         description="The path to the SQLite database file")
+    batch_size: int = Field(
+        default=100,
+        ge=1,
+        title="Batch Size",
+        description="The number of events written in a single transaction")
+    flush_interval: float = Field(
+        default=1.0,
+        gt=0,
+        title="Flush Interval",
+        description="The maximum time in seconds an event waits before being written")
+    max_queued: int = Field(
+        default=10000,
+        ge=1,
+        title="Max Queued Events",
+        description="The maximum number of events waiting to be written")
+    retain_days: float = Field(
+        default=30,
+        gt=0,
+        title="Retain Days",
+        description="The number of days events are kept in the database")
+    prune_chunk: int = Field(
+        default=500,
+        ge=1,
+        title="Prune Chunk",
+        description="The maximum number of events deleted in a single transaction")
+
+
+class LogLevelEnum(str, Enum):
+    debug = "debug"
+    info = "info"
+    warning = "warning"
+    error = "error"
+
+
+class LoggerConfig(EdgeBaseModel):
+    level: LogLevelEnum = Field(
+        default=LogLevelEnum.info,
+        title="Log Level",
+        description="The minimum level of the messages written to the log")
+
+
+class TracingConfig(EdgeBaseModel):
+    enabled: bool = Field(
+        default=False,
+        title="Enable Tracing",
+        description="Record the latency of sampled frames through the pipeline")
+    sample_rate: float = Field(
+        default=0.01,
+        gt=0,
+        le=1,
+        title="Sample Rate",
+        description="The fraction of the frames that are traced")
+    ring_size: int = Field(
+        default=256,
+        ge=1,
+        title="Ring Size",
+        description="The number of traces kept per camera")
+
+    @property
+    def sample_every(self) -> int:
+        return max(1, round(1 / self.sample_rate))
+
+
+class HttpConfig(EdgeBaseModel):
+    enabled: bool = Field(
+        default=True,
+        title="Enable HTTP server",
+        description="Serve the /metrics and /health endpoints")
+    host: str = Field(
+        default="127.0.0.1",
+        title="Host",
+        description="The address the HTTP server listens on, 0.0.0.0 for every interface")
+    port: int = Field(
+        default=9101,
+        title="Port",
+        description="The port the HTTP server listens on")
+
+
+class ProfilingConfig(EdgeBaseModel):
+    enabled: bool = Field(
+        default=False,
+        title="Enable Profiling",
+        description="Accept profiling requests on the /profile endpoint, which is not "
+                    "authenticated")
+    path: str = Field(
+        default="./profiles",
+        title="Profile Directory",
+        description="The directory the profiles are written to")
+    max_duration: float = Field(
+        default=60.0,
+        gt=0,
+        title="Max Duration",
+        description="The maximum duration in seconds of a single profile")
+    interval: float = Field(
+        default=0.005,
+        gt=0,
+        title="Sampling Interval",
+        description="The interval in seconds between two stack samples")
+
+
+class WatchdogConfig(EdgeBaseModel):
+    enabled: bool = Field(
+        default=True,
+        title="Enable Watchdog",
+        description="Restart the camera processes that stop making progress")
+    interval: float = Field(
+        default=1.0,
+        gt=0,
+        title="Check Interval",
+        description="The interval in seconds between two heartbeat checks")
+    stall_frames: int = Field(
+        default=10,
+        ge=1,
+        title="Stall Frames",
+        description="A stage is stalled after missing this many frames at the detect fps")
+    min_stall: float = Field(
+        default=2.0,
+        gt=0,
+        title="Minimum Stall",
+        description="The minimum time in seconds without progress before a stage is stalled")
+    overrun_ratio: float = Field(
+        default=2.0,
+        gt=1,
+        title="Overrun Ratio",
+        description="Capture is overrunning above this multiple of the detect fps")
+    overrun_window: float = Field(
+        default=5.0,
+        gt=0,
+        title="Overrun Window",
+        description="The time in seconds over which the capture rate is measured")
+    startup_grace: float = Field(
+        default=10.0,
+        ge=0,
+        title="Startup Grace",
+        description="The time in seconds a restarted process has before it is checked")
+    reset_after: float = Field(
+        default=60.0,
+        gt=0,
+        title="Reset After",
+        description="A stage healthy for this many seconds starts again from the mildest restart")
+
+
+class RestartConfig(EdgeBaseModel):
+    base_delay: float = Field(
+        default=0.1,
+        gt=0,
+        title="Base Delay",
+        description="The delay in seconds before the first restart of a crashed process")
+    max_delay: float = Field(
+        default=30.0,
+        gt=0,
+        title="Max Delay",
+        description="The delay in seconds between restarts of a process that keeps crashing")
+    reset_after: float = Field(
+        default=60.0,
+        gt=0,
+        title="Reset After",
+        description="A process up for this many seconds restarts after the base delay again")
+    stop_timeout: float = Field(
+        default=10.0,
+        gt=0,
+        title="Stop Timeout",
+        description="The time in seconds processes have to exit before they are killed")
+
+
+class LoadSheddingConfig(EdgeBaseModel):
+    enabled: bool = Field(
+        default=True,
+        title="Enable Load Shedding",
+        description="Degrade the cheapest cameras first when the box is saturated")
+    interval: float = Field(
+        default=2.0,
+        gt=0,
+        title="Check Interval",
+        description="The interval in seconds between two load checks")
+    cpu_high: float = Field(
+        default=0.9,
+        gt=0,
+        le=1,
+        title="High CPU",
+        description="The box is saturated above this fraction of busy CPU time")
+    cpu_low: float = Field(
+        default=0.7,
+        gt=0,
+        le=1,
+        title="Low CPU",
+        description="Shedding is undone below this fraction of busy CPU time")
+    max_skip_ratio: float = Field(
+        default=0.1,
+        gt=0,
+        le=1,
+        title="Max Skip Ratio",
+        description="A camera skipping more than this fraction of its frames is saturated")
+    max_busy: float = Field(
+        default=0.8,
+        gt=0,
+        le=1,
+        title="Max Detector Busy",
+        description="A camera whose detector spends more than this fraction "
+                    "of the time in motion detection is saturated")
+    escalate_after: int = Field(
+        default=2,
+        ge=1,
+        title="Escalate After",
+        description="The number of saturated checks in a row before shedding one more step")
+    restore_after: float = Field(
+        default=30.0,
+        gt=0,
+        title="Restore After",
+        description="The time in seconds with headroom before undoing one step")
+
+
+class DetectorModeEnum(str, Enum):
+    per_camera = "per_camera"
+    pool = "pool"
+
+
+class StartMethodEnum(str, Enum):
+    fork = "fork"
+    spawn = "spawn"
+    forkserver = "forkserver"
+
+
+class WorkersConfig(EdgeBaseModel):
+    mode: DetectorModeEnum = Field(
+        default=DetectorModeEnum.per_camera,
+        title="Detector Mode",
+        description="Run a motion detection process per camera, "
+                    "or a pool of motion workers each serving several cameras")
+    motion_workers: int = Field(
+        default=0,
+        ge=0,
+        title="Motion Workers",
+        description="The number of motion workers in the pool mode, one per CPU core when zero")
+    start_method: StartMethodEnum = Field(
+        default=StartMethodEnum.forkserver,
+        title="Start Method",
+        description="How the camera processes are started, the fork server has their "
+                    "modules preloaded. Changing it takes a restart of the edge")
+    share_decoders: bool = Field(
+        default=True,
+        title="Share Decoders",
+        description="Run a single FFmpeg for the cameras with the same input and decode "
+                    "arguments, its frames are scaled for each of them")
+
+
+class FramesConfig(EdgeBaseModel):
+    instance: str = Field(
+        default="edge",
+        pattern=r"^[A-Za-z0-9_-]+$",
+        title="Instance Name",
+        description="The prefix of the shared memory of the frames, it must differ "
+                    "between the edges of a box")
+    budget_mb: float = Field(
+        default=0,
+        ge=0,
+        title="Shared Memory Budget",
+        description="The megabytes of shared memory the frames of all the cameras may "
+                    "hold, the capturers drop frames past it. No limit when zero")
+    check_interval: float = Field(
+        default=1.0,
+        gt=0,
+        title="Check Interval",
+        description="The interval in seconds between two checks of the shared memory usage")
+    orphan_age: float = Field(
+        default=10.0,
+        gt=0,
+        title="Orphan Age",
+        description="The seconds after a camera process crashed at which the frames "
+                    "created before the crash are swept, those still queued are consumed by then")
+
+
+class PlacementModeEnum(str, Enum):
+    disabled = "disabled"
+    manual = "manual"
+    auto = "auto"
+
+
+class RolePlacementConfig(EdgeBaseModel):
+    cores: List[int] = Field(
+        default_factory=list,
+        title="Cores",
+        description="The CPU cores the processes of this role run on, all of them when empty")
+    nice: int = Field(
+        default=0,
+        ge=-20,
+        le=19,
+        title="Nice Level",
+        description="The scheduling niceness of the processes of this role")
+    weight: float = Field(
+        default=1.0,
+        gt=0,
+        title="Weight",
+        description="The share of a camera's cost the automatic placement gives this role")
+
+
+class FfmpegPlacementConfig(RolePlacementConfig):
+    threads: Optional[int] = Field(
+        default=None,
+        ge=1,
+        title="Threads",
+        description="The -threads budget of each FFmpeg, the number of its cores when empty")
+
+
+class PlacementConfig(EdgeBaseModel):
+    mode: PlacementModeEnum = Field(
+        default=PlacementModeEnum.disabled,
+        title="Placement Mode",
+        description="Leave scheduling to the OS, pin each role to its cores, "
+                    "or balance the cameras across the cores of each role")
+    capturer: RolePlacementConfig = Field(
+        default_factory=lambda: RolePlacementConfig(weight=0.1),
+        title="Capturer Placement",
+        description="The placement of the processes reading frames from FFmpeg")
+    detector: RolePlacementConfig = Field(
+        default_factory=lambda: RolePlacementConfig(weight=0.5),
+        title="Detector Placement",
+        description="The placement of the motion detection processes")
+    ffmpeg: FfmpegPlacementConfig = Field(
+        default_factory=FfmpegPlacementConfig,
+        title="FFmpeg Placement",
+        description="The placement of the FFmpeg decoders")
 
 
 class MotionConfig(EdgeBaseModel):
@@ -200,6 +559,93 @@ class MotionConfig(EdgeBaseModel):
     frame_height: Optional[int] = Field(default=100, title="Frame Height")
 
 
+class RecordConfig(EdgeBaseModel):
+    enabled: bool = Field(
+        default=False,
+        title="Enable Raw Recording",
+        description="Record the raw frames of the camera for a later replay")
+    path: str = Field(
+        default="./recordings",
+        title="Recording Directory",
+        description="The directory the recordings are written to")
+    max_frames: int = Field(
+        default=3000,
+        ge=1,
+        title="Max Frames",
+        description="The maximum number of frames in a single recording")
+
+
+class ReplayModeEnum(str, Enum):
+    realtime = "realtime"
+    fixed = "fixed"
+    fastest = "fastest"
+
+
+class ReplayConfig(EdgeBaseModel):
+    path: str = Field(
+        default="",
+        title="Recording Path",
+        description="Replay this raw recording instead of running FFmpeg")
+    mode: ReplayModeEnum = Field(
+        default=ReplayModeEnum.realtime,
+        title="Replay Mode",
+        description="Replay at the recorded speed, at a fixed rate or as fast as the detector consumes")
+    fps: float = Field(
+        default=5.0,
+        gt=0,
+        title="FPS",
+        description="The frames per second in the fixed replay mode")
+    loop: bool = Field(
+        default=True,
+        title="Loop",
+        description="Restart from the first frame at the end of the recording")
+
+
+class PyramidLevelEnum(str, Enum):
+    motion = "motion"
+    thumbnail = "thumbnail"
+
+
+class PyramidConfig(EdgeBaseModel):
+    enabled: bool = Field(
+        default=False,
+        title="Enable the Frame Pyramid",
+        description="Publish smaller copies of every frame after it in its shared memory, "
+                    "computed once by the capturer")
+    levels: List[PyramidLevelEnum] = Field(
+        default=[PyramidLevelEnum.motion, PyramidLevelEnum.thumbnail],
+        title="Levels",
+        description="The levels after the full frame: the motion detection frame at the "
+                    "motion frame height and a YUV 4:2:0 thumbnail")
+    thumbnail_height: int = Field(
+        default=120,
+        ge=16,
+        title="Thumbnail Height",
+        description="The height of the thumbnail, at most the detect height")
+
+
+class CameraSheddingConfig(EdgeBaseModel):
+    priority: int = Field(
+        default=0,
+        title="Priority",
+        description="Cameras with a lower priority are degraded first under load")
+    fps_divisor: int = Field(
+        default=2,
+        ge=1,
+        title="FPS Divisor",
+        description="The detection fps is divided by this once the camera is shed")
+    idle_fps: float = Field(
+        default=1.0,
+        gt=0,
+        title="Idle FPS",
+        description="The detection fps without motion once idle processing is paused")
+    motion_frame_height: int = Field(
+        default=50,
+        ge=10,
+        title="Motion Frame Height",
+        description="The motion detection frame height once its resolution is reduced")
+
+
 class CameraConfig(EdgeBaseModel):
     name: Optional[str] = Field(
         default=None,
@@ -229,6 +675,53 @@ class CameraConfig(EdgeBaseModel):
         default_factory=DetectConfig,
         title="Object detection configs"
     )
+    record: RecordConfig = Field(
+        default_factory=RecordConfig,
+        title="Raw Recording Configuration",
+        description="The raw frame recording configuration for the camera")
+    replay: ReplayConfig = Field(
+        default_factory=ReplayConfig,
+        title="Replay Configuration",
+        description="The raw frame replay configuration for the camera")
+    shedding: CameraSheddingConfig = Field(
+        default_factory=CameraSheddingConfig,
+        title="Load Shedding Configuration",
+        description="How the camera is degraded when the box is saturated")
+    pyramid: PyramidConfig = Field(
+        default_factory=PyramidConfig,
+        title="Frame Pyramid Configuration",
+        description="The smaller copies of the frames published with them")
+    colocated: bool = Field(
+        default=False,
+        title="Colocated Motion Detection",
+        description="Detect motion in a thread of the capturer process, the frames never "
+                    "leave it and only the events and the metrics are published")
+    # the probed stream of the source, set by the parent
+    _stream: Optional[dict] = PrivateAttr(default=None)
+    # the prefix of the shared memory of the frames, set by the parent
+    _frames_prefix: str = PrivateAttr(default="")
+
+    def use_frames_prefix(self, prefix: str) -> None:
+        self._frames_prefix = prefix
+
+    @property
+    def frames_prefix(self) -> str:
+        return self._frames_prefix
+
+    def use_stream(self, stream: Optional[dict]) -> None:
+        # Fills in a missing detect size with the aspect ratio of the stream
+        self._stream = stream
+        detect = self.detect
+        if detect.width and detect.height:
+            return
+        native = (stream["width"], stream["height"]) if stream else DEFAULT_DETECT_SIZE
+        if not detect.width and not detect.height:
+            detect.width, detect.height = native
+        elif not detect.width:
+            # the YUV 4:2:0 frames need even sizes
+            detect.width = round(detect.height * native[0] / native[1] / 2) * 2
+        else:
+            detect.height = round(detect.width * native[1] / native[0] / 2) * 2
 
     @property
     def frame_size(self):
@@ -252,7 +745,8 @@ class CameraConfig(EdgeBaseModel):
             extra_args=[],
             fps=self.detect.fps,
             width=self.detect.width,
-            height=self.detect.height
+            height=self.detect.height,
+            stream=self._stream
         )
         output_args = get_ffmpeg_argument_list(
             arg=input.ffmpeg.output_args,
@@ -339,6 +833,46 @@ class EdgeConfig(EdgeBaseModel):
         default_factory=DatabaseConfig,
         title="Database Configuration",
         description="The database configuration for the edge")
+    logger: LoggerConfig = Field(
+        default_factory=LoggerConfig,
+        title="Logger Configuration",
+        description="The logging configuration for the edge")
+    tracing: TracingConfig = Field(
+        default_factory=TracingConfig,
+        title="Tracing Configuration",
+        description="The per-frame latency tracing configuration")
+    http: HttpConfig = Field(
+        default_factory=HttpConfig,
+        title="HTTP Configuration",
+        description="The configuration of the metrics and health endpoints")
+    profiling: ProfilingConfig = Field(
+        default_factory=ProfilingConfig,
+        title="Profiling Configuration",
+        description="The on-demand profiling configuration")
+    watchdog: WatchdogConfig = Field(
+        default_factory=WatchdogConfig,
+        title="Watchdog Configuration",
+        description="The heartbeat watchdog configuration")
+    restart: RestartConfig = Field(
+        default_factory=RestartConfig,
+        title="Restart Configuration",
+        description="The restart policy of crashed camera processes")
+    placement: PlacementConfig = Field(
+        default_factory=PlacementConfig,
+        title="Placement Configuration",
+        description="The CPU placement policy of the camera processes")
+    load_shedding: LoadSheddingConfig = Field(
+        default_factory=LoadSheddingConfig,
+        title="Load Shedding Configuration",
+        description="The load shedding policy when the box is saturated")
+    workers: WorkersConfig = Field(
+        default_factory=WorkersConfig,
+        title="Workers Configuration",
+        description="How the motion detection of the cameras is spread over processes")
+    frames: FramesConfig = Field(
+        default_factory=FramesConfig,
+        title="Frames Configuration",
+        description="The shared memory of the frames")
     cameras: Dict[str, CameraConfig] = Field(
         default={},
         title="Cameras",
@@ -355,6 +889,8 @@ class EdgeConfig(EdgeBaseModel):
             if raw is None:
                 raise Exception("unable to read configuration file")
         if config_file.endswith(".yaml"):
+            # only the parent reads configuration files
+            from yaml import load, CLoader as Loader
             config = load(stream=raw, Loader=Loader)
             if config is None:
                 raise Exception("unable to read configuration file as YAML")
@@ -1,53 +1,34 @@
 from enum import Enum
+import fcntl
+import json
 import os
 import shlex
-from typing import Any, List, Optional, Self, Tuple
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Self, Tuple
 from loguru import logger
 import subprocess as sp
-import requests
 
 
-def vainfo_hwaccel(device_name: Optional[str] = None) -> sp.CompletedProcess:
+def vainfo_hwaccel(device_name: Optional[str] = None,
+                   vainfo: str = "vainfo",
+                   dri_dir: str = "/dev/dri",
+                   timeout: Optional[float] = None) -> sp.CompletedProcess:
     """Run vainfo."""
     ffprobe_cmd = (
-        ["vainfo"]
+        [vainfo]
         if not device_name
-        else ["vainfo", "--display", "drm", "--device", f"/dev/dri/{device_name}"]
+        else [vainfo, "--display", "drm", "--device", os.path.join(dri_dir, device_name)]
     )
-    return sp.run(ffprobe_cmd, capture_output=True)
+    return sp.run(ffprobe_cmd, capture_output=True, timeout=timeout)
 
 
 class LibvaGpuSelector:
     "Automatically selects the correct libva GPU."
 
-    _selected_gpu = None
-
     def get_selected_gpu(self) -> str:
-        """Get selected libva GPU."""
-        if not os.path.exists("/dev/dri"):
-            return ""
-
-        if self._selected_gpu:
-            return self._selected_gpu
-
-        devices = list(filter(lambda d: d.startswith(
-            "render"), os.listdir("/dev/dri")))
-
-        if len(devices) < 2:
-            self._selected_gpu = "/dev/dri/renderD128"
-            return self._selected_gpu
-
-        for device in devices:
-            check = vainfo_hwaccel(device_name=device)
-
-            logger.debug(
-                f"{device} return vainfo status code: {check.returncode}")
-
-            if check.returncode == 0:
-                self._selected_gpu = f"/dev/dri/{device}"
-                return self._selected_gpu
-
-        return ""
+        """Get selected libva GPU, as found by the cached hwaccel probe."""
+        return hwaccel_capabilities()["gpu"]
 
 
 class Parameters:
@@ -128,55 +109,55 @@ class HardwareAccelerationDecodeType(str, Enum):
 
 
 _gpu_selector = LibvaGpuSelector()
+# {3} is the libva GPU, only looked up when a preset needs it since the
+# lookup may run vainfo
 PRESET_HARDWARE_ACCEL_DECODE = {
-    HardwareAccelerationDecodeType.INTEL_QUICKSYNC_H264: f"-hwaccel qsv -qsv_device {_gpu_selector.get_selected_gpu()} -hwaccel_output_format qsv -c:v h264_qsv",
-    HardwareAccelerationDecodeType.VA_API: f"-hwaccel_flags allow_profile_mismatch -hwaccel vaapi -hwaccel_device {_gpu_selector.get_selected_gpu()} -hwaccel_output_format vaapi",
+    HardwareAccelerationDecodeType.INTEL_QUICKSYNC_H264: "-hwaccel qsv -qsv_device {3} -hwaccel_output_format qsv -c:v h264_qsv",
+    HardwareAccelerationDecodeType.VA_API: "-hwaccel_flags allow_profile_mismatch -hwaccel vaapi -hwaccel_device {3} -hwaccel_output_format vaapi",
     HardwareAccelerationDecodeType.NVIDIA_CUDA: "-hwaccel cuda -hwaccel_output_format cuda",
 }
 
 
+def _decode_preset(args: Any) -> Optional[HardwareAccelerationDecodeType]:
+    # The decode preset FFmpeg runs with, None when it decodes in software.
+    # The scale preset follows it, device filters need device frames.
+    if args == HWACCEL_AUTO:
+        key = _auto_preset()
+    elif not isinstance(args, str):
+        key = HardwareAccelerationDecodeType.VA_API
+    else:
+        key = HardwareAccelerationDecodeType.from_str(
+            inp=args, default=HardwareAccelerationDecodeType.VA_API)
+    # an empty device would swallow the next argument
+    if key is not None and "{3}" in PRESET_HARDWARE_ACCEL_DECODE[key] \
+            and not _gpu_selector.get_selected_gpu():
+        return None
+    return key
+
+
 def parse_preset_hardware_acceleration_decode(
         args: Any,
         extra_args: List[str],
         fps: int,
         width: int,
         height: int) -> List[str]:
-    if not isinstance(args, str):
-        scale = PRESET_HARDWARE_ACCEL_DECODE[HardwareAccelerationDecodeType.VA_API]
-    else:
-        key = HardwareAccelerationDecodeType.from_str(
-            inp=args, default=HardwareAccelerationDecodeType.VA_API)
-        scale = PRESET_HARDWARE_ACCEL_DECODE.get(key)
-    with_inputs = scale.format(fps, width, height).split(" ")
+    key = _decode_preset(args)
+    if key is None:
+        if args != HWACCEL_AUTO:
+            logger.warning("No libva GPU found, decoding in software")
+        return list(extra_args)
+    scale = PRESET_HARDWARE_ACCEL_DECODE[key]
+    gpu = _gpu_selector.get_selected_gpu() if "{3}" in scale else ""
+    with_inputs = scale.format(fps, width, height, gpu).split(" ")
     with_inputs.extend(extra_args)
     return with_inputs
 
 
 def autodetect_hwaccel() -> Tuple[HardwareAccelationScaleType, HardwareAccelerationDecodeType]:
-    try:
-        cuda = False
-        vaapi = False
-        resp = requests.get(
-            "http://127.0.0.1:1984/api/ffmpeg/hardware", timeout=3)
-
-        if resp.status_code == 200:
-            data: dict[str, list[dict[str, str]]] = resp.json()
-            for source in data.get("sources", []):
-                if "cuda" in source.get("url", "") and source.get("name") == "OK":
-                    cuda = True
-
-                if "vaapi" in source.get("url", "") and source.get("name") == "OK":
-                    vaapi = True
-    except requests.RequestException:
-        pass
-
-    if cuda:
-        logger.info("Automatically detected nvidia hwaccel for video decoding")
-        return (HardwareAccelationScaleType.NVIDIA_CUDA, HardwareAccelerationDecodeType.NVIDIA_CUDA)
-
-    if vaapi:
-        logger.info("Automatically detected vaapi hwaccel for video decoding")
-        return (HardwareAccelationScaleType.VA_API, HardwareAccelerationDecodeType.VA_API)
+    preferred = _auto_preset()
+    if preferred is not None:
+        logger.info(f"Automatically detected {preferred.value} hwaccel for video decoding")
+        return (HardwareAccelationScaleType(preferred.value), preferred)
 
     logger.warning(
         "Did not detect hwaccel, using a GPU for accelerated video decoding is highly recommended"
@@ -184,6 +165,337 @@ def autodetect_hwaccel() -> Tuple[HardwareAccelationScaleType, HardwareAccelerat
     return ""
 
 
+# hwaccel_args picking the first preset that works on this box
+HWACCEL_AUTO = "auto"
+HWACCEL_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "edge", "hwaccel.json")
+# the probed decode presets, from the most preferred
+PROBED_PRESETS = (
+    HardwareAccelerationDecodeType.NVIDIA_CUDA,
+    HardwareAccelerationDecodeType.VA_API,
+    HardwareAccelerationDecodeType.INTEL_QUICKSYNC_H264,
+)
+_SAMPLE_SHAPE = (5, 320, 240)
+
+
+class HwaccelProbe:
+    """
+    Finds out which decode presets work on this box, once.
+
+    Every preset is tried by decoding and scaling a short sample clip with
+    FFmpeg, the libva GPU is picked with vainfo like before. A preset is not
+    tried when its device nodes are missing, so a box without GPU falls back
+    to software decoding without running anything. The result is cached on
+    disk with a fingerprint of the devices, their drivers and the binaries,
+    and only probed again when the fingerprint changes. A lock file makes
+    concurrent processes wait for a single probe.
+    """
+
+    def __init__(self,
+                 cache_path: str = HWACCEL_CACHE,
+                 ffmpeg: str = "ffmpeg",
+                 vainfo: str = "vainfo",
+                 dri_dir: str = "/dev/dri",
+                 sys_dir: str = "/sys/class/drm",
+                 nvidia_device: str = "/dev/nvidia0",
+                 sample: Optional[str] = None,
+                 timeout: float = 5.0) -> None:
+        self.cache_path = cache_path
+        self.ffmpeg = ffmpeg
+        self.vainfo = vainfo
+        self.dri_dir = dri_dir
+        self.sys_dir = sys_dir
+        self.nvidia_device = nvidia_device
+        self.sample = sample
+        self.timeout = timeout
+
+    def render_devices(self) -> List[str]:
+        if not os.path.isdir(self.dri_dir):
+            return []
+        return sorted(d for d in os.listdir(self.dri_dir) if d.startswith("render"))
+
+    def _binary(self, name: str) -> Optional[List[Any]]:
+        path = shutil.which(name)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return [path, stat.st_size, stat.st_mtime]
+
+    def fingerprint(self) -> dict:
+        devices = {}
+        for device in self.render_devices():
+            base = os.path.join(self.sys_dir, device, "device")
+            ids = []
+            for name in ("vendor", "device"):
+                try:
+                    with open(os.path.join(base, name)) as f:
+                        ids.append(f.read().strip())
+                except OSError:
+                    ids.append(None)
+            driver = os.path.join(base, "driver")
+            devices[device] = [os.path.basename(os.path.realpath(driver))
+                               if os.path.exists(driver) else None] + ids
+        nvidia = None
+        try:
+            with open("/proc/driver/nvidia/version") as f:
+                nvidia = f.readline().strip()
+        except OSError:
+            pass
+        return {
+            "devices": devices,
+            "nvidia": nvidia if os.path.exists(self.nvidia_device) else None,
+            "ffmpeg": self._binary(self.ffmpeg),
+            "vainfo": self._binary(self.vainfo),
+        }
+
+    def select_gpu(self, devices: List[str]) -> str:
+        if not devices:
+            return ""
+        if len(devices) < 2:
+            return os.path.join(self.dri_dir, devices[0])
+        for device in devices:
+            try:
+                check = vainfo_hwaccel(device_name=device, vainfo=self.vainfo,
+                                       dri_dir=self.dri_dir, timeout=self.timeout)
+            except (OSError, sp.TimeoutExpired) as e:
+                logger.debug(f"vainfo failed for {device}: {e}")
+                continue
+            logger.debug(f"{device} return vainfo status code: {check.returncode}")
+            if check.returncode == 0:
+                return os.path.join(self.dri_dir, device)
+        return ""
+
+    def _run(self, cmd: List[str]) -> bool:
+        try:
+            return sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL, stdin=sp.DEVNULL,
+                          timeout=self.timeout).returncode == 0
+        except (OSError, sp.TimeoutExpired):
+            return False
+
+    def _sample_clip(self) -> Optional[str]:
+        if self.sample is not None:
+            return self.sample
+        path = os.path.join(os.path.dirname(self.cache_path), "hwaccel-sample.mp4")
+        if os.path.exists(path):
+            return path
+        fps, width, height = _SAMPLE_SHAPE
+        created = self._run([
+            self.ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}",
+            "-frames:v", str(fps * 2), "-c:v", "libx264", "-pix_fmt", "yuv420p", path])
+        return path if created else None
+
+    def _usable(self, preset: HardwareAccelerationDecodeType, gpu: str) -> bool:
+        if preset == HardwareAccelerationDecodeType.NVIDIA_CUDA:
+            return os.path.exists(self.nvidia_device)
+        return bool(gpu)
+
+    def probe(self) -> dict:
+        fingerprint = self.fingerprint()
+        gpu = self.select_gpu(self.render_devices())
+        decoders = {preset.value: False for preset in PROBED_PRESETS}
+        candidates = [p for p in PROBED_PRESETS if self._usable(p, gpu)]
+        sample = self._sample_clip() if candidates else None
+        fps, width, height = _SAMPLE_SHAPE
+        for preset in candidates if sample is not None else []:
+            decode = PRESET_HARDWARE_ACCEL_DECODE[preset].format(fps, width, height, gpu)
+            scale = PRESET_HARDWARE_ACCEL_SCALE[HardwareAccelationScaleType(preset.value)]
+            decoders[preset.value] = self._run(
+                [self.ffmpeg, "-hide_banner", "-loglevel", "error"]
+                + decode.split(" ") + ["-i", sample]
+                + scale.format(fps, width, height).split(" ")
+                + ["-frames:v", "3", "-f", "null", "-"])
+        preferred = next((p.value for p in PROBED_PRESETS if decoders[p.value]), None)
+        logger.info(f"HwaccelProbe: preferred decoding {preferred or 'software'}, "
+                    f"libva GPU {gpu or 'none'}, tried {[p.value for p in candidates]}")
+        return {"fingerprint": fingerprint, "gpu": gpu,
+                "decoders": decoders, "preferred": preferred}
+
+    def _read(self, fingerprint: dict) -> Optional[dict]:
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cached if cached.get("fingerprint") == fingerprint else None
+
+    def load(self) -> dict:
+        fingerprint = self.fingerprint()
+        cached = self._read(fingerprint)
+        if cached is not None:
+            return cached
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            lock = open(f"{self.cache_path}.lock", "w")
+        except OSError as e:
+            logger.warning(f"HwaccelProbe: unable to cache in {self.cache_path}: {e}")
+            return self.probe()
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # somebody else may have probed while waiting for the lock
+            cached = self._read(fingerprint)
+            if cached is not None:
+                return cached
+            result = self.probe()
+            try:
+                with open(f"{self.cache_path}.tmp", "w") as f:
+                    json.dump(result, f)
+                os.replace(f"{self.cache_path}.tmp", self.cache_path)
+            except OSError as e:
+                logger.warning(f"HwaccelProbe: unable to cache in {self.cache_path}: {e}")
+            return result
+
+
+_capabilities: Optional[dict] = None
+
+
+def hwaccel_capabilities(probe: Optional[HwaccelProbe] = None, refresh: bool = False) -> dict:
+    # Probed or read from the cache once per process
+    global _capabilities
+    if _capabilities is None or refresh:
+        _capabilities = (probe or HwaccelProbe()).load()
+    return _capabilities
+
+
+def _auto_preset() -> Optional[HardwareAccelerationDecodeType]:
+    preferred = hwaccel_capabilities()["preferred"]
+    return HardwareAccelerationDecodeType(preferred) if preferred else None
+
+
+def _frame_rate(rate: Optional[str]) -> Optional[float]:
+    try:
+        num, _, den = (rate or "").partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def probe_stream(path: str,
+                 input_args: List[str],
+                 ffprobe: str = "ffprobe",
+                 timeout: float = 10.0) -> Optional[dict]:
+    # The size and the frame rate of the first video stream of the source
+    cmd = ([ffprobe, "-v", "error"] + input_args +
+           ["-select_streams", "v:0",
+            "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate",
+            "-of", "json", path])
+    try:
+        result = sp.run(cmd, capture_output=True, timeout=timeout)
+        stream = json.loads(result.stdout)["streams"][0]
+        info = {"width": int(stream["width"]), "height": int(stream["height"])}
+    except (OSError, sp.TimeoutExpired, ValueError, KeyError, IndexError, TypeError) as e:
+        logger.warning(f"Unable to probe the stream of {path}: {e}")
+        return None
+    # avg_frame_rate is 0/0 for some RTSP streams
+    info["fps"] = _frame_rate(stream.get("avg_frame_rate")) or \
+        _frame_rate(stream.get("r_frame_rate"))
+    return info
+
+
+class StreamProber:
+    """
+    Probes the camera sources with ffprobe once and keeps the result.
+
+    Lives in the parent for as long as the edge runs, so reloads and
+    restarted capturers reuse the stream of a source instead of probing
+    it again. Failed probes are not kept and are tried again on the next
+    reload. The sources of a configuration are probed in parallel.
+    """
+
+    def __init__(self, ffprobe: str = "ffprobe", timeout: float = 10.0) -> None:
+        self.ffprobe = ffprobe
+        self.timeout = timeout
+        self.streams: Dict[Tuple[str, Tuple[str, ...]], dict] = {}
+
+    @staticmethod
+    def _key(camera: Any) -> Tuple[str, Tuple[str, ...]]:
+        input_args = get_ffmpeg_argument_list(
+            arg=parse_preset_input(args=camera.source.ffmpeg.input_args))
+        return camera.source.path, tuple(input_args)
+
+    def resolve(self, cameras: Dict[str, Any]) -> None:
+        # Hands every camera reading from FFmpeg the stream of its source
+        pending = {name: camera for name, camera in cameras.items()
+                   if camera.enabled and camera.source is not None
+                   and camera.source.path and not camera.replay.path}
+        keys = {name: self._key(camera) for name, camera in pending.items()}
+        missing = sorted({key for key in keys.values() if key not in self.streams})
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(8, len(missing))) as executor:
+                probed = executor.map(
+                    lambda key: probe_stream(key[0], list(key[1]), self.ffprobe, self.timeout),
+                    missing)
+                for key, stream in zip(missing, probed):
+                    if stream is not None:
+                        self.streams[key] = stream
+                        logger.info(f"StreamProber: {key[0]} is {stream['width']}x"
+                                    f"{stream['height']} at {stream['fps'] or '?'} fps")
+        for name, camera in pending.items():
+            camera.use_stream(self.streams.get(keys[name]))
+
+
+def decoder_key(cmd: List[str]) -> Tuple[str, ...]:
+    # everything up to the input, what the cameras sharing a decoder agree on
+    return tuple(cmd[:cmd.index("-i") + 2])
+
+
+def share_decoders(cameras: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Groups the enabled cameras reading from FFmpeg whose input and decode
+    arguments are the same, but for the colocated ones that run their
+    detection in their capturer process. Returns the groups of more than one camera by
+    their first camera in name order, which runs the decoder of the group.
+    """
+    groups: Dict[Tuple[str, ...], List[str]] = {}
+    for name in sorted(cameras):
+        camera = cameras[name]
+        if not camera.enabled or camera.source is None or not camera.source.path \
+                or camera.replay.path or camera.source.backend != "ffmpeg" \
+                or camera.colocated:
+            continue
+        groups.setdefault(decoder_key(camera.ffmpeg_cmd), []).append(name)
+    return {names[0]: names for names in groups.values() if len(names) > 1}
+
+
+def shared_ffmpeg_cmd(cmds: List[List[str]], outputs: List[str]) -> List[str]:
+    """
+    Merges the commands of cameras sharing a decoder into a single FFmpeg.
+    The decoded frames are split into a branch per camera running the video
+    filters of its command, and written to the output of the camera with
+    the rest of its output arguments.
+    """
+    prefix = list(decoder_key(cmds[0]))
+    graph = [f"[0:v]split={len(cmds)}" + "".join(f"[s{i}]" for i in range(len(cmds)))]
+    mapped = []
+    for i, (cmd, output) in enumerate(zip(cmds, outputs)):
+        # without the trailing pipe: of the single camera command
+        args = cmd[len(prefix):-1]
+        filters = "null"
+        if "-vf" in args:
+            at = args.index("-vf")
+            filters = args[at + 1]
+            args = args[:at] + args[at + 2:]
+        graph.append(f"[s{i}]{filters}[o{i}]")
+        mapped += ["-map", f"[o{i}]"] + args + [output]
+    return prefix + ["-filter_complex", ";".join(graph)] + mapped
+
+
+def av_options(args: List[str]) -> Dict[str, str]:
+    # The input arguments of FFmpeg as the options of a demuxer opened in
+    # process, an option without a value is a flag set to 1
+    options = {}
+    i = 0
+    while i < len(args):
+        key = args[i].lstrip("-")
+        value = args[i + 1] if i + 1 < len(args) else None
+        if value is None or (value.startswith("-") and not value.lstrip("-").isdigit()):
+            options[key] = "1"
+            i += 1
+        else:
+            options[key] = value
+            i += 2
+    return options
+
+
 def get_ffmpeg_argument_list(arg: Any) -> List[str]:
     if isinstance(arg, list) is True:
         return arg
@@ -196,18 +508,41 @@ def parse_preset_hardware_acceleration_scale(
         extra_args: List[str],
         fps: int,
         width: int,
-        height: int) -> List[str]:
-    if not isinstance(args, str):
-        scale = PRESET_HARDWARE_ACCEL_SCALE[HardwareAccelationScaleType.DEFAULT]
+        height: int,
+        stream: Optional[dict] = None) -> List[str]:
+    if args == HWACCEL_AUTO:
+        # scaled on the device that decoded, on the CPU without one
+        preferred = _auto_preset()
+        key = HardwareAccelationScaleType(preferred.value) if preferred is not None \
+            else HardwareAccelationScaleType.DEFAULT
+    elif not isinstance(args, str):
+        key = HardwareAccelationScaleType.DEFAULT
     else:
         key = HardwareAccelationScaleType.from_str(
             inp=args, default=HardwareAccelationScaleType.DEFAULT)
-        scale = PRESET_HARDWARE_ACCEL_SCALE.get(key)
+    if key != HardwareAccelationScaleType.DEFAULT and _decode_preset(args) is None:
+        # decoded in software after all
+        key = HardwareAccelationScaleType.DEFAULT
+    if key == HardwareAccelationScaleType.DEFAULT and stream is not None:
+        # the device presets also download the frames, only the software
+        # filters can be left out when the stream already matches
+        return _software_scale(stream, fps, width, height) + list(extra_args)
+    scale = PRESET_HARDWARE_ACCEL_SCALE.get(key)
     with_inputs = scale.format(fps, width, height).split(" ")
     with_inputs.extend(extra_args)
     return with_inputs
 
 
+def _software_scale(stream: dict, fps: int, width: int, height: int) -> List[str]:
+    args, filters = [], []
+    if stream.get("fps") is None or abs(stream["fps"] - fps) > 0.01:
+        args = ["-r", str(fps)]
+        filters.append(f"fps={fps}")
+    if (stream["width"], stream["height"]) != (width, height):
+        filters.append(f"scale={width}:{height}")
+    return args + (["-vf", ",".join(filters)] if filters else [])
+
+
 def parse_preset_input(args: Any) -> List[str]:
     if not isinstance(args, str):
         return PresetsInputType.RTSP_GENERIC
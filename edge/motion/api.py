@@ -1,4 +1,12 @@
 from abc import ABC, abstractmethod
+from typing import Tuple
+
+
+def motion_frame_size(frame_shape: Tuple[int, int], frame_height: int) -> Tuple[int, int]:
+    # The (height, width) the frames are resized to for motion detection,
+    # scaled by the aspect ratio of the luma plane of the YUV 4:2:0 frame
+    height, width = frame_shape[0] * 2 // 3, frame_shape[1]
+    return frame_height, max(1, round(frame_height * width / height))
 
 
 class MotionDetectorAPI(ABC):
@@ -10,9 +18,14 @@ class MotionDetectorAPI(ABC):
         pass
 
     @abstractmethod
-    def detect(self, frame):
+    def detect(self, frame, motion_frame=None):
+        # motion_frame is the frame already resized by the capturer, if any
         pass
 
     @abstractmethod
     def stop(self):
         pass
+
+    def update_config(self, config):
+        # Applies a new configuration to the running detector
+        self.config = config
@@ -1,6 +1,6 @@
 import queue
 from typing import Tuple
-from edge.motion.api import MotionDetectorAPI
+from edge.motion.api import MotionDetectorAPI, motion_frame_size
 import multiprocessing as mp
 import signal
 from loguru import logger
@@ -26,19 +26,15 @@ class DefaultMotionDetector(MotionDetectorAPI):
             contrast_frame_history=50) -> None:
         self.name = name
         self.config = config
+        self.fps = fps
         self.frame_shape = frame_shape
         self.resize_factor = self.frame_shape[0] / config.frame_height
 
         logger.debug(f"Frame height: {config.frame_height}")
         logger.debug(f"Frame shape: {frame_shape}")
         logger.debug(f"Resize factor: {self.resize_factor}")
-        logger.debug(
-            f"Frame width: {config.frame_height * (self.frame_shape[0] // self.frame_shape[1])}")
-        # Resized frame size, scaled by the aspect ratio of the original frame
-        self.motion_frame_size = (
-            config.frame_height,
-            config.frame_height * (self.frame_shape[0] // self.frame_shape[1])
-        )
+        self.motion_frame_size = motion_frame_size(frame_shape, config.frame_height)
+        logger.debug(f"Frame width: {self.motion_frame_size[1]}")
         self.avg_frame = np.zeros(self.motion_frame_size, dtype=np.float32)
         self.motion_frame_count = 0
         self.frame_counter = 0
@@ -49,18 +45,22 @@ class DefaultMotionDetector(MotionDetectorAPI):
         self.contrast_values[:, 1:2] = 255
         self.contrast_values_index = 0
 
-    def detect(self, frame):
+    def detect(self, frame, motion_frame=None):
         motion_boxes = []
 
         if not self.config.enabled:
             return motion_boxes
 
-        gray = frame[0:self.frame_shape[0], 0:self.frame_shape[1]]
-        resized_frame = cv2.resize(
-            gray,
-            dsize=(self.motion_frame_size[1], self.motion_frame_size[0]),
-            interpolation=self.interpolation
-        )
+        # the motion level of the frame pyramid, unless shedding changed the size
+        if motion_frame is not None and motion_frame.shape == self.motion_frame_size:
+            resized_frame = motion_frame
+        else:
+            gray = frame[0:self.frame_shape[0], 0:self.frame_shape[1]]
+            resized_frame = cv2.resize(
+                gray,
+                dsize=(self.motion_frame_size[1], self.motion_frame_size[0]),
+                interpolation=self.interpolation
+            )
 
         resized_frame = gaussian_filter(
             resized_frame, sigma=1, radius=self.blur_radius)
@@ -126,5 +126,19 @@ class DefaultMotionDetector(MotionDetectorAPI):
             return motion_boxes
         return False
 
+    def update_config(self, config: MotionConfig) -> None:
+        # the background model only has to be rebuilt when its size changes
+        if config.frame_height != self.config.frame_height:
+            self.__init__(
+                frame_shape=self.frame_shape,
+                config=config,
+                fps=self.fps,
+                name=self.name,
+                blur_radius=self.blur_radius,
+                interpolation=self.interpolation,
+                contrast_frame_history=len(self.contrast_values))
+            return
+        self.config = config
+
     def stop(self):
         return
@@ -1,44 +1,79 @@
 import queue
 from loguru import logger
 import os
-from edge.capture import run_capturer
-from edge.video import run_camera_processor
+from edge.capture import run_capturer, run_shared_capturer
+from edge.video import run_camera_processor, run_motion_worker
 import multiprocessing as mp
 import signal
 import time
-import sys
+from multiprocessing.connection import wait
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
 from watchdog.observers import Observer
-from edge.utils.configs import ConfigChangeHandler
-from edge.config import EdgeConfig
-
-from hanging_threads import start_monitoring
-start_monitoring(seconds_frozen=10, test_interval=100)
+from typing import Dict, List, Optional, Set, Tuple
+from edge.utils.configs import (APPLY_CAPTURER, APPLY_DETECTOR, APPLY_FFMPEG,
+                                APPLY_LIVE, ConfigChannel, ConfigDiff)
+from edge.config import (CameraConfig, DecoderBackendEnum, DetectorModeEnum, EdgeConfig,
+                         PlacementModeEnum)
+from edge.ffmpeg import StreamProber, hwaccel_capabilities, share_decoders
+from edge.storage.sqlite import SqliteEventStore
+from edge.streams.pyav import disable_without_pyav
+from edge.utils.backoff import Backoff
+from edge.utils.frame import FrameMemory
+from edge.utils.metrics import ROLES, MetricsRegistry
+from edge.utils.placement import CameraPlacement, assign_workers, plan_placement
+from edge.utils.processes import camera_process, set_start_method
+from edge.utils.shedding import LoadShedder
+from edge.utils.trace import TraceRing
+from edge.comms.http import StatsServer
+from edge.stats import StatsCollector
+from edge.utils.logs import configure_logging
+from edge.utils.profiling import Profiler, check_mode, request_profile
+from edge.utils.watchdog import Watchdog
 
 DEFAULT_CONFIG_FILE = "./config.yaml"
+# cameras that can be added by a reload without restarting the others
+CAMERA_SPARE = 8
+
+
+class ConfigChangeHandler(FileSystemEventHandler):
+    # lives with the parent, the camera processes never import watchdog
+    def __init__(self, on_modified: any) -> None:
+        self._on_modified = on_modified
+        return
+
+    def on_modified(self, event: FileSystemEvent) -> None:
+        if event.is_directory:
+            return
+        if self._on_modified is not None:
+            self._on_modified(event.src_path)
 
 
 class EdgeProcessor:
     def __init__(self) -> None:
-        logger.remove()
-        logger.add(sys.stdout, colorize=False)
+        configure_logging()
+        self.event_store = None
+        self.stats_server = None
+        self.start_method = None
+        # kept across reloads, a source is only probed once
+        self.streams = StreamProber()
+        self.profiler = Profiler(name="edge")
+        self.profiler.install()
         return
 
     def start(self) -> None:
-        def on_exit():
-            logger.info("EdgeProcessor: Requested exiting")
-            self.stop()
-            logger.info("EdgeProcessor: Going to sys.exit")
-            sys.exit(0)
-
         self.configure()
 
+        self.init_wakeup()
         self.init_observers()
-        self.init_signaler(on_exit)
+        self.init_signaler()
+        self.start_observers()
 
         while not self.is_shutdown():
             self.reload_event.clear()
 
             self.read_configs()
+            self.init_storage()
+            self.init_stats_server()
 
             self.init_capturers()
             self.init_detectors()
@@ -46,35 +81,675 @@ class EdgeProcessor:
             self.start_capturers()
             self.start_detectors()
 
-            while not self.is_reload():
-                time.sleep(2)
+            # changes are applied in place until one needs everything restarted
+            while self.supervise() and self.reload_cameras():
+                pass
             self.reload()
 
+        logger.info("EdgeProcessor: Requested exiting")
+        self.stop_storage()
+        self.stop_stats_server()
         self.stop_observers()
         logger.info("Edge processor exited")
 
     def read_configs(self) -> None:
         self.configs = EdgeConfig.parse_file(config_file=DEFAULT_CONFIG_FILE)
+        disable_without_pyav(self.configs.cameras)
+        self.streams.resolve(self.configs.cameras)
+        configure_logging(level=self.configs.logger.level.value)
+        self.init_start_method()
+        self.init_hwaccel()
+        self.init_decoders()
         self.capturer_info = dict()
+        capacity = len(self.configs.cameras) + CAMERA_SPARE
+        self.metrics = MetricsRegistry(
+            cameras=list(self.configs.cameras), capacity=capacity)
+        self.init_frames()
+        self.traces = None
+        if self.configs.tracing.enabled:
+            self.traces = TraceRing(
+                cameras=list(self.configs.cameras),
+                ring_size=self.configs.tracing.ring_size,
+                sample_every=self.configs.tracing.sample_every,
+                capacity=capacity)
+        self.init_watchdog()
+        self.init_shedder()
+        self.init_placement()
+        self.backoffs: Dict[Tuple[str, str], Backoff] = {}
+        # (camera, role) of the crashed processes and when to restart them,
+        # motion workers go by their own name instead of a camera
+        self.pending_restarts: Dict[Tuple[str, str], float] = {}
+        self.init_workers()
 
         for name, config in self.configs.cameras.items():
-            self.capturer_info[name] = {
-                "camera_fps": mp.Value("d", 0.0),
-                "skipped_fps": mp.Value("d", 0.0),
-                "ffmpeg_pid": mp.Value("i", 0),
-                "frame_queue": mp.Queue(maxsize=2),
-                "capturer_process": None,
-                "detector_process": None,
-                "camera_config": config,
-                "detection_frame": mp.Value("d", 0.0)
+            self.capturer_info[name] = self._camera_info(config)
+
+    def _camera_info(self, config: CameraConfig) -> dict:
+        return {
+            "frame_queue": mp.Queue(maxsize=2),
+            "capturer_process": None,
+            "detector_process": None,
+            "capturer_channel": None,
+            "detector_channel": None,
+            "camera_config": config,
+        }
+
+    def init_frames(self) -> None:
+        config = self.configs.frames
+        self.frames = FrameMemory(
+            instance=config.instance,
+            metrics=self.metrics,
+            budget=int(config.budget_mb * 1024 * 1024),
+            orphan_age=config.orphan_age)
+        self._use_frames_prefix(self.configs)
+        # no camera process is running, whatever is left is from a previous run
+        self.frames.sweep()
+
+    def _use_frames_prefix(self, configs: EdgeConfig) -> None:
+        for camera in configs.cameras.values():
+            camera.use_frames_prefix(self.frames.prefix)
+
+    def _colocated(self, name: str) -> bool:
+        # the detection of the camera runs in its capturer process
+        return self.capturer_info[name]["camera_config"].colocated
+
+    def _detecting_process(self, name: str) -> Optional[mp.Process]:
+        info = self.capturer_info[name]
+        return info["capturer_process"] if self._colocated(name) else info["detector_process"]
+
+    def _process_cameras(self, name: str, role: str) -> List[str]:
+        # the cameras whose frames a process handles
+        if role == "capturer":
+            return self._decoder_group(name)
+        if self.pooled and name in self.workers:
+            return list(self.workers[name]["cameras"])
+        return [name]
+
+    def init_start_method(self) -> None:
+        # the queues and the events of the camera processes are bound to
+        # the start method, it is only chosen once before the first of them
+        method = self.configs.workers.start_method.value
+        if self.start_method is None:
+            set_start_method(method)
+            self.start_method = method
+            logger.info(f"EdgeProcessor: Starting camera processes with {method}")
+        elif method != self.start_method:
+            logger.warning(f"EdgeProcessor: Start method {method} is applied on the next "
+                           f"start, still using {self.start_method}")
+
+    def init_hwaccel(self) -> None:
+        # probed once here, the capturers and the reloads read the cache
+        if any(c.enabled and not c.replay.path and c.source.backend == DecoderBackendEnum.ffmpeg
+               for c in self.configs.cameras.values()):
+            hwaccel_capabilities()
+
+    def init_decoders(self) -> None:
+        # the cameras reading the same input are captured by the process of
+        # the first of them, from a single FFmpeg
+        self.decoders = self._share_decoders(self.configs)
+        self.decoder_of = {camera: leader
+                           for leader, cameras in self.decoders.items()
+                           for camera in cameras}
+        for leader, cameras in self.decoders.items():
+            logger.info(f"EdgeProcessor: {', '.join(cameras)} share the decoder of {leader}")
+
+    @staticmethod
+    def _share_decoders(configs: EdgeConfig) -> Dict[str, List[str]]:
+        if not configs.workers.share_decoders:
+            return {}
+        return share_decoders(configs.cameras)
+
+    def _decoder(self, name: str) -> str:
+        return self.decoder_of.get(name, name)
+
+    def _decoder_group(self, name: str) -> List[str]:
+        # every camera captured by the process of the camera, itself first
+        return self.decoders.get(self._decoder(name), [name])
+
+    def init_watchdog(self) -> None:
+        self.watchdog = None
+        if self.configs.watchdog.enabled:
+            self.watchdog = Watchdog(
+                metrics=self.metrics,
+                cameras=self.configs.cameras,
+                config=self.configs.watchdog)
+
+    @property
+    def pooled(self) -> bool:
+        return self.configs.workers.mode == DetectorModeEnum.pool
+
+    def init_workers(self) -> None:
+        self.workers: Dict[str, dict] = {}
+        self.worker_of: Dict[str, str] = {}
+        if not self.pooled:
+            return
+        count = self.configs.workers.motion_workers or os.cpu_count() or 1
+        for i in range(count):
+            self.workers[f"worker-{i}"] = {
+                "process": None,
+                "channel": None,
+                "cameras": [],
             }
 
+    def init_shedder(self) -> None:
+        self.shedder = None
+        if self.configs.load_shedding.enabled:
+            self.shedder = LoadShedder(
+                metrics=self.metrics,
+                cameras=self.configs.cameras,
+                config=self.configs.load_shedding)
+
+    def init_placement(self) -> None:
+        # processes started later, after a restart or a reload, follow
+        # the plan of the configuration they are started with
+        self.placements = plan_placement(
+            config=self.configs.placement, cameras=self.configs.cameras)
+        if self.configs.placement.mode != PlacementModeEnum.disabled:
+            for name, placement in self.placements.items():
+                logger.info(f"EdgeProcessor: Placement of {name}: {placement}")
+
+    def _placement(self, name: str) -> CameraPlacement:
+        return self.placements.get(name) or CameraPlacement()
+
+    def init_wakeup(self) -> None:
+        # written to by signal handlers and other threads to wake supervise()
+        self.wakeup_reader, self.wakeup_writer = os.pipe()
+        os.set_blocking(self.wakeup_reader, False)
+        os.set_blocking(self.wakeup_writer, False)
+
+    def wake(self) -> None:
+        try:
+            os.write(self.wakeup_writer, b"\0")
+        except BlockingIOError:
+            # already full of wake ups
+            pass
+
+    def supervise(self) -> bool:
+        # Sleeps until a camera process exits, a restart is due, the watchdog
+        # has to run, the configuration changes or a shutdown is requested.
+        # Returns True on a configuration change and False on shutdown.
+        next_check = time.monotonic() + self.configs.watchdog.interval
+        next_shed = time.monotonic() + self.configs.load_shedding.interval
+        next_frames = time.monotonic() + self.configs.frames.check_interval
+        while True:
+            if self.is_shutdown():
+                return False
+            if self.reload_event.is_set():
+                self.reload_event.clear()
+                return True
+            sentinels = {proc.sentinel: key
+                         for key, proc in self._supervised().items()
+                         if key not in self.pending_restarts}
+            deadline = min([next_check, next_shed, next_frames,
+                            *self.pending_restarts.values()])
+            ready = wait(list(sentinels) + [self.wakeup_reader],
+                         timeout=max(0.0, deadline - time.monotonic()))
+            for obj in ready:
+                if obj == self.wakeup_reader:
+                    try:
+                        os.read(self.wakeup_reader, 4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.on_process_exit(*sentinels[obj])
+            now = time.monotonic()
+            for key, due in list(self.pending_restarts.items()):
+                if due <= now:
+                    self.restart_process(*key)
+            if now >= next_check:
+                self.check_heartbeats()
+                next_check = now + self.configs.watchdog.interval
+            if now >= next_shed:
+                if self.shedder is not None:
+                    self.shedder.check(now)
+                next_shed = now + self.configs.load_shedding.interval
+            if now >= next_frames:
+                self.frames.check(self.capturer_info)
+                next_frames = now + self.configs.frames.check_interval
+
+    def _backoff(self, name: str, role: str) -> Backoff:
+        key = (name, role)
+        if key not in self.backoffs:
+            config = self.configs.restart
+            self.backoffs[key] = Backoff(
+                base=config.base_delay,
+                cap=config.max_delay,
+                reset_after=config.reset_after)
+        return self.backoffs[key]
+
+    def _supervised(self) -> Dict[Tuple[str, str], mp.Process]:
+        # every camera process, by the key its restarts are tracked with
+        procs = {}
+        for name, info in self.capturer_info.items():
+            if self._decoder(name) == name:
+                procs[(name, "capturer")] = info["capturer_process"]
+            if not self.pooled:
+                procs[(name, "detector")] = info["detector_process"]
+        for name, worker in self.workers.items():
+            procs[(name, "detector")] = worker["process"]
+        return {key: proc for key, proc in procs.items() if proc is not None}
+
+    def on_process_exit(self, name: str, role: str) -> None:
+        proc = self._supervised()[(name, role)]
+        # the sentinel fires before the child is reaped
+        proc.join(timeout=1.0)
+        delay = self._backoff(name, role).delay()
+        logger.error(f"EdgeProcessor: {role} of {name} exited with code "
+                     f"{proc.exitcode}, restarting in {delay:.2f}s")
+        self.pending_restarts[(name, role)] = time.monotonic() + delay
+        # it may have left frames behind
+        self.frames.crashed(self._process_cameras(name, role))
+
+    def reload_cameras(self) -> bool:
+        # Applies a new configuration to the cameras it concerns only,
+        # returns False when the whole pipeline has to be restarted
+        try:
+            configs = EdgeConfig.parse_file(config_file=DEFAULT_CONFIG_FILE)
+        except Exception as e:
+            logger.error(f"EdgeProcessor: Keeping the current configuration: {e}")
+            return True
+        disable_without_pyav(configs.cameras)
+        self.streams.resolve(configs.cameras)
+        self._use_frames_prefix(configs)
+        diff = ConfigDiff(self.configs, configs)
+        if diff.empty:
+            return True
+        if diff.full:
+            logger.info("EdgeProcessor: " + ", ".join(sorted(diff.sections)) +
+                        " changed, restarting all cameras")
+            return False
+        added = [n for n in configs.cameras if n not in self.capturer_info]
+        deleted = [n for n in self.capturer_info if n not in configs.cameras]
+        if len(added) > self.metrics.slots.count(None) + len(deleted):
+            logger.info("EdgeProcessor: No room for the new cameras, restarting all cameras")
+            return False
+        if self._share_decoders(configs) != self.decoders:
+            logger.info("EdgeProcessor: The shared decoders changed, restarting all cameras")
+            return False
+        if any(camera.colocated != self.capturer_info[name]["camera_config"].colocated
+               for name, camera in configs.cameras.items() if name in self.capturer_info):
+            logger.info("EdgeProcessor: The colocated cameras changed, restarting all cameras")
+            return False
+
+        self.configs = configs
+        self.init_placement()
+        for name in diff.removed:
+            self.stop_camera(name)
+        for name in deleted:
+            self.metrics.remove_camera(name)
+            if self.traces is not None:
+                self.traces.remove_camera(name)
+            if self.watchdog is not None:
+                self.watchdog.remove_camera(name)
+            del self.capturer_info[name]
+        for name in added:
+            self.metrics.add_camera(name)
+            if self.traces is not None:
+                self.traces.add_camera(name)
+            self.capturer_info[name] = self._camera_info(configs.cameras[name])
+        for name, camera in configs.cameras.items():
+            self.capturer_info[name]["camera_config"] = camera
+            if self.watchdog is not None:
+                self.watchdog.set_camera(name, camera)
+        if self.shedder is not None:
+            self.shedder.set_cameras(configs.cameras)
+        for name in diff.added:
+            self.start_camera(name)
+        for name, actions in diff.changed.items():
+            self.apply_camera_change(name, actions)
+        if self.pooled:
+            self.rebalance_workers()
+        self.apply_sections(diff.sections)
+        logger.info(f"EdgeProcessor: Configuration reloaded, {len(diff.added)} added, "
+                    f"{len(diff.removed)} removed, {len(diff.changed)} changed")
+        return True
+
+    def apply_camera_change(self, name: str, actions: Set[str]) -> None:
+        info = self.capturer_info[name]
+        camera = info["camera_config"]
+        logger.info(f"EdgeProcessor: Applying the new configuration of {name} "
+                    f"({', '.join(sorted(actions))})")
+        if APPLY_CAPTURER in actions:
+            self.restart_process(name, "capturer")
+        elif APPLY_FFMPEG in actions:
+            self.publish_capturer_config(name)
+        if APPLY_DETECTOR in actions and not (self._colocated(name) and APPLY_CAPTURER in actions):
+            self.restart_process(name, "detector")
+        elif APPLY_LIVE in actions:
+            self.publish_detector_config(name)
+
+    def publish_capturer_config(self, name: str) -> None:
+        info = self.capturer_info[name]
+        group = self._decoder_group(name)
+        if len(group) == 1:
+            info["capturer_channel"].publish(info["camera_config"])
+            return
+        # a shared decoder is rebuilt from the configurations of all its cameras
+        info["capturer_channel"].publish({
+            camera: self.capturer_info[camera]["camera_config"] for camera in group})
+
+    def publish_detector_config(self, name: str) -> None:
+        info = self.capturer_info[name]
+        if info["detector_channel"] is None:
+            return
+        if not self.pooled or self._colocated(name):
+            info["detector_channel"].publish(info["camera_config"])
+            return
+        # a worker takes the configurations of all its cameras at once
+        worker = self.workers[self.worker_of[name]]
+        info["detector_channel"].publish({
+            camera: self.capturer_info[camera]["camera_config"]
+            for camera in worker["cameras"]})
+
+    def apply_sections(self, sections: Set[str]) -> None:
+        # the sections that only concern the parent process
+        if "logger" in sections:
+            configure_logging(level=self.configs.logger.level.value)
+        if "http" in sections:
+            self.stop_stats_server()
+            self.init_stats_server()
+        if "load_shedding" in sections:
+            # the cameras go back to full quality until the new policy sheds again
+            if self.shedder is not None:
+                self.shedder.clear()
+            self.init_shedder()
+        if "watchdog" in sections:
+            self.init_watchdog()
+            for name in self.capturer_info:
+                if self.watchdog is not None:
+                    self.watchdog.started(name)
+
+    def start_camera(self, name: str) -> None:
+        # in the pool mode, the detection starts with the next rebalance
+        info = self.capturer_info[name]
+        camera = info["camera_config"]
+        roles = ("capturer",) if self.pooled or camera.colocated else ROLES
+        if self._decoder(name) != name:
+            # started with the first camera of its decoder
+            roles = roles[1:]
+        else:
+            info["capturer_process"] = self._capturer_process(name, camera)
+        if "detector" in roles:
+            info["detector_process"] = self._detector_process(name, camera)
+        for role in roles:
+            info[f"{role}_process"].start()
+            self._backoff(name, role).started()
+        if self.watchdog is not None:
+            self.watchdog.started(name)
+        logger.info(f"EdgeProcessor: Camera {name} started")
+
+    def stop_camera(self, name: str) -> None:
+        # in the pool mode, the worker lets go of the camera with the next rebalance
+        info = self.capturer_info[name]
+        roles = ("capturer",) if self.pooled else ROLES
+        terminate_processes(
+            [info[f"{role}_process"] for role in roles],
+            timeout=self.configs.restart.stop_timeout)
+        for role in ROLES:
+            info[f"{role}_process"] = None
+            info[f"{role}_channel"] = None
+            self.pending_restarts.pop((name, role), None)
+        self._drain_queue(name)
+        # the drained frames, and any a killed process held
+        self.frames.sweep([name])
+        logger.info(f"EdgeProcessor: Camera {name} stopped")
+
+    def _drain_queue(self, name: str) -> None:
+        q: mp.Queue = self.capturer_info[name]["frame_queue"]
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+
+    def _replace_queue(self, name: str) -> None:
+        # a process killed or crashed while holding the frame queue lock
+        # would block the next one forever, the queue must be replaced
+        logger.warning(f"EdgeProcessor: Replacing the frame queue of {name}")
+        info = self.capturer_info[name]
+        self._drain_queue(name)
+        info["frame_queue"].close()
+        info["frame_queue"] = mp.Queue(maxsize=2)
+
+    def rebalance_workers(self) -> None:
+        # Reassigns the running cameras to the motion workers by cost, and
+        # restarts only the workers whose cameras changed
+        cameras = {name: info["camera_config"]
+                   for name, info in self.capturer_info.items()
+                   if info["capturer_process"] is not None and not self._colocated(name)}
+        names = list(self.workers)
+        assignment = assign_workers(
+            cameras, len(names),
+            previous={c: names.index(w) for c, w in self.worker_of.items()})
+        changed = [name for name, cameras in zip(names, assignment)
+                   if cameras != self.workers[name]["cameras"]]
+        if not changed:
+            return
+        self.stop_workers(changed)
+        self.worker_of = {camera: name
+                          for name, cameras in zip(names, assignment)
+                          for camera in cameras}
+        for name, cameras in zip(names, assignment):
+            self.workers[name]["cameras"] = cameras
+        for name in changed:
+            self.start_worker(name)
+        logger.info(f"EdgeProcessor: Cameras rebalanced over {len(names)} motion workers, "
+                    f"{len(changed)} restarted")
+
+    def stop_workers(self, names: List[str]) -> None:
+        procs = [self.workers[name]["process"] for name in names]
+        terminate_processes(procs, timeout=self.configs.restart.stop_timeout)
+        stuck = []
+        for name, proc in zip(names, procs):
+            self.pending_restarts.pop((name, "detector"), None)
+            self.workers[name]["process"] = None
+            if proc is not None and proc.exitcode != 0:
+                stuck.extend(c for c in self.workers[name]["cameras"]
+                             if c in self.capturer_info)
+        if not stuck:
+            return
+        # any of their queues may be stuck, and with them the capturers
+        decoders = list(dict.fromkeys(self._decoder(camera) for camera in stuck))
+        terminate_processes(
+            [self.capturer_info[camera]["capturer_process"] for camera in decoders],
+            timeout=self.configs.restart.stop_timeout)
+        for camera in decoders:
+            self._restart_capturer(camera, replace_queue=True, restart_worker=False)
+        # the other cameras of their decoders moved to new queues as well
+        others = dict.fromkeys(self.worker_of[camera]
+                               for decoder in decoders
+                               for camera in self._decoder_group(decoder)
+                               if camera in self.worker_of and self.worker_of[camera] not in names)
+        for worker in others:
+            self.restart_worker(worker)
+
+    def start_worker(self, name: str) -> None:
+        worker = self.workers[name]
+        cameras = [c for c in worker["cameras"] if c in self.capturer_info]
+        worker["process"] = None
+        worker["channel"] = None
+        if not cameras:
+            return
+        channel = ConfigChannel()
+        proc = camera_process(
+            target=run_motion_worker,
+            name=f"detector:{name}",
+            args=(name,
+                  {c: self.capturer_info[c]["camera_config"] for c in cameras},
+                  {c: self.capturer_info[c]["frame_queue"] for c in cameras},
+                  self.metrics,
+                  self.event_store.events if self.event_store else None,
+                  self.traces,
+                  channel,
+                  self._placement(cameras[0])),
+            log_level=self.configs.logger.level.value)
+        proc.start()
+        worker["process"] = proc
+        worker["channel"] = channel
+        self._backoff(name, "detector").started()
+        for camera in cameras:
+            self.capturer_info[camera]["detector_process"] = proc
+            self.capturer_info[camera]["detector_channel"] = channel
+            if self.watchdog is not None:
+                self.watchdog.started(camera, "detect")
+        logger.info(f"EdgeProcessor: Motion worker {name} started for "
+                    f"{', '.join(cameras)} PID={proc.pid}")
+
+    def init_storage(self) -> None:
+        if self.event_store is not None or not self.configs.database.path:
+            return
+        self.event_store = SqliteEventStore(config=self.configs.database)
+        self.event_store.start()
+
+    def stop_storage(self) -> None:
+        if self.event_store is None:
+            return
+        self.event_store.stop()
+        self.event_store = None
+        logger.info("EdgeProcessor: Event store stopped")
+
+    def init_stats_server(self) -> None:
+        if self.stats_server is not None or not self.configs.http.enabled:
+            return
+        self.stats_server = StatsServer(
+            config=self.configs.http,
+            collector=StatsCollector(processor=self))
+        self.stats_server.start()
+
+    def stop_stats_server(self) -> None:
+        if self.stats_server is None:
+            return
+        self.stats_server.stop()
+        self.stats_server = None
+
+    def check_heartbeats(self) -> None:
+        if self.watchdog is None:
+            return
+        for name, info in self.capturer_info.items():
+            capturer = info["capturer_process"]
+            detector = self._detecting_process(name)
+            # processes that have exited are not stalled
+            if capturer is None or detector is None or \
+                    not capturer.is_alive() or not detector.is_alive():
+                continue
+            failure = self.watchdog.check(name)
+            if failure is not None:
+                self.recover(name, *failure)
+
+    def recover(self, name: str, stage: str, level: int) -> None:
+        # Escalates from restarting FFmpeg to restarting the whole camera
+        info = self.capturer_info[name]
+        if stage == "capture" and level == 1:
+            logger.warning(f"EdgeProcessor: Restarting FFmpeg for {name}")
+            os.kill(info["capturer_process"].pid, signal.SIGHUP)
+        elif stage == "capture" and level == 2:
+            self.restart_process(name, "capturer")
+        elif stage == "detect" and level == 1:
+            self.restart_process(name, "detector")
+        elif self._colocated(name):
+            self.restart_process(name, "capturer")
+        else:
+            self.restart_process(name, "detector")
+            self.restart_process(name, "capturer")
+
+    def restart_process(self, name: str, role: str) -> None:
+        # name is a camera, or a motion worker in the pool mode
+        if role == "detector" and name in self.capturer_info and self._colocated(name):
+            role = "capturer"
+        if self.pooled and role == "detector":
+            self.restart_worker(self.worker_of.get(name, name))
+            return
+        if self.pooled:
+            self._restart_capturer(name)
+            return
+        if role == "capturer":
+            name = self._decoder(name)
+        info = self.capturer_info[name]
+        old = info[f"{role}_process"]
+        logger.warning(f"EdgeProcessor: Restarting {role} for {name} PID={old.pid}")
+        self.pending_restarts.pop((name, role), None)
+        terminate_processes([old], timeout=self.configs.restart.stop_timeout)
+        if old.exitcode != 0:
+            # the capturer of a shared decoder may be stuck on any of its queues
+            group = self._decoder_group(name)
+            for camera in group:
+                self.stop_camera(camera)
+                self._replace_queue(camera)
+            for camera in group:
+                self.start_camera(camera)
+            return
+        camera = info["camera_config"]
+        proc = self._capturer_process(name, camera) if role == "capturer" \
+            else self._detector_process(name, camera)
+        info[f"{role}_process"] = proc
+        proc.start()
+        self._backoff(name, role).started()
+        if self.watchdog is not None:
+            stage = "capture" if role == "capturer" else "detect"
+            for camera in self._decoder_group(name) if role == "capturer" else [name]:
+                self.watchdog.started(camera, stage)
+        logger.info(f"EdgeProcessor: {role} restarted for {name} PID={proc.pid}")
+
+    def restart_worker(self, name: str) -> None:
+        logger.warning(f"EdgeProcessor: Restarting motion worker {name}")
+        self.stop_workers([name])
+        self.start_worker(name)
+
+    def _restart_capturer(self, name: str,
+                          replace_queue: bool = False,
+                          restart_worker: bool = True) -> None:
+        name = self._decoder(name)
+        group = self._decoder_group(name)
+        info = self.capturer_info[name]
+        old = info["capturer_process"]
+        self.pending_restarts.pop((name, "capturer"), None)
+        if old is not None:
+            logger.warning(f"EdgeProcessor: Restarting capturer for {name} PID={old.pid}")
+            terminate_processes([old], timeout=self.configs.restart.stop_timeout)
+        crashed = old is not None and old.exitcode != 0
+        if replace_queue or crashed:
+            for camera in group:
+                self._replace_queue(camera)
+        proc = self._capturer_process(name, info["camera_config"])
+        info["capturer_process"] = proc
+        proc.start()
+        self._backoff(name, "capturer").started()
+        if self.watchdog is not None:
+            for camera in group:
+                self.watchdog.started(camera, "capture")
+        logger.info(f"EdgeProcessor: capturer restarted for {name} PID={proc.pid}")
+        if crashed and restart_worker:
+            # the workers still read from the old queues
+            for worker in dict.fromkeys(self.worker_of[camera] for camera in group
+                                        if camera in self.worker_of):
+                self.restart_worker(worker)
+
+    def profile(self, camera: str, role: str, mode: str, duration: float) -> str:
+        if not self.configs.profiling.enabled:
+            raise ValueError("profiling is disabled")
+        if camera not in self.capturer_info:
+            raise KeyError(f"unknown camera {camera}")
+        proc = self._detecting_process(camera) if role == "detector" \
+            else self.capturer_info[camera]["capturer_process"]
+        if proc is None or not proc.is_alive():
+            raise ValueError(f"no running {role} process for {camera}")
+        # the capturers and the colocated detection run in threads
+        check_mode(mode, main_thread=role == "detector" and not self._colocated(camera))
+        return request_profile(
+            pid=proc.pid,
+            name=f"{role}:{camera}",
+            output_dir=self.configs.profiling.path,
+            mode=mode,
+            duration=min(duration, self.configs.profiling.max_duration),
+            interval=self.configs.profiling.interval)
+
     def init_observers(self) -> None:
         self.reload_event = mp.Event()
 
         def on_modified(src_path: str):
-            print(f"Config file {src_path} has been modified")
+            logger.info(f"Config file {src_path} has been modified")
             self.reload_event.set()
+            self.wake()
 
         handler = ConfigChangeHandler(
             on_modified=on_modified,
@@ -88,12 +763,12 @@ class EdgeProcessor:
     def start_observers(self) -> None:
         self.observer.start()
 
-    def init_signaler(self, handler: any) -> None:
+    def init_signaler(self) -> None:
         self.shutdown_event = mp.Event()
 
         def on_shutdown(_, __):
             self.shutdown_event.set()
-            handler()
+            self.wake()
 
         signal.signal(signal.SIGINT, on_shutdown)
         signal.signal(signal.SIGTERM, on_shutdown)
@@ -120,70 +795,117 @@ class EdgeProcessor:
             if not camera.enabled:
                 logger.info(f"Camera {name} is disabled, skipping")
                 continue
-            i = self.capturer_info[name]
-            proc = mp.Process(
-                target=run_capturer,
-                name=f"capturer:{name}",
-                args=(name, camera,
-                      i["frame_queue"],
-                      i["camera_fps"],
-                      i["skipped_fps"],
-                      i["ffmpeg_pid"])
-            )
-            proc.daemon = True
-            self.capturer_info[name]["capturer_process"] = proc
+            if self._decoder(name) != name:
+                continue
+            self.capturer_info[name]["capturer_process"] = \
+                self._capturer_process(name, camera)
             logger.info(f"Initialized capturer process {name}")
 
+    def _capturer_process(self, name: str, camera) -> mp.Process:
+        # every process gets its own channel, so it never sees stale updates
+        channel = ConfigChannel()
+        self.capturer_info[name]["capturer_channel"] = channel
+        group = self._decoder_group(name)
+        if len(group) > 1:
+            return self._shared_capturer_process(name, group, channel)
+        events = None
+        detector_channel = None
+        if camera.colocated:
+            detector_channel = ConfigChannel()
+            self.capturer_info[name]["detector_channel"] = detector_channel
+            events = self.event_store.events if self.event_store else None
+        return camera_process(
+            target=run_capturer,
+            name=f"capturer:{name}",
+            args=(name, camera,
+                  self.capturer_info[name]["frame_queue"],
+                  self.metrics,
+                  self.traces,
+                  channel,
+                  self._placement(name),
+                  events,
+                  detector_channel),
+            log_level=self.configs.logger.level.value)
+
+    def _shared_capturer_process(self, name: str, group: List[str],
+                                 channel: ConfigChannel) -> mp.Process:
+        proc = camera_process(
+            target=run_shared_capturer,
+            name=f"capturer:{name}",
+            args=(name,
+                  {c: self.capturer_info[c]["camera_config"] for c in group},
+                  {c: self.capturer_info[c]["frame_queue"] for c in group},
+                  self.metrics,
+                  self.traces,
+                  channel,
+                  self._placement(name)),
+            log_level=self.configs.logger.level.value)
+        for camera in group:
+            self.capturer_info[camera]["capturer_process"] = proc
+            self.capturer_info[camera]["capturer_channel"] = channel
+        return proc
+
     def init_detectors(self) -> None:
+        if self.pooled:
+            # the motion workers are started with the first rebalance
+            return
         for name, camera in self.configs.cameras.items():
             if not camera.enabled:
                 logger.info(f"Camera {name} is disabled, skipping detectors")
                 continue
-            i = self.capturer_info[name]
-            proc = mp.Process(
-                name=f"detector:{name}",
-                target=run_camera_processor,
-                args=(name, camera,
-                      i["frame_queue"],
-                      i["detection_frame"],
-                      i["camera_fps"],
-                      i["skipped_fps"])
-            )
-            proc.daemon = True
-            self.capturer_info[name]["detector_process"] = proc
+            if camera.colocated:
+                continue
+            self.capturer_info[name]["detector_process"] = \
+                self._detector_process(name, camera)
             logger.info(f"Initialized detector process {name}")
 
+    def _detector_process(self, name: str, camera) -> mp.Process:
+        channel = ConfigChannel()
+        self.capturer_info[name]["detector_channel"] = channel
+        return camera_process(
+            target=run_camera_processor,
+            name=f"detector:{name}",
+            args=(name, camera,
+                  self.capturer_info[name]["frame_queue"],
+                  self.metrics,
+                  self.event_store.events if self.event_store else None,
+                  self.traces,
+                  channel,
+                  self._placement(name)),
+            log_level=self.configs.logger.level.value)
+
     def start_capturers(self) -> None:
         for name, info in self.capturer_info.items():
             p = info["capturer_process"]
+            if p is None:
+                continue
+            if self.watchdog is not None:
+                self.watchdog.started(name)
+            if self._decoder(name) != name:
+                # started with the first camera of its decoder
+                continue
             p.start()
+            self._backoff(name, "capturer").started()
             logger.info(f"Capturer started for camera {name} PID={p.pid}")
 
     def start_detectors(self) -> None:
+        if self.pooled:
+            self.rebalance_workers()
+            return
         for name, info in self.capturer_info.items():
             p = info["detector_process"]
+            if p is None:
+                continue
             p.start()
+            self._backoff(name, "detector").started()
             logger.info(f"Detector started for camera {name} PID={p.pid}")
 
-    def stop_capturers(self) -> None:
-        for name, info in self.capturer_info.items():
-            p = info["capturer_process"]
-            p.terminate()
-            p.join()
-            logger.info(f"Capturer stopped for camera {name} PID={p.pid}")
-
-    def stop_detectors(self) -> None:
-        for name, info in self.capturer_info.items():
-            p = info["detector_process"]
-            p.terminate()
-            p.join()
-            logger.info(f"Detector stopped for camera {name} PID={p.pid}")
-        return
-
     def reload(self) -> None:
-        self.stop_capturers()
-        self.stop_detectors()
-
+        # every process is asked to stop at once, then waited for together
+        terminate_processes(
+            list(self._supervised().values()),
+            timeout=self.configs.restart.stop_timeout)
+        logger.info("EdgeProcessor: Camera processes stopped")
         self.stop()
 
     def stop(self) -> None:
@@ -206,8 +928,31 @@ class EdgeProcessor:
             if det_proc is not None:
                 logger.info(
                     f"EdgeProcessor: Waiting for detector process {name} to exit")
+        self.frames.sweep()
+        self.metrics.close()
+        if self.traces is not None:
+            self.traces.close()
+        logger.info("EdgeProcessor: Metrics registry released")
 
     def configure(self) -> None:
         if not os.path.exists(DEFAULT_CONFIG_FILE):
             raise FileNotFoundError(
                 f"Config file {DEFAULT_CONFIG_FILE} not found")
+
+
+def terminate_processes(procs: List[Optional[mp.Process]], timeout: float) -> None:
+    # Sends SIGTERM to all the processes and kills those still alive after timeout
+    procs = [p for p in procs if p is not None and p.pid is not None]
+    for p in procs:
+        if p.is_alive():
+            p.terminate()
+    deadline = time.monotonic() + timeout
+    pending = [p for p in procs if p.is_alive()]
+    while pending and time.monotonic() < deadline:
+        wait([p.sentinel for p in pending], timeout=deadline - time.monotonic())
+        pending = [p for p in pending if p.is_alive()]
+    for p in pending:
+        logger.warning(f"EdgeProcessor: {p.name} did not exit in time, killing PID={p.pid}")
+        p.kill()
+    for p in procs:
+        p.join()
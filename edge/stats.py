@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from edge.utils.metrics import HISTOGRAM_BUCKETS, STAGES
+
+SHM_PATH = "/dev/shm"
+STALE_FRAME_SECONDS = 20
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_process_stats(pid: int) -> Optional[Tuple[int, float]]:
+    # Returns (rss bytes, cpu seconds) straight from procfs, None if gone
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+    # the command name may contain spaces, the fields start after it
+    fields = raw[raw.rindex(b")") + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    rss = int(fields[21]) * _PAGE_SIZE
+    return rss, cpu
+
+
+def read_cpu_times(path: str = "/proc/stat") -> Optional[Tuple[int, int]]:
+    # Returns the (busy, total) clock ticks of all the CPUs since boot
+    try:
+        with open(path, "rb") as f:
+            # guest time is already part of the user time
+            fields = [int(v) for v in f.readline().split()[1:9]]
+    except (OSError, ValueError):
+        return None
+    # idle and iowait
+    idle = sum(fields[3:5])
+    return sum(fields) - idle, sum(fields)
+
+
+def read_shm_usage(path: str = SHM_PATH) -> Tuple[int, int]:
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return 0, 0
+    size = st.f_blocks * st.f_frsize
+    return size - st.f_bfree * st.f_frsize, size
+
+
+_BUCKET_LABELS = tuple("+Inf" if bound == float("inf") else repr(bound)
+                       for bound in HISTOGRAM_BUCKETS)
+
+
+class StatsCollector:
+    """
+    Renders the state of the pipeline in the Prometheus text format.
+
+    Everything is read from the parent process: the shared metrics registry,
+    the frame queues and procfs. The rendered output is cached for
+    `cache_ttl` seconds so that frequent scrapes share a single render.
+    """
+
+    def __init__(self, processor, cache_ttl: float = 1.0) -> None:
+        self.processor = processor
+        self.cache_ttl = cache_ttl
+        self.lock = threading.Lock()
+        self.cached: Optional[bytes] = None
+        self.cached_at = 0.0
+
+    def metrics(self) -> bytes:
+        with self.lock:
+            now = time.monotonic()
+            if self.cached is None or now - self.cached_at >= self.cache_ttl:
+                self.cached = self.render().encode()
+                self.cached_at = now
+            return self.cached
+
+    def health(self) -> Tuple[bool, Dict[str, dict]]:
+        now = time.time()
+        snapshot = self.processor.metrics.snapshot()
+        cameras = {}
+        for name, info in self.processor.capturer_info.items():
+            if not info["camera_config"].enabled:
+                continue
+            gauges = snapshot[name]["gauges"]
+            camera = {
+                "capturer": self._is_alive(info["capturer_process"]),
+                "detector": self._is_alive(
+                    info["capturer_process"] if info["camera_config"].colocated
+                    else info["detector_process"]),
+                "frame_age": round(now - gauges["frame_time"], 3)
+                if gauges["frame_time"] else None,
+            }
+            camera["healthy"] = camera["capturer"] and camera["detector"] \
+                and camera["frame_age"] is not None \
+                and camera["frame_age"] < STALE_FRAME_SECONDS
+            cameras[name] = camera
+        return all(c["healthy"] for c in cameras.values()), cameras
+
+    def render(self) -> str:
+        snapshot = self.processor.metrics.snapshot()
+        capturer_info = self.processor.capturer_info
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help: str) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        gauges = (
+            ("edge_camera_fps", "fps", "Frames read from FFmpeg per second"),
+            ("edge_camera_skipped_fps", "skipped_fps",
+             "Frames skipped per second because the detector is behind"),
+            ("edge_camera_detection_fps", "detection_fps",
+             "Frames processed by the detector per second"),
+        )
+        for metric, key, help in gauges:
+            family(metric, "gauge", help)
+            for camera, stats in snapshot.items():
+                lines.append(
+                    f'{metric}{{camera="{camera}"}} {stats["gauges"][key]}')
+
+        counters = (
+            ("edge_camera_frames_total", "frames", "Frames read from FFmpeg"),
+            ("edge_camera_skipped_frames_total", "skipped_frames",
+             "Frames dropped because the frame queue was full"),
+            ("edge_camera_read_errors_total", "read_errors",
+             "Errors reading frames from FFmpeg"),
+            ("edge_camera_decode_restarts_total", "decode_restarts",
+             "Restarts of the FFmpeg decoder"),
+            ("edge_camera_ffmpeg_corrupt_frames_total", "ffmpeg_corrupt_frames",
+             "Corrupt or concealed frames reported by FFmpeg"),
+            ("edge_camera_ffmpeg_reconnects_total", "ffmpeg_reconnects",
+             "Connection losses and timeouts reported by FFmpeg"),
+            ("edge_camera_ffmpeg_decode_errors_total", "ffmpeg_decode_errors",
+             "Decode errors reported by FFmpeg"),
+            ("edge_camera_keyframes_total", "keyframes",
+             "Keyframes captured, when decoding with PyAV"),
+            ("edge_camera_shm_dropped_frames_total", "shm_dropped_frames",
+             "Frames dropped over the shared memory budget or with it full"),
+            ("edge_camera_detected_frames_total", "detected_frames",
+             "Frames processed by the detector"),
+            ("edge_camera_shed_frames_total", "shed_frames",
+             "Frames the detector left out because of load shedding"),
+        )
+        for metric, key, help in counters:
+            family(metric, "counter", help)
+            for camera, stats in snapshot.items():
+                lines.append(
+                    f'{metric}{{camera="{camera}"}} {stats["counters"][key]}')
+
+        family("edge_camera_shed_level", "gauge",
+               "Load shedding actions applied to the camera, as bits: "
+               "1 lower fps, 2 idle pause, 4 lower motion resolution")
+        for camera, stats in snapshot.items():
+            lines.append(
+                f'edge_camera_shed_level{{camera="{camera}"}} {stats["gauges"]["shed_level"]}')
+        shedder = getattr(self.processor, "shedder", None)
+        if shedder is not None:
+            family("edge_shed_steps", "gauge", "Load shedding steps currently taken")
+            lines.append(f"edge_shed_steps {shedder.level}")
+            family("edge_shed_decisions_total", "counter",
+                   "Load shedding decisions, per camera, action and direction")
+            for (camera, action, direction), count in sorted(shedder.decisions.items()):
+                lines.append(
+                    f'edge_shed_decisions_total{{camera="{camera}",action="{action}",'
+                    f'direction="{direction}"}} {count}')
+
+        family("edge_camera_shm_bytes", "gauge",
+               "Shared memory held by the frames of the camera")
+        for camera, stats in snapshot.items():
+            lines.append(
+                f'edge_camera_shm_bytes{{camera="{camera}"}} {stats["gauges"]["shm_bytes"]}')
+        frames = getattr(self.processor, "frames", None)
+        if frames is not None:
+            family("edge_frames_shm_budget_bytes", "gauge",
+                   "Shared memory budget of the frames, 0 without one")
+            lines.append(f"edge_frames_shm_budget_bytes {frames.budget}")
+            family("edge_frames_swept_total", "counter",
+                   "Orphaned frames removed from the shared memory")
+            lines.append(f"edge_frames_swept_total {frames.swept}")
+
+        family("edge_camera_queue_depth", "gauge",
+               "Frames waiting in the queue between capturer and detector")
+        for camera, info in capturer_info.items():
+            try:
+                depth = info["frame_queue"].qsize()
+            except (NotImplementedError, OSError, ValueError):
+                continue
+            lines.append(f'edge_camera_queue_depth{{camera="{camera}"}} {depth}')
+
+        family("edge_stage_latency_seconds", "histogram",
+               "Latency of each pipeline stage")
+        for camera, stats in snapshot.items():
+            for stage in STAGES:
+                hist = stats["stages"][stage]
+                labels = f'camera="{camera}",stage="{stage}"'
+                for le, count in zip(_BUCKET_LABELS, hist["buckets"]):
+                    lines.append(
+                        f'edge_stage_latency_seconds_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(
+                    f"edge_stage_latency_seconds_sum{{{labels}}} {hist['sum']}")
+                lines.append(
+                    f"edge_stage_latency_seconds_count{{{labels}}} {hist['count']}")
+
+        processes = []
+        for camera, info in capturer_info.items():
+            for role in ("capturer", "detector"):
+                proc = info[f"{role}_process"]
+                if proc is not None and proc.pid is not None:
+                    processes.append((camera, role, proc.pid))
+            ffmpeg_pid = int(snapshot[camera]["gauges"]["ffmpeg_pid"])
+            if ffmpeg_pid:
+                processes.append((camera, "ffmpeg", ffmpeg_pid))
+        process_stats = [(camera, role, read_process_stats(pid))
+                         for camera, role, pid in processes]
+        process_stats.append(("", "main", read_process_stats(os.getpid())))
+
+        family("edge_process_resident_memory_bytes", "gauge",
+               "Resident memory of the pipeline processes")
+        for camera, role, stats in process_stats:
+            if stats is not None:
+                lines.append(
+                    f'edge_process_resident_memory_bytes{{camera="{camera}",process="{role}"}} {stats[0]}')
+        family("edge_process_cpu_seconds_total", "counter",
+               "CPU time used by the pipeline processes")
+        for camera, role, stats in process_stats:
+            if stats is not None:
+                lines.append(
+                    f'edge_process_cpu_seconds_total{{camera="{camera}",process="{role}"}} {stats[1]}')
+
+        used, size = read_shm_usage()
+        family("edge_shm_used_bytes", "gauge", f"Used space in {SHM_PATH}")
+        lines.append(f"edge_shm_used_bytes {used}")
+        family("edge_shm_size_bytes", "gauge", f"Total space in {SHM_PATH}")
+        lines.append(f"edge_shm_size_bytes {size}")
+        family("edge_metrics_shm_bytes", "gauge",
+               "Size of the shared metrics registry")
+        lines.append(f"edge_metrics_shm_bytes {self.processor.metrics.shm.size}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _is_alive(proc) -> bool:
+        try:
+            return proc is not None and proc.is_alive()
+        except (AssertionError, ValueError):
+            # not started yet or already closed
+            return False
+
@@ -0,0 +1,22 @@
+from abc import ABC, abstractmethod
+
+
+class EventStoreAPI(ABC):
+    """
+    Standard interface for the storage of the event history
+    """
+    @abstractmethod
+    def __init__(self) -> None:
+        pass
+
+    @abstractmethod
+    def put(self, event: dict) -> bool:
+        pass
+
+    @abstractmethod
+    def query(self, camera=None, label=None, after=None, limit=100):
+        pass
+
+    @abstractmethod
+    def stop(self):
+        pass
@@ -0,0 +1,187 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import multiprocessing as mp
+from typing import List, Optional
+from loguru import logger
+from edge.config import DatabaseConfig
+from edge.storage.api import EventStoreAPI
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS events (
+        id TEXT PRIMARY KEY,
+        camera TEXT NOT NULL,
+        label TEXT NOT NULL,
+        start_time REAL NOT NULL,
+        end_time REAL,
+        score REAL,
+        data TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS events_camera_start ON events (camera, start_time)",
+    "CREATE INDEX IF NOT EXISTS events_label_start ON events (label, start_time)",
+    "CREATE INDEX IF NOT EXISTS events_start ON events (start_time)",
+]
+
+# The statements are kept constant so that sqlite3 reuses its prepared
+# statement cache instead of compiling them again on every batch
+UPSERT_EVENT = """INSERT INTO events (id, camera, label, start_time, end_time, score, data)
+    VALUES (:id, :camera, :label, :start_time, :end_time, :score, :data)
+    ON CONFLICT (id) DO UPDATE SET
+        end_time = excluded.end_time,
+        score = excluded.score,
+        data = excluded.data"""
+
+# The expired events are a range of the start time index, so a prune reads
+# at most a chunk of it and a single entry when nothing has expired
+PRUNE_EVENTS = """DELETE FROM events WHERE rowid IN (
+    SELECT rowid FROM events WHERE start_time < ? LIMIT ?)"""
+
+_STOP = None
+
+
+class SqliteEventStore(EventStoreAPI, threading.Thread):
+    # Writes events to SQLite from a dedicated thread. Producers only enqueue,
+    # the writer batches them into a single transaction per flush.
+    def __init__(self,
+                 config: DatabaseConfig,
+                 events: Optional[mp.Queue] = None,
+                 prune_interval: float = 60.0) -> None:
+        threading.Thread.__init__(self, name="storage:events")
+        self.daemon = True
+        self.config = config
+        self.path = config.path
+        self.events = events if events is not None \
+            else mp.Queue(maxsize=config.max_queued)
+        self.prune_interval = prune_interval
+        self.dropped = 0
+        self.written = 0
+        self.pruned = 0
+        self.ready = threading.Event()
+
+    def put(self, event: dict) -> bool:
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def run(self) -> None:
+        db = self._connect()
+        self.ready.set()
+        logger.info(f"Event store writing to {self.path}")
+        pending: List[dict] = []
+        deadline = time.monotonic() + self.config.flush_interval
+        next_prune = time.monotonic()
+        stopping = False
+        while not stopping:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                event = self.events.get(timeout=timeout)
+                while event is not _STOP:
+                    pending.append(event)
+                    if len(pending) >= self.config.batch_size:
+                        break
+                    event = self.events.get_nowait()
+                stopping = event is _STOP
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if len(pending) < self.config.batch_size and now < deadline \
+                    and not stopping:
+                continue
+            if pending:
+                self._flush(db, pending)
+                pending = []
+            deadline = now + self.config.flush_interval
+            if now >= next_prune and not stopping:
+                # a full chunk means there is more to delete on the next flush
+                if self._prune_chunk(db) < self.config.prune_chunk:
+                    next_prune = now + self.prune_interval
+        db.close()
+        logger.info("Event store stopped")
+
+    def stop(self) -> None:
+        self.events.put(_STOP)
+        self.join()
+
+    def query(self, camera=None, label=None, after=None, limit=100) -> List[dict]:
+        # WAL mode lets readers use their own connection next to the writer
+        clauses, params = [], []
+        if camera is not None:
+            clauses.append("camera = ?")
+            params.append(camera)
+        if label is not None:
+            clauses.append("label = ?")
+            params.append(label)
+        if after is not None:
+            clauses.append("start_time > ?")
+            params.append(after)
+        sql = "SELECT id, camera, label, start_time, end_time, score, data FROM events"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY start_time DESC LIMIT ?"
+        params.append(limit)
+        with sqlite3.connect(self.path) as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute(sql, params).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        # WAL with NORMAL only syncs on checkpoints, not on every commit
+        db.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            db.execute(statement)
+        return db
+
+    def _flush(self, db: sqlite3.Connection, pending: List[dict]) -> None:
+        rows = [self._to_row(event) for event in pending]
+        try:
+            db.execute("BEGIN")
+            db.executemany(UPSERT_EVENT, rows)
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            db.execute("ROLLBACK")
+            logger.error(f"Unable to write {len(rows)} events: {e}")
+            return
+        self.written += len(rows)
+
+    def _prune_chunk(self, db: sqlite3.Connection) -> int:
+        cutoff = time.time() - self.config.retain_days * 86400
+        try:
+            deleted = db.execute(
+                PRUNE_EVENTS, (cutoff, self.config.prune_chunk)).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Unable to prune events: {e}")
+            return 0
+        self.pruned += deleted
+        if deleted:
+            logger.debug(f"Pruned {deleted} events older than {cutoff}")
+        return deleted
+
+    @staticmethod
+    def _to_row(event: dict) -> dict:
+        return {
+            "id": event["id"],
+            "camera": event["camera"],
+            "label": event["label"],
+            "start_time": event["start_time"],
+            "end_time": event.get("end_time"),
+            "score": event.get("score"),
+            "data": json.dumps(event["data"]) if event.get("data") is not None else None,
+        }
+
+    @staticmethod
+    def _from_row(row: sqlite3.Row) -> dict:
+        event = dict(row)
+        if event["data"] is not None:
+            event["data"] = json.loads(event["data"])
+        return event
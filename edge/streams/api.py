@@ -18,3 +18,11 @@ class StreamProviderAPI(ABC):
     @abstractmethod
     def stop(self):
         pass
+
+    def restart(self):
+        # Restarts the source of the frames, if the provider has one
+        pass
+
+    def update_config(self, config):
+        # Applies a new camera configuration with the same frame shape
+        pass
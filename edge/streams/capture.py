@@ -1,4 +1,6 @@
+from edge.ffmpeg import shared_ffmpeg_cmd
 from edge.streams.ffmpeg import start_or_restart_ffmpeg, stop_ffmpeg
+import os
 import signal
 from edge.utils.events import EventsPerSecond
 from edge.streams.api import StreamProviderAPI
@@ -7,13 +9,20 @@ import multiprocessing as mp
 from loguru import logger
 import multiprocessing as mp
 import subprocess as sp
-from typing import Tuple
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
 import datetime
 import threading
 from edge.config import CameraConfig
 
-from edge.utils.frame import FrameManager, SharedMemoryFrameManager
+from edge.utils.backoff import Backoff
+from edge.utils.frame import FrameManager, SharedMemoryFrameManager, frame_name
+from edge.utils.logs import PeriodicSummary, RateLimitedLogger
+from edge.utils.metrics import CameraMetrics
+from edge.utils.placement import Placement
+from edge.utils.trace import CameraTrace
 from edge.utils.pipe import LogPipe
+from edge.utils.pyramid import FramePyramid, frame_pyramid
+from edge.streams.recording import FrameRecorder
 
 import queue
 
@@ -25,22 +34,33 @@ class FrameCollector():
                  source_name: str,
                  frame_shape: Tuple[int, int],
                  frame_queue: mp.Queue,
-                 fps: mp.Value,  # shared memory
+                 metrics: CameraMetrics,  # shared memory
                  frame_manager: FrameManager,
-                 skipped_fps: mp.Value,
-                 current_frame: mp.Value,
-                 stop_event: mp.Event) -> None:
+                 stop_event: mp.Event,
+                 trace: Optional[CameraTrace] = None,
+                 recorder: Optional[FrameRecorder] = None,
+                 output: Optional[BinaryIO] = None,
+                 pyramid: Optional[FramePyramid] = None) -> None:
         self.ffmpeg_process = ffmpeg_process
+        # the standard output of FFmpeg unless it writes several
+        if output is None and ffmpeg_process is not None:
+            output = ffmpeg_process.stdout
+        self.output = output
         self.source_name = source_name
         self.frame_size = frame_shape[0] * frame_shape[1]
+        # the segment of a frame has room for the levels of its pyramid
+        self.pyramid = pyramid
+        self.slot_size = pyramid.size if pyramid is not None else self.frame_size
         self.frame_queue = frame_queue
-        self.fps: mp.Value = fps
-        self.skipped_fps: mp.Value = skipped_fps
-        self.current_frame: mp.Event = current_frame
+        self.metrics = metrics
+        self.trace = trace
+        self.recorder = recorder
         self.stop_event = stop_event
         self.fm: FrameManager = frame_manager
-        self.frame_counter = EventsPerSecond(max_events=1000)
-        self.skipped_frame_counter = EventsPerSecond(max_events=1000)
+        self.frame_counter: EventsPerSecond = metrics.rate("fps")
+        self.skipped_frame_counter: EventsPerSecond = metrics.rate("skipped_fps")
+        self.summary = PeriodicSummary()
+        self.limiter = RateLimitedLogger()
         self.fc = 0
 
     def run(self) -> None:
@@ -48,44 +68,103 @@ class FrameCollector():
         self.frame_counter.start()
         self.skipped_frame_counter.start()
         while not self.stop_event.is_set():
-            self.fps.value = self.frame_counter.eps()
-            self.skipped_fps.value = self.skipped_frame_counter.eps()
-            self.current_frame.value = datetime.datetime.now().timestamp()
-            logger.info(f"FPS: {self.fps.value}")
-            logger.info(f"Frames: {self.fc}")
-
-            frame_name = f"{self.source_name}{self.current_frame.value}"
-            buffer = self.fm.create(name=frame_name, size=self.frame_size)
+            frame_time = datetime.datetime.now().timestamp()
+            self.metrics.set("frame_time", frame_time)
+            if self.summary.ready():
+                logger.info("{}: capturing {:.1f} fps, {} frames, {:.1f} skipped fps",
+                            self.source_name, self.frame_counter.eps(), self.fc,
+                            self.skipped_frame_counter.eps())
+
+            name = frame_name(self.source_name, frame_time)
+            start = time.monotonic()
             try:
-                buffer[:] = self.ffmpeg_process.stdout.read(self.frame_size)
+                data = self.output.read(self.frame_size)
+                if not data:
+                    # FFmpeg closed its output, it is exiting
+                    logger.error(f"FFmpeg output ended for {self.source_name}")
+                    break
+                buffer = self.create(name)
+                if buffer is None:
+                    # no shared memory for it, the frame is dropped
+                    continue
+                buffer[:self.frame_size] = data
             except Exception as e:
                 # shutdown has been initiated
                 if self.stop_event.is_set():
                     logger.info(
                         f"Frame collector exit requested for source {self.source_name}")
                     break
-                logger.error(
-                    f"Error reading frame from FFmpeg process for source {self.source_name}: {e}")
+                self.metrics.inc("read_errors")
+                self.limiter.error(
+                    "read", "Error reading frame from FFmpeg process for source {}: {}",
+                    self.source_name, e)
                 if self.ffmpeg_process.poll() is not None:
                     logger.error(
                         f"FFmpeg process has exited for {self.source_name}")
-                    self.fm.delete(name=frame_name)
+                    self.fm.delete(name=name)
                     break
                 # just a corrupted frame, skip it
+                self.fm.delete(name=name)
                 continue
-            self.frame_counter.update()
-            try:
-                self.frame_queue.put(obj=self.current_frame.value, block=False)
-                self.fm.close(name=frame_name)
-            except queue.Full:
-                logger.error(
-                    f"Error putting frame in queue for {self.source_name}")
-                self.skipped_frame_counter.update()
-                self.fm.delete(name=frame_name)
-            self.fc += 1
+            read = time.monotonic()
+            self.metrics.observe("read", read - start)
+            if self.recorder is not None:
+                self.recorder.write(frame_time, buffer[:self.frame_size])
+            self.publish(name, frame_time, read)
         logger.info(f"Frame collector exited for {self.source_name}")
         return
 
+    def create(self, name: str):
+        # The segment of a new frame, None when there is no shared memory for it
+        if isinstance(self.fm, SharedMemoryFrameManager) and self.metrics.get("shm_over_budget"):
+            self.metrics.inc("shm_dropped_frames")
+            return None
+        try:
+            return self.fm.create(name=name, size=self.slot_size)
+        except OSError as e:
+            self.metrics.inc("shm_dropped_frames")
+            self.limiter.error("shm", "Error creating frame {} in shared memory: {}", name, e)
+            return None
+
+    def publish(self, frame_name: str, frame_time: float, read: float,
+                block: bool = False) -> None:
+        # Hands a frame written to the frame store over to the detector
+        if self.pyramid is not None:
+            self.pyramid.build(self.fm.get(name=frame_name, shape=(self.slot_size,)))
+        self.frame_counter.update()
+        self.metrics.inc("frames")
+        self.metrics.beat("capture", read)
+        record = -1
+        if self.trace is not None and self.trace.sample():
+            record = self.trace.begin(frame_time, read)
+        try:
+            self._put(frame_time, block)
+            self.fm.close(name=frame_name)
+        except queue.Full:
+            self.limiter.error(
+                "queue", "Error putting frame in queue for {}", self.source_name)
+            self.skipped_frame_counter.update()
+            self.metrics.inc("skipped_frames")
+            self.fm.delete(name=frame_name)
+        published = time.monotonic()
+        self.metrics.observe("publish", published - read)
+        if record >= 0:
+            self.trace.mark(record, "published", published)
+        self.fc += 1
+
+    def _put(self, frame_time: float, block: bool) -> None:
+        if not block:
+            self.frame_queue.put(frame_time, block=False)
+            return
+        # wait for the detector, but never past a stop request
+        while True:
+            try:
+                self.frame_queue.put(frame_time, block=True, timeout=0.5)
+                return
+            except queue.Full:
+                if self.stop_event.is_set():
+                    raise
+
 
 class FrameCapturer(threading.Thread):
     # Runs the FrameCollector in a separate thread
@@ -94,20 +173,31 @@ class FrameCapturer(threading.Thread):
             source_name: str,
             frame_shape: Tuple[int, int],  # (width, height)
             frame_queue: mp.Queue,
-            fps: mp.Value,
+            metrics: CameraMetrics,
             ffmpeg_process: sp.Popen,
-            skipped_fps: mp.Value,
-            stop_event: mp.Event) -> None:
+            stop_event: mp.Event,
+            trace: Optional[CameraTrace] = None,
+            recorder: Optional[FrameRecorder] = None,
+            on_exit: Optional[Callable[[], None]] = None,
+            output: Optional[BinaryIO] = None,
+            pyramid: Optional[FramePyramid] = None,
+            frames_prefix: str = "",
+            frame_manager: Optional[FrameManager] = None) -> None:
         threading.Thread.__init__(self)
+        self.output = output
+        self.pyramid = pyramid
         self.source_name = source_name
+        self.on_exit = on_exit
         self.frame_shape = frame_shape
         self.frame_queue = frame_queue
-        self.fps: mp.Value = fps
-        self.fm = SharedMemoryFrameManager()
+        self.metrics = metrics
+        self.trace = trace
+        self.recorder = recorder
+        # the frames of a colocated camera are kept by its detection thread
+        self.owned = frame_manager is None
+        self.fm = SharedMemoryFrameManager(prefix=frames_prefix) if self.owned else frame_manager
         self.stop_event = stop_event
         self.ffmpeg_process = ffmpeg_process
-        self.current_frame: mp.Value = mp.Value('d', 0.0)
-        self.skipped_fps: mp.Value = skipped_fps
 
     def run(self) -> None:
         c = FrameCollector(
@@ -115,15 +205,23 @@ class FrameCapturer(threading.Thread):
             source_name=self.source_name,
             frame_shape=self.frame_shape,
             frame_queue=self.frame_queue,
-            fps=self.fps,
+            metrics=self.metrics,
             frame_manager=self.fm,
-            skipped_fps=self.skipped_fps,
-            current_frame=self.current_frame,
-            stop_event=self.stop_event
+            stop_event=self.stop_event,
+            trace=self.trace,
+            recorder=self.recorder,
+            output=self.output,
+            pyramid=self.pyramid
         )
-        c.run()
+        try:
+            c.run()
+        finally:
+            if self.on_exit is not None:
+                self.on_exit()
 
     def stop(self) -> None:
+        if not self.owned:
+            return
         self.fm.clean()
         logger.debug(f"FrameCapturer cleaed its SharedMemoryFrameManager")
 
@@ -133,102 +231,214 @@ class PreRecordedProvider(StreamProviderAPI, threading.Thread):
     # Initialize the Capturer thread
     def __init__(self,
                  source_name: str,
-                 camera_fps: mp.Value,
-                 skipped_fps: mp.Value,
+                 metrics: CameraMetrics,
                  stop_event: mp.Event,
-                 ffmpeg_pid: int,
                  configs: CameraConfig,
-                 frame_queue: mp.Queue) -> None:
+                 frame_queue: mp.Queue,
+                 trace: Optional[CameraTrace] = None,
+                 placement: Optional[Placement] = None,
+                 frame_manager: Optional[FrameManager] = None) -> None:
         threading.Thread.__init__(self)
         self.frame_queue = frame_queue
+        self.frame_manager = frame_manager
+        self.placement = placement
         self.source_name = source_name
-        self.camera_fps = camera_fps
-        self.skipped_fps = skipped_fps
+        self.metrics = metrics
+        self.trace = trace
         self.stop_event = stop_event
-        self.capturer_thread = None
         self.ffmpeg_provider_process = None
-        self.log_pipe = LogPipe(log_name=f"ffmpeg:{source_name}.provider")
-        self.ffmpeg_pid = ffmpeg_pid
+        self.log_pipe = LogPipe(log_name=f"ffmpeg:{source_name}.provider", metrics=[metrics])
         ##################################
         self.frame_shape = configs.frame_shape_yuv
         ##################################
         self.frame_size = self.frame_shape[0] * self.frame_shape[1]
         self.retry_interval = configs.source.ffmpeg.retry_interval
         self.configs = configs
+        # the cameras whose frames FFmpeg writes, in the order of its outputs
+        self.cameras: Dict[str, CameraConfig] = {source_name: configs}
+        self.frame_queues: Dict[str, mp.Queue] = {source_name: frame_queue}
+        self.camera_metrics: Dict[str, CameraMetrics] = {source_name: metrics}
+        self.traces: Dict[str, Optional[CameraTrace]] = {source_name: trace}
+        self.recorders: Dict[str, FrameRecorder] = {}
+        self.capturer_threads: List[FrameCapturer] = []
+        self.outputs: List[BinaryIO] = []
+        # set when a capturer thread exits, FFmpeg is restarted right away
+        # instead of with the next check
+        self.wakeup = threading.Event()
+        self.backoff = Backoff(cap=self.retry_interval)
 
     def run(self) -> None:
         logger.info("PreRecordedProvider: Starting")
+        for name, config in self.cameras.items():
+            if config.record.enabled:
+                self.recorders[name] = FrameRecorder(
+                    path=os.path.join(
+                        config.record.path, f"{name}-{int(time.time())}.raw"),
+                    frame_shape=config.frame_shape_yuv,
+                    max_frames=config.record.max_frames)
         self.start_ffmpeg()
 
-        time.sleep(self.retry_interval)
-        while not self.stop_event.wait(timeout=self.retry_interval):
-            now = datetime.datetime.now().timestamp()
-
-            if not self.capturer_thread.is_alive():
-                self.camera_fps.value = 0
-                logger.error(
-                    f"Capturer thread has unexpectedly stopped for {self.source_name}")
-                logger.error(
-                    "Displaying the last 100 lines of the FFmpeg log")
-                self.log_pipe.dump()
-                logger.info(f"Restarting FFmpeg for {self.source_name}")
-                self.start_ffmpeg()
-            elif now - self.capturer_thread.current_frame.value > 20:
-                self.camera_fps.value = 0
-                logger.error(
-                    f"Capturer thread has stopped producing frames for 20 seconds for {self.source_name}")
-                self.ffmpeg_provider_process.terminate()
-                try:
-                    logger.info("Waiting for FFmpeg process to finish")
-                    self.ffmpeg_provider_process.communicate(timeout=30)
-                except sp.TimeoutExpired:
-                    logger.info("Timeout expired, killing FFmpeg process")
-                    self.ffmpeg_provider_process.kill()
-                    self.ffmpeg_provider_process.communicate()
-            elif self.camera_fps.value >= 30 + 10:
-                self.camera_fps.value = 0
-                logger.error(
-                    f"Capturer thread is producing more than 40 frames per second for {self.source_name}")
-                self.ffmpeg_provider_process.terminate()
-                try:
-                    logger.info("Waiting for FFmpeg process to finish")
-                    self.ffmpeg_provider_process.communicate(timeout=30)
-                except sp.TimeoutExpired:
-                    logger.info("Timeout expired, killing FFmpeg process")
-                    self.ffmpeg_provider_process.kill()
-                    self.ffmpeg_provider_process.communicate()
-        
+        # stalls and overruns are detected by the watchdog of the parent
+        # process from the heartbeats, which calls restart()
+        while not self.stop_event.is_set():
+            # the threads are checked every time, the wakeup may come
+            # while the exiting thread is still alive
+            self.wakeup.wait(timeout=1.0)
+            self.wakeup.clear()
+            if self.stop_event.is_set() or self.capturing():
+                continue
+            for metrics in self.camera_metrics.values():
+                metrics.rate("fps").reset()
+            logger.error(
+                f"Capturer thread has unexpectedly stopped for {self.source_name}")
+            logger.error(
+                "Displaying the last lines of the FFmpeg log since the previous restart")
+            self.log_pipe.dump()
+            delay = self.backoff.delay()
+            logger.info(f"Restarting FFmpeg for {self.source_name} in {delay:.2f}s")
+            if self.stop_event.wait(timeout=delay):
+                break
+            self.start_ffmpeg()
+
         self.stop()
 
+    def capturing(self) -> bool:
+        if all(thread.is_alive() for thread in self.capturer_threads):
+            return True
+        # FFmpeg writes all the outputs, once one of them ends the others follow
+        self.ffmpeg_provider_process.terminate()
+        for thread in self.capturer_threads:
+            thread.join(timeout=5)
+        return False
+
+    def restart(self) -> None:
+        # the capturer thread exits with FFmpeg and run() starts a new one
+        if self.ffmpeg_provider_process is not None:
+            logger.info(f"Restart requested, terminating FFmpeg for {self.source_name}")
+            self.ffmpeg_provider_process.terminate()
+
+    def update_config(self, configs: CameraConfig) -> None:
+        # the next FFmpeg is started with the command of the new configuration
+        self.configs = configs
+        self.cameras[self.source_name] = configs
+        if configs.source is not None:
+            self.retry_interval = configs.source.ffmpeg.retry_interval
+            self.backoff.cap = self.retry_interval
+        self.restart()
+
+    def ffmpeg_command(self) -> Tuple[List[str], List[Tuple[int, int]]]:
+        # the command and the (read, write) pipes of the outputs after the first
+        return self.configs.ffmpeg_cmd, []
+
     def start_ffmpeg(self) -> None:
         logger.info(f"Starting FFmpeg for {self.source_name}")
-        ffmpeg_cmd = self.configs.ffmpeg_cmd
+        restarted = self.ffmpeg_provider_process is not None
+        self.close_outputs()
+        ffmpeg_cmd, pipes = self.ffmpeg_command()
         self.ffmpeg_provider_process = start_or_restart_ffmpeg(
             ffmpeg_cmd=ffmpeg_cmd,
             logger=logger,
             log_pipe=self.log_pipe,
-            frame_size=self.frame_size
+            frame_size=self.frame_size,
+            placement=self.placement,
+            pass_fds=[write for _, write in pipes]
         )
-        self.ffmpeg_pid = self.ffmpeg_provider_process.pid
-        self.capturer_thread = FrameCapturer(
-            source_name=self.source_name,
-            frame_shape=self.frame_shape,
-            frame_queue=self.frame_queue,
-            fps=self.camera_fps,
-            ffmpeg_process=self.ffmpeg_provider_process,
-            skipped_fps=self.skipped_fps,
-            stop_event=self.stop_event
-        )
-        self.capturer_thread.start()
-        logger.info(f"Started Capturer thread for {self.source_name}")
+        # FFmpeg holds the only writers, so the readers see its exit
+        for _, write in pipes:
+            os.close(write)
+        self.outputs = [self.ffmpeg_provider_process.stdout] + \
+            [os.fdopen(read, "rb") for read, _ in pipes]
+        self.backoff.started()
+        self.capturer_threads = []
+        for name, output in zip(self.cameras, self.outputs):
+            metrics = self.camera_metrics[name]
+            if restarted:
+                metrics.inc("decode_restarts")
+            metrics.set("ffmpeg_pid", self.ffmpeg_provider_process.pid)
+            thread = FrameCapturer(
+                source_name=name,
+                frame_shape=self.cameras[name].frame_shape_yuv,
+                frame_queue=self.frame_queues[name],
+                metrics=metrics,
+                ffmpeg_process=self.ffmpeg_provider_process,
+                stop_event=self.stop_event,
+                trace=self.traces[name],
+                recorder=self.recorders.get(name),
+                on_exit=self.wakeup.set,
+                output=output,
+                pyramid=frame_pyramid(self.cameras[name]),
+                frames_prefix=self.cameras[name].frames_prefix,
+                frame_manager=self.frame_manager
+            )
+            thread.start()
+            self.capturer_threads.append(thread)
+        logger.info(f"Started Capturer thread for {', '.join(self.cameras)}")
+
+    def close_outputs(self) -> None:
+        # the standard output is closed with its FFmpeg
+        for output in self.outputs[1:]:
+            output.close()
+        self.outputs = []
 
     def stop(self) -> None:
-        self.capturer_thread.stop()
-        while not self.frame_queue.empty():
-            self.frame_queue.get()
-            logger.info("Emptied frame queue")
-        self.log_pipe.close()
+        for frame_queue in self.frame_queues.values():
+            while not frame_queue.empty():
+                frame_queue.get()
+                logger.info("Emptied frame queue")
         stop_ffmpeg(
             logger=logger,
             ffmpeg_process=self.ffmpeg_provider_process)
+        self.log_pipe.close()
+        # FFmpeg is gone, so the capturers are no longer reading its outputs
+        # and their frames can be cleaned without racing them
+        for thread in self.capturer_threads:
+            thread.join(timeout=5)
+            thread.stop()
+        self.close_outputs()
+        for recorder in self.recorders.values():
+            recorder.close()
         logger.info("PreRecordedProvider stopped")
+
+
+class SharedDecoderProvider(PreRecordedProvider):
+    # Runs a single FFmpeg for the cameras with the same input and decode
+    # arguments, the first camera reads its standard output and the others
+    # a pipe each
+    def __init__(self,
+                 source_name: str,
+                 metrics: Dict[str, CameraMetrics],
+                 stop_event: mp.Event,
+                 configs: Dict[str, CameraConfig],
+                 frame_queues: Dict[str, mp.Queue],
+                 traces: Optional[Dict[str, CameraTrace]] = None,
+                 placement: Optional[Placement] = None) -> None:
+        traces = traces or {}
+        PreRecordedProvider.__init__(
+            self,
+            source_name=source_name,
+            metrics=metrics[source_name],
+            stop_event=stop_event,
+            configs=configs[source_name],
+            frame_queue=frame_queues[source_name],
+            trace=traces.get(source_name),
+            placement=placement)
+        self.cameras = dict(configs)
+        self.frame_queues = frame_queues
+        self.camera_metrics = metrics
+        self.traces = {name: traces.get(name) for name in configs}
+        # a corrupt frame of the decoder is one of every camera
+        self.log_pipe.metrics = list(metrics.values())
+
+    def update_config(self, configs: Dict[str, CameraConfig]) -> None:
+        # the configurations of all the cameras of the decoder
+        for name, config in configs.items():
+            if name in self.cameras:
+                self.cameras[name] = config
+        PreRecordedProvider.update_config(self, self.cameras[self.source_name])
+
+    def ffmpeg_command(self) -> Tuple[List[str], List[Tuple[int, int]]]:
+        pipes = [os.pipe() for _ in range(len(self.cameras) - 1)]
+        outputs = ["pipe:"] + [f"pipe:{write}" for _, write in pipes]
+        cmd = shared_ffmpeg_cmd(
+            [config.ffmpeg_cmd for config in self.cameras.values()], outputs)
+        return cmd, pipes
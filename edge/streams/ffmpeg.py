@@ -1,6 +1,9 @@
 import multiprocessing as mp
+import os
 import subprocess as sp
+from typing import Optional, Sequence
 from edge.utils.pipe import LogPipe
+from edge.utils.placement import Placement
 from loguru import logger
 
 
@@ -23,28 +26,45 @@ def start_or_restart_ffmpeg(
         logger,
         log_pipe: LogPipe,
         frame_size=None,
-        ffmpeg_process=None):
+        ffmpeg_process=None,
+        placement: Optional[Placement] = None,
+        pass_fds: Sequence[int] = ()):
     if ffmpeg_process is not None:
         ffmpeg_process = stop_ffmpeg(
             logger=logger, ffmpeg_process=ffmpeg_process)
 
+    popen = sp.Popen
+    if placement is not None:
+        ffmpeg_cmd = placement.ffmpeg_args(ffmpeg_cmd)
+        popen = placement.popen
     logger.info(f"Starting FFmpeg with command: {' '.join(ffmpeg_cmd)}")
+    stderr = log_pipe.open()
+    try:
+        return _popen(popen, ffmpeg_cmd, stderr, frame_size, pass_fds)
+    finally:
+        # FFmpeg holds the only writer, the collector sees it exit
+        os.close(stderr)
+
+
+def _popen(popen, ffmpeg_cmd, stderr: int, frame_size, pass_fds: Sequence[int]):
     if frame_size is None:
         # FFmpeg is probably not going to output any frames
-        process = sp.Popen(
+        process = popen(
             ffmpeg_cmd,
             stdout=sp.DEVNULL,
-            stderr=log_pipe,
+            stderr=stderr,
             stdin=sp.DEVNULL,
             start_new_session=True
         )
     else:
-        process = sp.Popen(
+        process = popen(
             ffmpeg_cmd,
             stdout=sp.PIPE,
-            stderr=log_pipe,
+            stderr=stderr,
             stdin=sp.DEVNULL,
             bufsize=frame_size * 10,
-            start_new_session=True
+            start_new_session=True,
+            # the outputs of a shared decoder after the first
+            pass_fds=pass_fds
         )
     return process
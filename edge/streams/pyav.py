@@ -0,0 +1,198 @@
+import datetime
+import importlib.util
+import multiprocessing as mp
+import os
+import threading
+import time
+from typing import Dict, Optional
+import numpy as np
+from loguru import logger
+from edge.config import CameraConfig
+from edge.ffmpeg import av_options, get_ffmpeg_argument_list, parse_preset_input
+from edge.streams.api import StreamProviderAPI
+from edge.streams.capture import FrameCollector
+from edge.streams.recording import FrameRecorder
+from edge.utils.backoff import Backoff
+from edge.utils.frame import FrameManager, SharedMemoryFrameManager, frame_name
+from edge.utils.metrics import CameraMetrics
+from edge.utils.pyramid import frame_pyramid
+from edge.utils.trace import CameraTrace
+
+
+def copy_planes(frame, buffer: memoryview, width: int, height: int) -> None:
+    # Copies the planes of a YUV420p frame into a raw frame like FFmpeg
+    # writes them, leaving out the padding at the end of their lines
+    out = np.frombuffer(buffer, dtype=np.uint8)
+    offset = 0
+    for plane, (plane_width, plane_height) in zip(
+            frame.planes, ((width, height), (width // 2, height // 2), (width // 2, height // 2))):
+        lines = np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size)
+        size = plane_width * plane_height
+        out[offset:offset + size].reshape(plane_height, plane_width)[:] = \
+            lines[:plane_height, :plane_width]
+        offset += size
+
+
+def disable_without_pyav(cameras: Dict[str, CameraConfig]) -> None:
+    # Disables the cameras decoding with PyAV when it is not installed,
+    # their capturers would otherwise exit on the import and be restarted
+    if importlib.util.find_spec("av") is not None:
+        return
+    for name, camera in cameras.items():
+        if camera.enabled and camera.source is not None and not camera.replay.path \
+                and camera.source.backend == "pyav":
+            logger.error(f"{name}: The pyav backend needs PyAV, see requirements.txt "
+                         f"(pip install av), disabling the camera")
+            camera.enabled = False
+
+
+class PyAVProvider(StreamProviderAPI, threading.Thread):
+    """
+    Decodes the source in-process with PyAV instead of an FFmpeg subprocess.
+
+    Frames are converted to YUV420p at the detect size by libswscale and
+    their planes copied straight into their shared memory segment, so no
+    frame crosses a pipe. The input presets of edge.ffmpeg are passed as
+    demuxer options, frames are dropped down to the detect fps by their
+    PTS, and the PTS and the keyframe flag of the last frame are kept and
+    published as metrics. Decoding is done in software.
+    """
+
+    def __init__(self,
+                 source_name: str,
+                 metrics: CameraMetrics,
+                 stop_event: mp.Event,
+                 configs: CameraConfig,
+                 frame_queue: mp.Queue,
+                 trace: Optional[CameraTrace] = None,
+                 frame_manager: Optional[FrameManager] = None) -> None:
+        threading.Thread.__init__(self)
+        self.source_name = source_name
+        self.metrics = metrics
+        self.stop_event = stop_event
+        self.frame_queue = frame_queue
+        self.configs = configs
+        self.frame_shape = configs.frame_shape_yuv
+        self.frame_size = self.frame_shape[0] * self.frame_shape[1]
+        self.fm = frame_manager or SharedMemoryFrameManager(prefix=configs.frames_prefix)
+        self.recorder = None
+        self.collector = FrameCollector(
+            ffmpeg_process=None,
+            source_name=source_name,
+            frame_shape=self.frame_shape,
+            frame_queue=frame_queue,
+            metrics=metrics,
+            frame_manager=self.fm,
+            stop_event=stop_event,
+            trace=trace,
+            pyramid=frame_pyramid(configs))
+        # set to leave the current container, it is opened again right away
+        self.reopen = threading.Event()
+        self.backoff = Backoff(cap=configs.source.ffmpeg.retry_interval)
+        self.pts: Optional[float] = None
+        self.keyframe = False
+
+    def run(self) -> None:
+        # PyAV is optional, only the cameras using it need it installed
+        import av
+
+        logger.info(f"PyAVProvider: Starting for {self.source_name}")
+        if self.configs.record.enabled:
+            self.recorder = FrameRecorder(
+                path=os.path.join(
+                    self.configs.record.path,
+                    f"{self.source_name}-{int(time.time())}.raw"),
+                frame_shape=self.frame_shape,
+                max_frames=self.configs.record.max_frames)
+        self.collector.frame_counter.start()
+        self.collector.skipped_frame_counter.start()
+        started = False
+        while not self.stop_event.is_set():
+            if started:
+                self.metrics.inc("decode_restarts")
+            started = True
+            try:
+                self.decode(av)
+            except av.FFmpegError as e:
+                logger.error(f"PyAVProvider: Decoding failed for {self.source_name}: {e}")
+            if self.stop_event.is_set():
+                break
+            if self.reopen.is_set():
+                self.reopen.clear()
+                continue
+            self.metrics.rate("fps").reset()
+            delay = self.backoff.delay()
+            logger.info(f"Reopening {self.configs.source.path} for {self.source_name} "
+                        f"in {delay:.2f}s")
+            if self.stop_event.wait(timeout=delay):
+                break
+        self.stop()
+
+    def decode(self, av) -> None:
+        input_args = get_ffmpeg_argument_list(
+            arg=parse_preset_input(args=self.configs.source.ffmpeg.input_args))
+        container = av.open(self.configs.source.path, options=av_options(input_args),
+                            timeout=self.configs.source.ffmpeg.retry_interval)
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            self.backoff.started()
+            interval = 1 / self.configs.detect.fps
+            next_pts = None
+            waiting = time.monotonic()
+            for frame in container.decode(stream):
+                if self.stop_event.is_set() or self.reopen.is_set():
+                    return
+                # the fps filter of the FFmpeg presets
+                pts = frame.time
+                if pts is not None and next_pts is not None and pts < next_pts:
+                    continue
+                if pts is not None:
+                    next_pts = pts + interval * 0.95
+                self.publish(frame, waiting)
+                waiting = time.monotonic()
+            logger.warning(f"PyAVProvider: {self.configs.source.path} ended for "
+                           f"{self.source_name}")
+        finally:
+            container.close()
+
+    def publish(self, frame, waiting: float) -> None:
+        width, height = self.configs.frame_shape
+        frame_time = datetime.datetime.now().timestamp()
+        self.metrics.set("frame_time", frame_time)
+        name = frame_name(self.source_name, frame_time)
+        buffer = self.collector.create(name)
+        if buffer is None:
+            return
+        copy_planes(frame.reformat(width=width, height=height, format="yuv420p"),
+                    buffer, width, height)
+        self.pts = frame.time
+        self.keyframe = frame.key_frame
+        if self.pts is not None:
+            self.metrics.set("frame_pts", self.pts)
+        if self.keyframe:
+            self.metrics.inc("keyframes")
+        # decoding included, what reading from the pipe of FFmpeg waits for
+        read = time.monotonic()
+        self.metrics.observe("read", read - waiting)
+        if self.recorder is not None:
+            self.recorder.write(frame_time, buffer[:self.frame_size])
+        self.collector.publish(name, frame_time, read)
+
+    def restart(self) -> None:
+        logger.info(f"Restart requested, reopening the source of {self.source_name}")
+        self.reopen.set()
+
+    def update_config(self, configs: CameraConfig) -> None:
+        # the frame shape is the same, the next container follows the rest
+        self.configs = configs
+        self.backoff.cap = configs.source.ffmpeg.retry_interval
+        self.restart()
+
+    def stop(self) -> None:
+        while not self.frame_queue.empty():
+            self.frame_queue.get()
+        self.fm.clean()
+        if self.recorder is not None:
+            self.recorder.close()
+        logger.info(f"PyAVProvider stopped for {self.source_name}")
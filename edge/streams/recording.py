@@ -0,0 +1,127 @@
+import mmap
+import os
+import struct
+from typing import Tuple
+from loguru import logger
+
+MAGIC = b"EDGERAW1"
+VERSION = 1
+# magic, version, rows, cols, record size, frame count
+HEADER = struct.Struct("<8sIIIIQ")
+HEADER_SIZE = 64
+# sequence number and the capture timestamp of the frame
+FRAME_HEADER = struct.Struct("<Qd")
+# frames start on a cache line
+ALIGNMENT = 64
+
+
+def record_size(frame_shape: Tuple[int, int]) -> int:
+    size = FRAME_HEADER.size + frame_shape[0] * frame_shape[1]
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class FrameRecorder:
+    """
+    Writes raw YUV420 frames and their capture timestamps into a preallocated,
+    memory-mapped file of fixed-size records, so recording a frame is a single
+    copy and the file can be replayed without decoding.
+    """
+
+    def __init__(self,
+                 path: str,
+                 frame_shape: Tuple[int, int],
+                 max_frames: int = 3000) -> None:
+        self.path = path
+        self.frame_shape = frame_shape
+        self.frame_size = frame_shape[0] * frame_shape[1]
+        self.record_size = record_size(frame_shape)
+        self.max_frames = max_frames
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "w+b")
+        self._file.truncate(HEADER_SIZE + max_frames * self.record_size)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        self._write_header()
+        logger.info(f"Recording raw frames to {path}")
+
+    def _write_header(self) -> None:
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, self.frame_shape[0],
+                         self.frame_shape[1], self.record_size, self.count)
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.max_frames
+
+    def write(self, frame_time: float, frame) -> bool:
+        if self._mm is None or self.full:
+            return False
+        offset = HEADER_SIZE + self.count * self.record_size
+        FRAME_HEADER.pack_into(self._mm, offset, self.count, frame_time)
+        start = offset + FRAME_HEADER.size
+        self._mm[start:start + self.frame_size] = frame
+        self.count += 1
+        self._write_header()
+        if self.full:
+            logger.info(f"Recording {self.path} is full with {self.count} frames")
+        return True
+
+    def close(self) -> None:
+        if self._mm is None:
+            return
+        self._mm.flush()
+        self._mm.close()
+        self._mm = None
+        # drop the preallocated records that were never written
+        self._file.truncate(HEADER_SIZE + self.count * self.record_size)
+        self._file.close()
+        logger.info(f"Recorded {self.count} frames to {self.path}")
+
+
+class RecordingReader:
+    # Read-only mapping of a recording, frames are views into the mapping
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rows, cols, size, count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a raw frame recording")
+        self.frame_shape = (rows, cols)
+        self.frame_size = rows * cols
+        self.record_size = size
+        # a recorder that did not close cleanly leaves preallocated records
+        available = (len(self._mm) - HEADER_SIZE) // size
+        self.count = min(count, available)
+        self._view = memoryview(self._mm)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def frame_time(self, index: int) -> float:
+        offset = HEADER_SIZE + index * self.record_size
+        return FRAME_HEADER.unpack_from(self._mm, offset)[1]
+
+    def frame(self, index: int) -> Tuple[float, memoryview]:
+        # the caller must release the view before the reader is closed
+        offset = HEADER_SIZE + index * self.record_size
+        start = offset + FRAME_HEADER.size
+        return (FRAME_HEADER.unpack_from(self._mm, offset)[1],
+                self._view[start:start + self.frame_size])
+
+    def read_into(self, index: int, buffer) -> float:
+        frame_time, view = self.frame(index)
+        buffer[:] = view
+        view.release()
+        return frame_time
+
+    def close(self) -> None:
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            self._file.close()
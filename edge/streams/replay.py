@@ -0,0 +1,119 @@
+import datetime
+import multiprocessing as mp
+import threading
+import time
+from typing import Optional
+from loguru import logger
+from edge.config import CameraConfig, ReplayModeEnum
+from edge.streams.api import StreamProviderAPI
+from edge.streams.capture import FrameCollector
+from edge.streams.recording import RecordingReader
+from edge.utils.frame import FrameManager, SharedMemoryFrameManager, frame_name
+from edge.utils.metrics import CameraMetrics
+from edge.utils.pyramid import frame_pyramid
+from edge.utils.trace import CameraTrace
+
+
+class ReplayProvider(StreamProviderAPI, threading.Thread):
+    """
+    Replays a raw frame recording into the frame store in place of FFmpeg.
+
+    Frames are copied from the memory-mapped recording into their shared
+    memory segment, nothing is decoded. That is one copy per frame, 3 MB
+    at 1080p or under a millisecond once the recording is in the page
+    cache, counted in the read stage. The detectors attach to the frames by
+    their segment name, so they cannot be handed the recording itself.
+    The realtime mode keeps the recorded spacing between frames, the fixed
+    mode replays at `fps` and the fastest mode waits for the detector
+    instead of skipping frames, so every recorded frame is processed
+    exactly once per pass.
+    """
+
+    def __init__(self,
+                 source_name: str,
+                 metrics: CameraMetrics,
+                 stop_event: mp.Event,
+                 configs: CameraConfig,
+                 frame_queue: mp.Queue,
+                 trace: Optional[CameraTrace] = None,
+                 frame_manager: Optional[FrameManager] = None) -> None:
+        threading.Thread.__init__(self)
+        self.source_name = source_name
+        self.metrics = metrics
+        self.stop_event = stop_event
+        self.frame_queue = frame_queue
+        self.replay = configs.replay
+        self.frame_shape = configs.frame_shape_yuv
+        self.frame_size = self.frame_shape[0] * self.frame_shape[1]
+        self.fm = frame_manager or SharedMemoryFrameManager(prefix=configs.frames_prefix)
+        self.collector = FrameCollector(
+            ffmpeg_process=None,
+            source_name=source_name,
+            frame_shape=self.frame_shape,
+            frame_queue=frame_queue,
+            metrics=metrics,
+            frame_manager=self.fm,
+            stop_event=stop_event,
+            trace=trace,
+            pyramid=frame_pyramid(configs))
+
+    def run(self) -> None:
+        reader = RecordingReader(self.replay.path)
+        try:
+            if reader.frame_shape != tuple(self.frame_shape):
+                raise ValueError(
+                    f"Recording {self.replay.path} has frame shape {reader.frame_shape}, "
+                    f"expected {tuple(self.frame_shape)} for {self.source_name}")
+            if len(reader) == 0:
+                raise ValueError(f"Recording {self.replay.path} has no frames")
+            logger.info(f"Replaying {len(reader)} frames from {self.replay.path} "
+                        f"for {self.source_name} in {self.replay.mode.value} mode")
+            self.collector.frame_counter.start()
+            self.collector.skipped_frame_counter.start()
+            while self._replay_once(reader) and self.replay.loop:
+                pass
+        finally:
+            reader.close()
+            self.stop()
+
+    def _replay_once(self, reader: RecordingReader) -> bool:
+        # returns False when a stop has been requested
+        mode = self.replay.mode
+        interval = 1 / self.replay.fps
+        first = reader.frame_time(0)
+        clock = time.monotonic()
+        for i in range(len(reader)):
+            if mode == ReplayModeEnum.realtime:
+                due = clock + reader.frame_time(i) - first
+            elif mode == ReplayModeEnum.fixed:
+                due = clock + i * interval
+            else:
+                due = 0
+            wait = due - time.monotonic()
+            if wait > 0 and self.stop_event.wait(timeout=wait):
+                return False
+            if self.stop_event.is_set():
+                return False
+
+            frame_time = datetime.datetime.now().timestamp()
+            self.metrics.set("frame_time", frame_time)
+            name = frame_name(self.source_name, frame_time)
+            start = time.monotonic()
+            buffer = self.collector.create(name)
+            if buffer is None:
+                if self.stop_event.is_set():
+                    return False
+                continue
+            # the one copy of the frame, from the page cache into the segment
+            reader.read_into(i, buffer[:self.frame_size])
+            read = time.monotonic()
+            self.metrics.observe("read", read - start)
+            self.collector.publish(
+                name, frame_time, read,
+                block=mode == ReplayModeEnum.fastest)
+        logger.info(f"Replay of {self.replay.path} finished a pass for {self.source_name}")
+        return True
+
+    def stop(self) -> None:
+        self.fm.clean()
+        logger.info(f"ReplayProvider stopped for {self.source_name}")
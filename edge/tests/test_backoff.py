@@ -0,0 +1,50 @@
+import multiprocessing as mp
+import signal
+import time
+import unittest
+from edge.run import terminate_processes
+from edge.utils.backoff import Backoff
+
+
+def _ignore_terminate():
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while True:
+        time.sleep(0.1)
+
+
+class TestBackoff(unittest.TestCase):
+    def test_grows_until_cap(self):
+        backoff = Backoff(base=0.1, cap=1.0, rng=lambda: 1.0)
+        backoff.started(now=0.0)
+        delays = [backoff.delay(now=1.0) for _ in range(6)]
+        self.assertEqual([round(d, 3) for d in delays], [0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+
+    def test_jitter_keeps_half_of_the_delay(self):
+        low = Backoff(base=1.0, rng=lambda: 0.0)
+        high = Backoff(base=1.0, rng=lambda: 0.999)
+        self.assertEqual(low.delay(now=0.0), 0.5)
+        self.assertLess(high.delay(now=0.0), 1.0)
+        self.assertGreaterEqual(Backoff(base=1.0).delay(now=0.0), 0.5)
+
+    def test_resets_after_staying_up(self):
+        backoff = Backoff(base=0.1, reset_after=60.0, rng=lambda: 1.0)
+        backoff.started(now=0.0)
+        for _ in range(4):
+            backoff.delay(now=1.0)
+        backoff.started(now=2.0)
+        # crashed again quickly, keeps growing
+        self.assertAlmostEqual(backoff.delay(now=3.0), 1.6)
+        backoff.started(now=10.0)
+        self.assertAlmostEqual(backoff.delay(now=70.0), 0.1)
+
+
+class TestTerminateProcesses(unittest.TestCase):
+    def test_kills_processes_ignoring_terminate(self):
+        proc = mp.Process(target=_ignore_terminate, daemon=True)
+        proc.start()
+        time.sleep(0.2)
+        start = time.monotonic()
+        terminate_processes([proc, None], timeout=0.5)
+        self.assertFalse(proc.is_alive())
+        self.assertEqual(proc.exitcode, -signal.SIGKILL)
+        self.assertLess(time.monotonic() - start, 5.0)
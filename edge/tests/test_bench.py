@@ -0,0 +1,73 @@
+import importlib.util
+import os
+import unittest
+from edge.bench.__main__ import compare
+from edge.bench.decode import run_decode
+from edge.bench.runner import Scenario, run_scenario
+from edge.bench.startup import run_startup
+from edge.bench.sources import synthetic_frames
+
+
+class TestBench(unittest.TestCase):
+    def test_synthetic_frames_are_yuv420(self):
+        frames = synthetic_frames(width=64, height=48, count=3)
+        self.assertEqual(len(frames), 3)
+        self.assertTrue(all(len(f) == 64 * 48 * 3 // 2 for f in frames))
+        self.assertNotEqual(frames[0], frames[1])
+
+    def test_scenario_runs_real_pipeline(self):
+        shm_before = set(os.listdir("/dev/shm"))
+        scenario = Scenario(source="synthetic", cameras=1, width=64, height=48,
+                            fps=20, duration=1.0, warmup=0.5)
+        result = run_scenario(scenario)
+        self.assertEqual(result["name"], "synthetic-1x64x48@20")
+        camera = result["per_camera"]["cam0"]
+        self.assertGreater(camera["fps"], 10)
+        self.assertGreater(camera["detection_fps"], 10)
+        self.assertIn("motion", camera["latency"])
+        self.assertEqual(set(os.listdir("/dev/shm")) - shm_before, set())
+
+    def test_scenario_with_motion_workers(self):
+        scenario = Scenario(source="synthetic", cameras=3, width=64, height=48,
+                            fps=10, duration=1.0, warmup=0.5, workers=2)
+        result = run_scenario(scenario)
+        self.assertEqual(result["name"], "synthetic-3x64x48@10-w2")
+        # three capturers and two workers instead of six processes
+        self.assertEqual(result["total"]["processes"], 5)
+        for camera in result["per_camera"].values():
+            self.assertGreater(camera["detection_fps"], 5)
+        self.assertGreater(result["total"]["pss_bytes"], 0)
+
+    def test_colocated_scenario(self):
+        scenario = Scenario(source="synthetic", cameras=1, width=64, height=48,
+                            fps=20, duration=1.0, warmup=0.5, colocated=True)
+        result = run_scenario(scenario)
+        self.assertEqual(result["name"], "synthetic-1x64x48@20-colocated")
+        # no detector process
+        self.assertEqual(result["total"]["processes"], 1)
+        camera = result["per_camera"]["cam0"]
+        self.assertGreater(camera["detection_fps"], 10)
+        self.assertIsNotNone(camera["handoff"])
+
+    def test_startup_reaches_the_first_frame(self):
+        result = run_startup(runs=1, methods=["forkserver"], timeout=5.0)
+        forkserver = result["methods"]["forkserver"]
+        self.assertLess(forkserver["first"], 5.0)
+        self.assertLess(forkserver["max"], 5.0)
+        self.assertGreater(result["import_time"], 0)
+
+    @unittest.skipIf(importlib.util.find_spec("av") is None, "PyAV is not installed")
+    def test_decode_in_process(self):
+        result = run_decode("pyav", duration=1.0, width=64, height=48)
+        self.assertGreater(result["frames"], 0)
+        self.assertGreater(result["cpu_ms_per_frame"], 0)
+        self.assertIsNotNone(result["read_latency"]["mean"])
+
+    def test_compare_reports_changes(self):
+        total = {"fps": 10, "detection_fps": 10, "skipped_fps": 0,
+                 "cpu_percent_per_camera": 20, "shm_peak_bytes": 100}
+        old = {"scenarios": [{"name": "a", "total": total}]}
+        new = {"scenarios": [{"name": "a", "total": dict(total, fps=20)}]}
+        lines = compare(old, new)
+        self.assertEqual(lines[0], "a")
+        self.assertTrue(any("fps" in line and "+100.0%" in line for line in lines))
@@ -0,0 +1,248 @@
+import multiprocessing as mp
+import os
+import stat
+import subprocess as sp
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import importlib.util
+import edge.ffmpeg
+from edge.config import CameraConfig
+from edge.ffmpeg import share_decoders
+from edge.streams.capture import PreRecordedProvider, SharedDecoderProvider
+from edge.streams.pyav import PyAVProvider, disable_without_pyav
+from edge.utils.frame import SharedMemoryFrameManager, frame_name
+from edge.utils.metrics import ROLE_CAPTURER, MetricsRegistry
+from edge.utils.pipe import LogPipe, log_collector
+
+# logs its arguments and writes a frame filled with 7 to every output, at the
+# size of the scale filter of its branch
+STUB_FFMPEG = """#!{python}
+import os, re, sys
+args = sys.argv[1:]
+with open({log!r}, "a") as f:
+    f.write(" ".join(args) + "\\n")
+graph = args[args.index("-filter_complex") + 1]
+sizes = [(int(w), int(h)) for w, h in re.findall(r"scale=(\\d+):(\\d+)", graph)]
+outputs = [arg for arg in args if arg.startswith("pipe:")]
+for (width, height), output in zip(sizes, outputs):
+    fd = int(output[5:] or 1)
+    os.write(fd, bytes([7]) * (width * height * 3 // 2))
+"""
+
+
+def _camera(width: int, height: int, path: str = "rtsp://camera", **kwargs) -> CameraConfig:
+    return CameraConfig(source={"path": path},
+                        detect={"width": width, "height": height, "fps": 5}, **kwargs)
+
+
+class NoWakeup(threading.Event):
+    # never set, the exits of the capturer threads go unnoticed
+    def set(self) -> None:
+        pass
+
+
+class TestSharedDecoders(unittest.TestCase):
+    def setUp(self) -> None:
+        # decoded in software
+        edge.ffmpeg._capabilities = {"gpu": "", "decoders": {}, "preferred": None}
+
+    def tearDown(self) -> None:
+        edge.ffmpeg._capabilities = None
+
+    def test_groups_the_cameras_of_an_input(self):
+        cameras = {"b": _camera(32, 16), "a": _camera(16, 8),
+                   "other": _camera(32, 16, "rtsp://other"),
+                   "off": _camera(32, 16, enabled=False),
+                   "colocated": _camera(32, 16, colocated=True),
+                   "mp4": CameraConfig(source={"path": "rtsp://camera", "ffmpeg": {
+                       "input_args": "mp4_generic"}}, detect={"width": 32, "height": 16})}
+        self.assertEqual(share_decoders(cameras), {"a": ["a", "b"]})
+
+    def test_fans_the_frames_out_to_every_camera(self):
+        with tempfile.TemporaryDirectory() as root:
+            log = os.path.join(root, "ffmpeg.log")
+            stub = os.path.join(root, "ffmpeg")
+            with open(stub, "w") as f:
+                f.write(STUB_FFMPEG.format(python=sys.executable, log=log))
+            os.chmod(stub, os.stat(stub).st_mode | stat.S_IXUSR)
+            path = os.environ["PATH"]
+            os.environ["PATH"] = root + os.pathsep + path
+            try:
+                frames = self._capture({"a": _camera(32, 16), "b": _camera(16, 8)})
+            finally:
+                os.environ["PATH"] = path
+            with open(log) as f:
+                cmd = f.readline().split()
+        self.assertEqual(cmd.count("-i"), 1)
+        self.assertEqual(cmd[cmd.index("-filter_complex") + 1],
+                         "[0:v]split=2[s0][s1];[s0]fps=5,scale=32:16[o0];"
+                         "[s1]fps=5,scale=16:8[o1]")
+        self.assertEqual(frames, {"a": 32 * 16 * 3 // 2, "b": 16 * 8 * 3 // 2})
+
+    def _capture(self, cameras: dict) -> dict:
+        registry = MetricsRegistry(cameras=list(cameras))
+        queues = {name: mp.Queue(maxsize=2) for name in cameras}
+        stop_event = mp.Event()
+        provider = SharedDecoderProvider(
+            source_name="a",
+            metrics={name: registry.camera(name, ROLE_CAPTURER) for name in cameras},
+            stop_event=stop_event,
+            configs=cameras,
+            frame_queues=queues)
+        provider.start()
+        fm = SharedMemoryFrameManager()
+        frames = {}
+        for name, frame_queue in queues.items():
+            frame_time = frame_queue.get(timeout=10)
+            shape = cameras[name].frame_shape_yuv
+            frame = fm.get(name=frame_name(name, frame_time), shape=shape)
+            self.assertEqual(int(frame[0, 0]), 7)
+            frames[name] = frame.size
+            fm.delete(name=frame_name(name, frame_time))
+        stop_event.set()
+        provider.join(timeout=10)
+        self.assertFalse(provider.is_alive())
+        registry.close()
+        return frames
+
+    def test_restarts_without_a_wakeup(self):
+        with tempfile.TemporaryDirectory() as root:
+            log = os.path.join(root, "ffmpeg.log")
+            stub = os.path.join(root, "ffmpeg")
+            with open(stub, "w") as f:
+                f.write(STUB_FFMPEG.format(python=sys.executable, log=log))
+            os.chmod(stub, os.stat(stub).st_mode | stat.S_IXUSR)
+            path = os.environ["PATH"]
+            os.environ["PATH"] = root + os.pathsep + path
+            registry = MetricsRegistry(cameras=["a"])
+            frame_queue = mp.Queue(maxsize=2)
+            stop_event = mp.Event()
+            provider = PreRecordedProvider(
+                source_name="a", metrics=registry.camera("a", ROLE_CAPTURER),
+                stop_event=stop_event, configs=_camera(32, 16), frame_queue=frame_queue)
+            # as if the wakeup came while the exiting thread was still alive
+            provider.wakeup = NoWakeup()
+            provider.start()
+            try:
+                deadline = time.monotonic() + 10
+                starts = 0
+                while starts < 2 and time.monotonic() < deadline:
+                    time.sleep(0.1)
+                    if os.path.exists(log):
+                        with open(log) as f:
+                            starts = len(f.readlines())
+            finally:
+                stop_event.set()
+                provider.join(timeout=10)
+                os.environ["PATH"] = path
+                frame_queue.close()
+                registry.close()
+        # FFmpeg exits after a frame and is started again
+        self.assertGreaterEqual(starts, 2)
+        self.assertFalse(provider.is_alive())
+
+
+class TestLogCollector(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry(cameras=["a", "b"])
+        self.pipes = {name: LogPipe(log_name=f"ffmpeg:{name}",
+                                    metrics=[self.registry.camera(name, ROLE_CAPTURER)])
+                      for name in ("a", "b")}
+
+    def tearDown(self) -> None:
+        for pipe in self.pipes.values():
+            pipe.close()
+        self.registry.close()
+
+    def _ffmpeg(self, name: str, lines: str) -> None:
+        # an FFmpeg printing the lines and exiting
+        stderr = self.pipes[name].open()
+        proc = sp.Popen(["printf", lines], stderr=sp.STDOUT, stdout=stderr)
+        os.close(stderr)
+        proc.wait(timeout=5)
+
+    def _received(self, name: str, count: int) -> None:
+        deadline = time.monotonic() + 5
+        while self.pipes[name].received < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.pipes[name].received, count)
+
+    def test_counts_the_messages_of_every_ffmpeg(self):
+        self._ffmpeg("a", "[h264 @ 0x1] error while decoding MB 3 4, bytestream -5\n"
+                          "[h264 @ 0x1] concealing 200 DC, 200 AC, 200 MV errors in P frame\n"
+                          "[rtsp @ 0x2] method DESCRIBE failed: 404 Not Found\n")
+        self._ffmpeg("b", "[tcp @ 0x3] Connection to tcp://camera:554 failed: Connection refused\n"
+                          "Error while decoding stream #0:0: Invalid data found")
+        self._received("a", 3)
+        self._received("b", 2)
+        self.assertEqual(self.pipes["a"].events["ffmpeg_corrupt_frames"], 2)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["b"]["counters"]["ffmpeg_reconnects"], 1)
+        # the last line had no newline, it is read when FFmpeg exits
+        self.assertEqual(snapshot["b"]["counters"]["ffmpeg_decode_errors"], 1)
+        # the pipes of the exited FFmpegs are closed, only the wake up pipe is left
+        deadline = time.monotonic() + 5
+        while len(log_collector().selector.get_map()) > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(log_collector().selector.get_map()), 1)
+
+    def test_the_ring_survives_restarts(self):
+        self._ffmpeg("a", "first\n")
+        self._received("a", 1)
+        self.pipes["a"].dump()
+        self._ffmpeg("a", "second\n")
+        self._received("a", 2)
+        self.assertEqual(self.pipes["a"].lines(), ["first", "second"])
+        self.assertEqual(self.pipes["a"].received - self.pipes["a"].dumped, 1)
+
+
+class TestPyAVAvailability(unittest.TestCase):
+    def test_disables_the_pyav_cameras_without_it(self):
+        cameras = {
+            "pyav": CameraConfig(source={"path": "rtsp://a", "backend": "pyav"}),
+            "ffmpeg": CameraConfig(source={"path": "rtsp://b"}),
+            "replay": CameraConfig(source={"path": "rtsp://c", "backend": "pyav"},
+                                   replay={"path": "/tmp/c.raw"}),
+        }
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            disable_without_pyav(cameras)
+        self.assertEqual({name: camera.enabled for name, camera in cameras.items()},
+                         {"pyav": False, "ffmpeg": True, "replay": True})
+
+
+@unittest.skipIf(importlib.util.find_spec("av") is None, "PyAV is not installed")
+class TestPyAVProvider(unittest.TestCase):
+    def test_decodes_into_the_frame_store(self):
+        config = CameraConfig(
+            source={"path": os.path.abspath("tests/src/video.mp4"), "backend": "pyav",
+                    "ffmpeg": {"input_args": "mp4_generic"}},
+            detect={"width": 320, "height": 240, "fps": 5})
+        registry = MetricsRegistry(cameras=["a"])
+        frame_queue = mp.Queue(maxsize=2)
+        stop_event = mp.Event()
+        provider = PyAVProvider(source_name="a",
+                                metrics=registry.camera("a", ROLE_CAPTURER),
+                                stop_event=stop_event,
+                                configs=config,
+                                frame_queue=frame_queue)
+        provider.start()
+        fm = SharedMemoryFrameManager()
+        for _ in range(3):
+            frame_time = frame_queue.get(timeout=10)
+            frame = fm.get(name=frame_name("a", frame_time), shape=config.frame_shape_yuv)
+            self.assertEqual(frame.shape, (360, 320))
+            # a picture, not the black of an empty segment
+            self.assertGreater(int(frame[:240].max()), 0)
+            fm.delete(name=frame_name("a", frame_time))
+        stop_event.set()
+        provider.join(timeout=10)
+        self.assertFalse(provider.is_alive())
+        snapshot = registry.snapshot()["a"]
+        # the clip starts with a keyframe, the third frame kept at 5 fps is 0.4s in
+        self.assertGreaterEqual(snapshot["counters"]["keyframes"], 1)
+        self.assertGreaterEqual(snapshot["gauges"]["frame_pts"], 2 * 0.19)
+        registry.close()
@@ -0,0 +1,58 @@
+import unittest
+from edge.utils.events import EventsPerSecond
+
+
+class FakeClockEventsPerSecond(EventsPerSecond):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.clock = 1000.0
+
+    def now(self) -> float:
+        return self.clock
+
+
+class TestEventsPerSecond(unittest.TestCase):
+    def test_rate_over_window(self):
+        counter = FakeClockEventsPerSecond(last_n_seconds=10)
+        counter.start()
+        for _ in range(200):
+            counter.clock += 0.1
+            counter.update()
+        # 20 seconds at 10 fps, only the last 10 seconds are counted
+        self.assertAlmostEqual(counter.eps(), 10, delta=0.5)
+        counter.clock += 30
+        self.assertEqual(counter.eps(), 0)
+
+    def test_fixed_memory(self):
+        counter = FakeClockEventsPerSecond()
+        size = len(counter._buf)
+        for _ in range(100000):
+            counter.clock += 0.001
+            counter.update()
+        self.assertEqual(len(counter._buf), size)
+        self.assertAlmostEqual(counter.eps(), 1000, delta=30)
+
+    def test_jitter_percentiles(self):
+        counter = FakeClockEventsPerSecond(jitter_samples=100)
+        counter.start()
+        for i in range(100):
+            counter.clock += 0.2 if i % 10 == 0 else 0.1
+            counter.update()
+        p50, p99 = counter.percentiles((50, 99))
+        self.assertAlmostEqual(p50, 0.1)
+        self.assertAlmostEqual(p99, 0.2)
+
+    def test_shared_buffer(self):
+        buf = memoryview(bytearray(8 * EventsPerSecond.size())).cast("d")
+        writer = FakeClockEventsPerSecond(buffer=buf)
+        reader = FakeClockEventsPerSecond(buffer=buf)
+        writer.start()
+        for _ in range(50):
+            writer.clock += 0.1
+            writer.update()
+        reader.clock = writer.clock
+        self.assertAlmostEqual(reader.eps(), writer.eps())
+
+
+if __name__ == "__main__":
+    unittest.main()
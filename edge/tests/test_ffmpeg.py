@@ -0,0 +1,116 @@
+import os
+import stat
+import tempfile
+import unittest
+import edge.ffmpeg
+from edge.config import CameraConfig
+from edge.ffmpeg import StreamProber, av_options
+
+# logs its arguments, a 1920x1080 stream at 5 fps unless the path is broken
+STUB_FFPROBE = """#!/bin/sh
+echo "$@" >> {log}
+case "$*" in
+  *broken*) exit 1 ;;
+esac
+echo '{{"streams": [{{"width": 1920, "height": 1080, "avg_frame_rate": "0/0", "r_frame_rate": "5/1"}}]}}'
+"""
+
+
+def _camera(path: str = "rtsp://camera/sub", **detect) -> CameraConfig:
+    return CameraConfig(source={"path": path, "ffmpeg": {"hwaccel_args": "auto"}},
+                        detect=dict({"fps": 5}, **detect))
+
+
+class TestStreamProber(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.dir.name, "ffprobe.log")
+        ffprobe = os.path.join(self.dir.name, "ffprobe")
+        with open(ffprobe, "w") as f:
+            f.write(STUB_FFPROBE.format(log=self.log))
+        os.chmod(ffprobe, os.stat(ffprobe).st_mode | stat.S_IXUSR)
+        self.prober = StreamProber(ffprobe=ffprobe, timeout=5.0)
+        # decoded in software
+        edge.ffmpeg._capabilities = {"gpu": "", "decoders": {}, "preferred": None}
+
+    def tearDown(self) -> None:
+        edge.ffmpeg._capabilities = None
+        self.dir.cleanup()
+
+    def _probes(self) -> int:
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as f:
+            return len(f.readlines())
+
+    def test_fills_in_the_detect_size(self):
+        cameras = {"native": _camera(), "height": _camera(height=360),
+                   "fixed": _camera(width=640, height=480),
+                   "replay": CameraConfig(detect={"width": 64, "height": 48},
+                                          replay={"path": "cam.raw"})}
+        self.prober.resolve(cameras)
+        self.assertEqual(self._probes(), 1)
+        self.assertEqual((cameras["native"].detect.width, cameras["native"].detect.height),
+                         (1920, 1080))
+        self.assertEqual(cameras["height"].detect.width, 640)
+        self.assertEqual(cameras["fixed"].frame_shape, (640, 480))
+
+    def test_skips_the_filters_matching_the_stream(self):
+        cameras = {"native": _camera(), "smaller": _camera(width=640, height=360),
+                   "slower": _camera(width=1920, height=1080, fps=2)}
+        self.prober.resolve(cameras)
+        cmd = cameras["native"].ffmpeg_cmd
+        self.assertNotIn("-vf", cmd)
+        self.assertNotIn("-r", cmd)
+        smaller = cameras["smaller"].ffmpeg_cmd
+        self.assertEqual(smaller[smaller.index("-vf") + 1], "scale=640:360")
+        slower = cameras["slower"].ffmpeg_cmd
+        self.assertEqual(slower[slower.index("-vf") + 1], "fps=2")
+
+    def test_reuses_the_stream_on_reload(self):
+        self.prober.resolve({"a": _camera()})
+        reloaded = {"a": _camera(), "b": _camera()}
+        self.prober.resolve(reloaded)
+        self.assertEqual(self._probes(), 1)
+        self.assertEqual(reloaded["b"].detect.height, 1080)
+
+    def test_keeps_the_filters_when_probing_fails(self):
+        camera = _camera(path="rtsp://broken", height=360)
+        self.prober.resolve({"a": camera})
+        # 16:9 until the stream is known
+        self.assertEqual(camera.detect.width, 640)
+        self.assertEqual(camera.ffmpeg_cmd[camera.ffmpeg_cmd.index("-vf") + 1],
+                         "fps=5,scale=640:360")
+        self.prober.resolve({"a": _camera(path="rtsp://broken")})
+        self.assertEqual(self._probes(), 2)
+
+
+class TestHwaccelPresets(unittest.TestCase):
+    def tearDown(self) -> None:
+        edge.ffmpeg._capabilities = None
+
+    def _cmd(self, hwaccel_args: str, gpu: str):
+        edge.ffmpeg._capabilities = {"gpu": gpu, "decoders": {}, "preferred": None}
+        return CameraConfig(source={"path": "rtsp://camera",
+                                    "ffmpeg": {"hwaccel_args": hwaccel_args}},
+                            detect={"width": 320, "height": 240, "fps": 5}).ffmpeg_cmd
+
+    def test_scales_in_software_without_a_gpu(self):
+        for hwaccel_args in ("va_api", "intel_quicksync_h264"):
+            cmd = self._cmd(hwaccel_args, gpu="")
+            self.assertNotIn("-hwaccel", cmd)
+            self.assertEqual(cmd[cmd.index("-vf") + 1], "fps=5,scale=320:240")
+
+    def test_scales_on_the_gpu_that_decodes(self):
+        cmd = self._cmd("va_api", gpu="/dev/dri/renderD128")
+        self.assertEqual(cmd[cmd.index("-hwaccel_device") + 1], "/dev/dri/renderD128")
+        self.assertTrue(cmd[cmd.index("-vf") + 1].startswith("fps=5,scale_vaapi="))
+
+
+class TestAvOptions(unittest.TestCase):
+    def test_input_args_as_demuxer_options(self):
+        args = ["-avoid_negative_ts", "make_zero", "-fflags", "+genpts+discardcorrupt",
+                "-rtsp_transport", "tcp", "-re", "-itsoffset", "-1"]
+        self.assertEqual(av_options(args), {
+            "avoid_negative_ts": "make_zero", "fflags": "+genpts+discardcorrupt",
+            "rtsp_transport": "tcp", "re": "1", "itsoffset": "-1"})
@@ -0,0 +1,131 @@
+import io
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import unittest
+from edge.config import CameraConfig
+from edge.streams.capture import FrameCollector
+from edge.utils.frame import (FrameMemory, LocalFrameManager, SharedMemoryFrameManager,
+                              frame_name)
+from edge.utils.metrics import ROLE_CAPTURER, ROLE_DETECTOR, MetricsRegistry
+from edge.video import run_colocated_detector
+
+SHAPE = (6, 4)
+SIZE = SHAPE[0] * SHAPE[1]
+
+
+class TestFrameMemory(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry(cameras=["cam", "cam-2"])
+        self.memory = FrameMemory(instance=f"test{os.getpid()}", metrics=self.registry,
+                                  budget=3 * 4096, orphan_age=0.2)
+        self.fm = SharedMemoryFrameManager(prefix=self.memory.prefix)
+
+    def tearDown(self) -> None:
+        self.fm.clean()
+        self.memory.sweep()
+        self.registry.close()
+
+    def _frame(self, camera: str, frame_time: float) -> str:
+        name = frame_name(camera, frame_time)
+        self.fm.create(name=name, size=SIZE)[:] = bytes([1]) * SIZE
+        return name
+
+    def test_usage_per_camera(self):
+        self._frame("cam", time.time())
+        self._frame("cam-2", time.time())
+        self._frame("cam-2", time.time() + 1)
+        # a page per frame
+        self.assertEqual(self.memory.usage(), {"cam": 4096, "cam-2": 2 * 4096})
+        self.memory.check(["cam", "cam-2"])
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["cam-2"]["gauges"]["shm_bytes"], 2 * 4096)
+        self.assertEqual(snapshot["cam"]["gauges"]["shm_over_budget"], 1)
+        self.fm.clean()
+        self.memory.check(["cam", "cam-2"])
+        self.assertEqual(self.registry.snapshot()["cam"]["gauges"]["shm_over_budget"], 0)
+
+    def test_sweeps_the_frames_from_before_a_crash(self):
+        orphan = self._frame("cam", time.time() - 1)
+        other = self._frame("cam-2", time.time() - 1)
+        self.memory.crashed(["cam"])
+        queued = self._frame("cam", time.time())
+        self.memory.check(["cam", "cam-2"])
+        self.assertEqual(self.memory.swept, 0)
+        time.sleep(0.2)
+        self.memory.check(["cam", "cam-2"])
+        names = {name for name, _, _, _ in self.memory.segments()}
+        self.assertEqual(names, {self.memory.prefix + other, self.memory.prefix + queued})
+        self.assertEqual(self.memory.swept, 1)
+        # the process holding it is gone, deleting it is harmless
+        self.fm.delete(name=orphan)
+
+    def test_capturer_drops_frames_over_budget(self):
+        metrics = self.registry.camera("cam", ROLE_CAPTURER)
+        metrics.set("shm_over_budget", 1)
+        frame_queue = mp.Queue(maxsize=2)
+        collector = FrameCollector(
+            ffmpeg_process=None,
+            source_name="cam",
+            frame_shape=SHAPE,
+            frame_queue=frame_queue,
+            metrics=metrics,
+            frame_manager=self.fm,
+            stop_event=mp.Event(),
+            output=io.BytesIO(bytes(SIZE * 3)))
+        collector.run()
+        self.assertEqual(self.registry.snapshot()["cam"]["counters"]["shm_dropped_frames"], 3)
+        self.assertTrue(frame_queue.empty())
+        self.assertEqual(self.memory.usage(), {})
+
+
+class TestLocalFrameManager(unittest.TestCase):
+    def test_frames_stay_until_deleted(self):
+        fm = LocalFrameManager(pool=1)
+        buffer = fm.create(name="cam-1.0", size=SIZE)
+        buffer[:] = bytes([3]) * SIZE
+        fm.close(name="cam-1.0")
+        self.assertTrue((fm.get(name="cam-1.0", shape=SHAPE) == 3).all())
+        fm.delete(name="cam-1.0")
+        with self.assertRaises(KeyError):
+            fm.get(name="cam-1.0", shape=SHAPE)
+        # the buffer of the deleted frame is reused
+        self.assertIs(fm.create(name="cam-2.0", size=SIZE).obj, buffer.obj)
+        fm.clean()
+        self.assertIsNone(fm.create(name="cam-3.0", size=SIZE))
+
+    def test_motion_is_detected_in_the_capturer_process(self):
+        config = CameraConfig(source={"path": "rtsp://camera"}, colocated=True,
+                              detect={"width": 64, "height": 48, "fps": 5})
+        registry = MetricsRegistry(cameras=["cam"])
+        frame_size = config.frame_shape_yuv[0] * config.frame_shape_yuv[1]
+        frame_queue = queue.Queue(maxsize=10)
+        fm = LocalFrameManager()
+        stop_event = mp.Event()
+        detection = threading.Thread(
+            target=run_colocated_detector,
+            args=("cam", config, frame_queue, fm, registry, stop_event))
+        detection.start()
+        shm_before = set(os.listdir("/dev/shm"))
+        FrameCollector(
+            ffmpeg_process=None,
+            source_name="cam",
+            frame_shape=config.frame_shape_yuv,
+            frame_queue=frame_queue,
+            metrics=registry.camera("cam", ROLE_CAPTURER),
+            frame_manager=fm,
+            stop_event=stop_event,
+            output=io.BytesIO(bytes(frame_size * 5))).run()
+        self.assertEqual(set(os.listdir("/dev/shm")) - shm_before, set())
+        detector = registry.camera("cam", ROLE_DETECTOR)
+        deadline = time.monotonic() + 5
+        while detector.get("detected_frames") < 5 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stop_event.set()
+        detection.join(timeout=5)
+        self.assertFalse(detection.is_alive())
+        self.assertEqual(detector.get("detected_frames"), 5)
+        self.assertEqual(fm.store, {})
+        registry.close()
@@ -0,0 +1,117 @@
+import os
+import stat
+import tempfile
+import time
+import unittest
+import edge.ffmpeg
+from edge.config import CameraConfig
+from edge.ffmpeg import HwaccelProbe, hwaccel_capabilities
+
+# logs its arguments, creates the sample clip and only decodes with vaapi
+STUB_FFMPEG = """#!/bin/sh
+echo "$@" >> {log}
+case "$*" in
+  *lavfi*) for last; do :; done; touch "$last"; exit 0 ;;
+  *vaapi*) exit 0 ;;
+esac
+exit 1
+"""
+# only the second render device works
+STUB_VAINFO = """#!/bin/sh
+case "$*" in
+  *renderD129*) exit 0 ;;
+esac
+exit 1
+"""
+
+
+def _script(path: str, content: str) -> str:
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+class TestHwaccelProbe(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        root = self.dir.name
+        self.log = os.path.join(root, "ffmpeg.log")
+        self.dri = os.path.join(root, "dri")
+        self.sys = os.path.join(root, "drm")
+        os.makedirs(self.dri)
+        for device in ("card0", "renderD128", "renderD129"):
+            open(os.path.join(self.dri, device), "w").close()
+        for device in ("renderD128", "renderD129"):
+            self._driver(device, "i915")
+        self.ffmpeg = _script(os.path.join(root, "ffmpeg"), STUB_FFMPEG.format(log=self.log))
+        self.vainfo = _script(os.path.join(root, "vainfo"), STUB_VAINFO)
+
+    def tearDown(self) -> None:
+        edge.ffmpeg._capabilities = None
+        self.dir.cleanup()
+
+    def _driver(self, device: str, driver: str) -> None:
+        target = os.path.join(self.dir.name, "drivers", driver)
+        os.makedirs(target, exist_ok=True)
+        base = os.path.join(self.sys, device, "device")
+        os.makedirs(base, exist_ok=True)
+        link = os.path.join(base, "driver")
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(target, link)
+
+    def _probe(self, **kwargs) -> HwaccelProbe:
+        return HwaccelProbe(cache_path=os.path.join(self.dir.name, "cache", "hwaccel.json"),
+                            ffmpeg=self.ffmpeg, vainfo=self.vainfo, dri_dir=self.dri,
+                            sys_dir=self.sys, nvidia_device=os.path.join(self.dri, "nvidia0"),
+                            **kwargs)
+
+    def _ffmpeg_runs(self) -> int:
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as f:
+            return len(f.readlines())
+
+    def test_probes_the_presets_once(self):
+        result = self._probe().load()
+        self.assertEqual(result["gpu"], os.path.join(self.dri, "renderD129"))
+        self.assertEqual(result["preferred"], "va_api")
+        # no NVIDIA device, CUDA is not even tried
+        self.assertEqual(result["decoders"], {
+            "nvidia_cuda": False, "va_api": True, "intel_quicksync_h264": False})
+        # the sample clip, then VA-API and Quick Sync
+        self.assertEqual(self._ffmpeg_runs(), 3)
+        self.assertEqual(self._probe().load(), result)
+        self.assertEqual(self._ffmpeg_runs(), 3)
+
+    def test_probes_again_when_the_driver_changes(self):
+        self._probe().load()
+        self._driver("renderD129", "amdgpu")
+        result = self._probe().load()
+        self.assertEqual(result["fingerprint"]["devices"]["renderD129"][0], "amdgpu")
+        # the sample clip is reused
+        self.assertEqual(self._ffmpeg_runs(), 5)
+
+    def test_falls_back_to_software_without_devices(self):
+        for device in ("renderD128", "renderD129"):
+            os.remove(os.path.join(self.dri, device))
+        start = time.monotonic()
+        result = self._probe().load()
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertIsNone(result["preferred"])
+        self.assertEqual(self._ffmpeg_runs(), 0)
+
+    def test_auto_uses_the_probed_preset(self):
+        hwaccel_capabilities(probe=self._probe(), refresh=True)
+        camera = CameraConfig(
+            source={"path": "rtsp://camera", "ffmpeg": {"hwaccel_args": "auto"}},
+            detect={"width": 640, "height": 360})
+        cmd = " ".join(camera.ffmpeg_cmd)
+        self.assertIn(f"-hwaccel vaapi -hwaccel_device {self.dri}/renderD129", cmd)
+        self.assertIn("scale_vaapi=w=640:h=360", cmd)
+
+        edge.ffmpeg._capabilities = dict(edge.ffmpeg._capabilities, preferred=None)
+        cmd = " ".join(camera.ffmpeg_cmd)
+        self.assertNotIn("-hwaccel", cmd)
+        self.assertIn("scale=640:360", cmd)
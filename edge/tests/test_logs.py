@@ -0,0 +1,99 @@
+import multiprocessing as mp
+import unittest
+from loguru import logger
+from edge.utils.logs import PeriodicSummary, RateLimitedLogger, TokenBucket, configure_logging
+from edge.utils.processes import camera_process
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _log_and_flush(reconfigured: mp.Event) -> None:
+    reconfigured.wait(timeout=5)
+    logger.info("child logging")
+    # waits for the worker thread of the sink to write it
+    logger.complete()
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refills_at_its_rate(self):
+        clock = Clock()
+        bucket = TokenBucket(rate=2.0, burst=3, clock=clock)
+        self.assertEqual([bucket.allow() for _ in range(4)], [True, True, True, False])
+        clock.now += 0.5
+        self.assertTrue(bucket.allow())
+        self.assertFalse(bucket.allow())
+        # never more than the burst
+        clock.now += 60
+        self.assertEqual(sum(bucket.allow() for _ in range(5)), 3)
+
+
+class TestRateLimitedLogger(unittest.TestCase):
+    def setUp(self) -> None:
+        self.messages = []
+        self.handler = logger.add(self.messages.append, format="{level} {message}")
+
+    def tearDown(self) -> None:
+        logger.remove(self.handler)
+
+    def test_reports_the_suppressed_messages(self):
+        clock = Clock()
+        limiter = RateLimitedLogger(rate=1.0, burst=2, clock=clock)
+        results = [limiter.error("read", "frame {} lost", i) for i in range(5)]
+        self.assertEqual(results, [True, True, False, False, False])
+        # another key has a bucket of its own
+        self.assertTrue(limiter.warning("queue", "queue full"))
+        clock.now += 1.0
+        self.assertTrue(limiter.error("read", "frame {} lost", 5))
+        self.assertEqual([m.strip() for m in self.messages], [
+            "ERROR frame 0 lost",
+            "ERROR frame 1 lost",
+            "WARNING queue full",
+            "ERROR frame 5 lost (3 similar messages suppressed)",
+        ])
+        clock.now += 1.0
+        limiter.error("read", "frame {} lost", 6)
+        self.assertEqual(self.messages[-1].strip(), "ERROR frame 6 lost")
+
+
+class TestPeriodicSummary(unittest.TestCase):
+    def test_ready_once_per_interval(self):
+        clock = Clock()
+        summary = PeriodicSummary(interval=10.0, clock=clock)
+        self.assertFalse(summary.ready())
+        clock.now += 10.0
+        self.assertTrue(summary.ready())
+        self.assertFalse(summary.ready())
+        # the next one is an interval after the last summary, not a catch up
+        clock.now += 25.0
+        self.assertTrue(summary.ready())
+        clock.now += 5.0
+        self.assertFalse(summary.ready())
+
+
+class TestForkedLogging(unittest.TestCase):
+    def tearDown(self) -> None:
+        configure_logging()
+
+    def test_child_logs_after_the_parent_reconfigures(self):
+        context = mp.get_context("fork")
+        configure_logging()
+        reconfigured = context.Event()
+        proc = camera_process(target=_log_and_flush, name="logging", args=(reconfigured,),
+                              log_level="INFO", context=context)
+        proc.start()
+        # as a reload does, which stops the worker thread the child inherited
+        configure_logging()
+        reconfigured.set()
+        proc.join(timeout=10)
+        alive = proc.is_alive()
+        if alive:
+            proc.kill()
+            proc.join()
+        self.assertFalse(alive)
+        self.assertEqual(proc.exitcode, 0)
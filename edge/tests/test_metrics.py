@@ -0,0 +1,55 @@
+import multiprocessing as mp
+import unittest
+from edge.utils.metrics import ROLE_CAPTURER, ROLE_DETECTOR, MetricsRegistry, percentile
+
+
+def _write_detector_metrics(registry: MetricsRegistry) -> None:
+    metrics = registry.camera("back", ROLE_DETECTOR)
+    for _ in range(100):
+        metrics.observe("motion", 0.003)
+    metrics.observe("motion", 0.2)
+    metrics.rate("detection_fps").start()
+    for _ in range(5):
+        metrics.rate("detection_fps").update()
+    metrics.inc("detected_frames", 101)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry(cameras=["front", "back"])
+
+    def tearDown(self) -> None:
+        self.registry.close()
+
+    def test_aggregate_across_processes(self):
+        capturer = self.registry.camera("back", ROLE_CAPTURER)
+        capturer.set("ffmpeg_pid", 42)
+        capturer.inc("frames", 5)
+        proc = mp.Process(target=_write_detector_metrics, args=(self.registry,))
+        proc.start()
+        proc.join()
+
+        back = self.registry.snapshot()["back"]
+        self.assertEqual(back["gauges"]["ffmpeg_pid"], 42)
+        # the counter started less than a second ago, the rate is per second
+        self.assertEqual(back["gauges"]["detection_fps"], 5)
+        self.assertEqual(back["gauges"]["fps"], 0)
+        self.assertEqual(back["counters"]["frames"], 5)
+        self.assertEqual(back["counters"]["detected_frames"], 101)
+        motion = back["stages"]["motion"]
+        self.assertEqual(motion["count"], 101)
+        self.assertAlmostEqual(motion["sum"], 0.5)
+        self.assertEqual(percentile(motion["buckets"], 0.5), 0.005)
+        self.assertEqual(percentile(motion["buckets"], 0.999), 0.25)
+        self.assertEqual(
+            self.registry.snapshot()["front"]["counters"]["frames"], 0)
+
+    def test_reset(self):
+        metrics = self.registry.camera("front", ROLE_CAPTURER)
+        metrics.inc("frames")
+        self.registry.reset("front", ROLE_CAPTURER)
+        self.assertEqual(metrics.get("frames"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import socket
+import threading
+import unittest
+import paho.mqtt.client as mqtt
+from edge.comms.mqtt import MqttPublisher
+from edge.config import EventMqttConfig, MqttDropPolicyEnum
+
+
+class FakeBroker(threading.Thread):
+    # Speaks just enough MQTT 3.1.1 to accept a client and record publishes
+    def __init__(self) -> None:
+        threading.Thread.__init__(self, daemon=True)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.messages = []
+        self.received = threading.Condition()
+
+    def run(self) -> None:
+        conn, _ = self.server.accept()
+        with conn:
+            while True:
+                header = self._read(conn, 1)
+                if not header:
+                    return
+                body = self._read(conn, self._remaining_length(conn))
+                kind = header[0] >> 4
+                if kind == 1:  # CONNECT
+                    conn.sendall(b"\x20\x02\x00\x00")
+                elif kind == 3:  # PUBLISH
+                    self._on_publish(conn, header[0], body)
+                elif kind == 12:  # PINGREQ
+                    conn.sendall(b"\xd0\x00")
+                elif kind == 14:  # DISCONNECT
+                    return
+
+    def _on_publish(self, conn, flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        topic_len = int.from_bytes(body[0:2], "big")
+        topic = body[2:2 + topic_len].decode()
+        offset = 2 + topic_len
+        if qos > 0:
+            conn.sendall(b"\x40\x02" + body[offset:offset + 2])
+            offset += 2
+        with self.received:
+            self.messages.append((topic, body[offset:]))
+            self.received.notify_all()
+
+    def wait_for(self, count: int, timeout: float = 5.0):
+        with self.received:
+            self.received.wait_for(
+                lambda: len(self.messages) >= count, timeout=timeout)
+            return list(self.messages)
+
+    @staticmethod
+    def _read(conn, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            try:
+                chunk = conn.recv(size - len(data))
+            except OSError:
+                return data
+            if not chunk:
+                return data
+            data += chunk
+        return data
+
+    def _remaining_length(self, conn) -> int:
+        value, multiplier = 0, 1
+        while True:
+            byte = self._read(conn, 1)
+            if not byte:
+                return 0
+            byte = byte[0]
+            value += (byte & 0x7F) * multiplier
+            if byte & 0x80 == 0:
+                return value
+            multiplier *= 128
+
+
+class FakeClient:
+    # Returns the scripted result codes of its publishes in turn
+    def __init__(self, codes) -> None:
+        self.codes = list(codes)
+        self.sent = []
+
+    def max_queued_messages_set(self, size: int) -> None:
+        pass
+
+    def publish(self, topic: str, payload: bytes, qos: int, retain: bool):
+        rc = self.codes.pop(0)
+        self.sent.append((topic, qos, rc))
+        info = mqtt.MQTTMessageInfo(mid=len(self.sent))
+        info.rc = rc
+        return info
+
+
+class TestMqttPublisher(unittest.TestCase):
+    def test_publish_to_broker(self):
+        broker = FakeBroker()
+        broker.start()
+        config = EventMqttConfig(
+            enabled=True, host="127.0.0.1", port=broker.port)
+        publisher = MqttPublisher(config=config)
+        publisher.publish_state("front", "motion", "ON")
+        publisher.publish_state("front", "motion", "OFF")
+        publisher.publish_event({"label": "person"})
+        publisher.start()
+        try:
+            messages = broker.wait_for(2)
+        finally:
+            publisher.stop()
+            publisher.join(timeout=5)
+        # the event goes out first and the motion updates are coalesced
+        self.assertEqual(messages[0], ("edge/events", b'{"label": "person"}'))
+        self.assertEqual(messages[1], ("edge/front/motion", b"OFF"))
+        self.assertEqual(len(messages), 2)
+
+    def test_drop_oldest(self):
+        config = EventMqttConfig(max_queued=2)
+        publisher = MqttPublisher(config=config)
+        for i in range(3):
+            self.assertTrue(publisher.publish_event(i))
+        self.assertEqual(publisher.dropped, 1)
+        self.assertEqual([p for _, p in publisher.events], [b"1", b"2"])
+
+    def test_drop_newest(self):
+        config = EventMqttConfig(
+            max_queued=2, drop_policy=MqttDropPolicyEnum.drop_newest)
+        publisher = MqttPublisher(config=config)
+        for i in range(2):
+            self.assertTrue(publisher.publish_event(i))
+        self.assertFalse(publisher.publish_event(2))
+        self.assertEqual(publisher.dropped, 1)
+        self.assertEqual([p for _, p in publisher.events], [b"0", b"1"])
+
+    def test_states_are_coalesced(self):
+        publisher = MqttPublisher(config=EventMqttConfig())
+        for fps in range(100):
+            publisher.publish_state("front", "fps", fps)
+        publisher.publish_state("back", "fps", 1)
+        self.assertEqual(publisher.pending(), 2)
+        self.assertEqual(publisher.states[("front", "fps")], b"99")
+
+    def test_send_while_disconnected(self):
+        client = FakeClient([mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN,
+                             mqtt.MQTT_ERR_NO_CONN])
+        publisher = MqttPublisher(config=EventMqttConfig(), client=client)
+        for i in range(2):
+            publisher.publish_event(i)
+        publisher.publish_state("front", "motion", "ON")
+        requeue = publisher._send(publisher._take_batch())
+        publisher._requeue(requeue)
+        # paho sends the QoS 1 event on reconnect, the QoS 0 state is kept here
+        self.assertEqual(publisher.published, 2)
+        self.assertEqual(list(publisher.events), [])
+        self.assertEqual(publisher.states, {("front", "motion"): b"ON"})
+
+    def test_send_with_a_full_client_buffer(self):
+        client = FakeClient([mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_QUEUE_SIZE])
+        publisher = MqttPublisher(config=EventMqttConfig(), client=client)
+        for i in range(3):
+            publisher.publish_event(i)
+        publisher._requeue(publisher._send(publisher._take_batch()))
+        self.assertEqual(publisher.published, 1)
+        self.assertEqual([p for _, p in publisher.events], [b"1", b"2"])
+        self.assertEqual(len(client.sent), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
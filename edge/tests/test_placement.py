@@ -0,0 +1,96 @@
+import os
+import subprocess as sp
+import sys
+import unittest
+from edge.config import CameraConfig, PlacementConfig
+from edge.utils.placement import Placement, assign_workers, plan_placement
+
+
+def _camera(width: int, height: int, fps: int) -> CameraConfig:
+    return CameraConfig(detect={"width": width, "height": height, "fps": fps})
+
+
+class TestPlanPlacement(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cameras = {
+            "big": _camera(1920, 1080, 10),
+            "small1": _camera(640, 360, 5),
+            "small2": _camera(640, 360, 5),
+            "off": CameraConfig(enabled=False, detect={"width": 640, "height": 360}),
+        }
+
+    def test_disabled_leaves_scheduling_alone(self):
+        plan = plan_placement(PlacementConfig(), self.cameras, available={0, 1})
+        self.assertEqual(sorted(plan), ["big", "small1", "small2"])
+        self.assertEqual(plan["big"].ffmpeg, Placement())
+
+    def test_manual_uses_the_role_cores(self):
+        config = PlacementConfig(
+            mode="manual",
+            ffmpeg={"cores": [2, 3], "nice": 5, "threads": 2},
+            detector={"cores": [1, 9]})
+        plan = plan_placement(config, self.cameras, available={0, 1, 2, 3})
+        self.assertEqual(plan["small1"].ffmpeg, Placement(cores=[2, 3], nice=5, threads=2))
+        # unavailable cores are left out, no cores means all of them
+        self.assertEqual(plan["small1"].detector.cores, [1])
+        self.assertEqual(plan["small1"].capturer.cores, [0, 1, 2, 3])
+
+    def test_auto_balances_by_cost(self):
+        config = PlacementConfig(mode="auto")
+        plan = plan_placement(config, self.cameras, available={0, 1, 2, 3})
+        # the decoder of the big camera gets a core to itself
+        big = plan["big"].ffmpeg.cores
+        self.assertEqual(len(big), 1)
+        others = [plan[name].ffmpeg.cores for name in ("small1", "small2")] + \
+            [plan[name].detector.cores for name in ("big", "small1", "small2")]
+        self.assertNotIn(big, others)
+        # processes of a camera are spread before sharing a core
+        self.assertNotEqual(plan["small1"].ffmpeg.cores, plan["small1"].detector.cores)
+        self.assertEqual(plan["big"].ffmpeg.ffmpeg_args(["ffmpeg", "-i", "x"]),
+                         ["ffmpeg", "-threads", "1", "-i", "x"])
+
+    def test_auto_stays_within_role_cores(self):
+        config = PlacementConfig(mode="auto", detector={"cores": [3]})
+        plan = plan_placement(config, self.cameras, available={0, 1, 2, 3})
+        for name in ("big", "small1", "small2"):
+            self.assertEqual(plan[name].detector.cores, [3])
+
+
+class TestPlacement(unittest.TestCase):
+    def test_threads_budget_replaces_every_threads(self):
+        cmd = ["ffmpeg", "-threads", "2", "-i", "x", "-threads", "2", "pipe:"]
+        self.assertEqual(Placement(threads=4).ffmpeg_args(cmd),
+                         ["ffmpeg", "-threads", "4", "-i", "x", "-threads", "4", "pipe:"])
+        self.assertEqual(Placement().ffmpeg_args(cmd), cmd)
+
+    def test_popen_places_the_child_only(self):
+        before = os.getpriority(os.PRIO_PROCESS, 0)
+        proc = Placement(cores=sorted(os.sched_getaffinity(0))[:1], nice=before + 1).popen(
+            [sys.executable, "-c",
+             "import os; print(os.getpriority(os.PRIO_PROCESS, 0), len(os.sched_getaffinity(0)))"],
+            stdout=sp.PIPE)
+        out, _ = proc.communicate(timeout=10)
+        self.assertEqual(out.split(), [str(before + 1).encode(), b"1"])
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, 0), before)
+
+
+class TestAssignWorkers(unittest.TestCase):
+    def test_balances_by_cost(self):
+        cameras = {"big": _camera(1280, 720, 10), "a": _camera(640, 360, 10),
+                   "b": _camera(640, 360, 10), "c": _camera(640, 360, 10)}
+        self.assertEqual(assign_workers(cameras, 2), [["big"], ["a", "b", "c"]])
+        self.assertEqual(assign_workers(cameras, 5), [["big"], ["a"], ["b"], ["c"], []])
+
+    def test_keeps_cameras_in_place(self):
+        cameras = {name: _camera(640, 360, 5) for name in "abcd"}
+        first = assign_workers(cameras, 2)
+        previous = {c: w for w, names in enumerate(first) for c in names}
+        cameras["e"] = _camera(640, 360, 5)
+        second = assign_workers(cameras, 2, previous=previous)
+        # only the new camera is placed, on either worker
+        for before, after in zip(first, second):
+            self.assertEqual(set(after) - {"e"}, set(before))
+        del cameras["a"]
+        third = assign_workers(cameras, 2, previous={c: w for w, names in enumerate(second)
+                                                      for c in names})
+        self.assertEqual(sum(len(names) for names in third), 4)
@@ -0,0 +1,97 @@
+import os
+import pstats
+import threading
+import time
+import tempfile
+import unittest
+from edge.utils.profiling import Profiler, check_mode, request_dir, request_profile
+
+
+def _busy_worker(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _wait_for(path: str, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(name="detector:test")
+        self.profiler.install()
+
+    def tearDown(self) -> None:
+        self.profiler.uninstall()
+        self.dir.cleanup()
+
+    def test_sampling_sees_other_threads(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=_busy_worker, args=(stop,), name="busy")
+        worker.start()
+        output = request_profile(os.getpid(), name="detector:test",
+                                 output_dir=self.dir.name, mode="sample",
+                                 duration=0.2, interval=0.001)
+        self.assertTrue(_wait_for(output))
+        stop.set()
+        worker.join()
+        # the session may still be logging once its output is in place
+        self.profiler.session.join(timeout=5)
+        with open(output) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any(line.startswith("busy;") and "_busy_worker" in line
+                            for line in lines))
+        self.assertFalse(self.profiler.active)
+
+    def test_cprofile_stops_after_duration(self):
+        output = request_profile(os.getpid(), name="detector:test",
+                                 output_dir=self.dir.name, mode="cprofile",
+                                 duration=0.2)
+        deadline = time.monotonic() + 5
+        # the signals are handled by the main thread while it runs bytecode
+        while not os.path.exists(output) and time.monotonic() < deadline:
+            sum(range(1000))
+        self.assertTrue(os.path.exists(output))
+        self.assertIsNone(self.profiler.profile)
+        self.assertGreater(pstats.Stats(output).total_calls, 0)
+
+    def test_stacks_dump(self):
+        output = request_profile(os.getpid(), name="detector:test",
+                                 output_dir=self.dir.name, mode="stacks")
+        self.assertTrue(_wait_for(output))
+        with open(output) as f:
+            self.assertIn("Thread MainThread", f.read())
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            request_profile(os.getpid(), name="x", output_dir=self.dir.name,
+                            mode="perf")
+
+    def test_cprofile_needs_the_main_thread(self):
+        with self.assertRaises(ValueError):
+            check_mode("cprofile", main_thread=False)
+        check_mode("cprofile", main_thread=True)
+        # the sampler walks every thread
+        check_mode("sample", main_thread=False)
+
+    def test_invalid_duration(self):
+        for duration in (float("nan"), float("inf"), 0, -1):
+            with self.assertRaises(ValueError):
+                request_profile(os.getpid(), name="x", output_dir=self.dir.name,
+                                duration=duration)
+
+    def test_requests_stay_private(self):
+        path = request_dir()
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+        os.chmod(path, 0o777)
+        try:
+            with self.assertRaises(PermissionError):
+                request_profile(os.getpid(), name="x", output_dir=self.dir.name)
+        finally:
+            os.chmod(path, 0o700)
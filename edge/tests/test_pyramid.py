@@ -0,0 +1,69 @@
+import unittest
+import numpy as np
+from edge.config import CameraConfig
+from edge.motion.default import DefaultMotionDetector
+from edge.utils.pyramid import frame_pyramid
+
+
+def _camera(width: int = 320, height: int = 240, **pyramid) -> CameraConfig:
+    return CameraConfig(source={"path": "rtsp://camera"},
+                        detect={"width": width, "height": height, "fps": 5},
+                        pyramid=dict({"enabled": True}, **pyramid))
+
+
+class TestFramePyramid(unittest.TestCase):
+    def test_levels_follow_the_frame(self):
+        pyramid = frame_pyramid(_camera())
+        frame_size = 360 * 320
+        self.assertEqual(pyramid.levels, {
+            "motion": (frame_size, (100, 133)),
+            "thumbnail": (frame_size + 100 * 133, (180, 160))})
+        self.assertEqual(pyramid.size, frame_size + 100 * 133 + 180 * 160)
+        self.assertIsNone(frame_pyramid(_camera(enabled=False)))
+        only = frame_pyramid(_camera(levels=["thumbnail"], thumbnail_height=60))
+        self.assertEqual(only.levels, {"thumbnail": (frame_size, (90, 80))})
+
+    def test_levels_are_built_in_place(self):
+        pyramid = frame_pyramid(_camera())
+        slot = np.zeros(pyramid.size, dtype=np.uint8)
+        frame = pyramid.frame(slot)
+        frame[:240] = 200
+        frame[240:] = 100
+        pyramid.build(slot)
+        thumbnail = pyramid.level(slot, "thumbnail")
+        self.assertTrue((thumbnail[:120] == 200).all())
+        self.assertTrue((thumbnail[120:] == 100).all())
+        self.assertEqual(pyramid.level(slot, "motion").shape, (100, 133))
+        self.assertIsNone(frame_pyramid(_camera(levels=["thumbnail"])).level(slot, "motion"))
+
+    def test_wide_frames(self):
+        # the YUV height of a 16:9 frame is smaller than its width
+        config = _camera(width=640, height=360)
+        pyramid = frame_pyramid(config)
+        self.assertEqual(pyramid.levels["motion"][1], (100, 178))
+        self.assertEqual(pyramid.levels["thumbnail"][1], (180, 214))
+        slot = np.zeros(pyramid.size, dtype=np.uint8)
+        pyramid.frame(slot)[:360] = 200
+        pyramid.build(slot)
+        self.assertTrue((pyramid.level(slot, "motion")[:66] == 200).all())
+        detector = DefaultMotionDetector(frame_shape=config.frame_shape_yuv,
+                                         config=config.motion, fps=5)
+        self.assertEqual(detector.motion_frame_size, (100, 178))
+
+    def test_motion_level_detects_the_same_motion(self):
+        config = _camera()
+        pyramid = frame_pyramid(config)
+        detectors = [DefaultMotionDetector(frame_shape=config.frame_shape_yuv,
+                                           config=config.motion, fps=5) for _ in range(2)]
+        rng = np.random.default_rng(1)
+        for i in range(20):
+            slot = np.zeros(pyramid.size, dtype=np.uint8)
+            frame = pyramid.frame(slot)
+            frame[:] = rng.integers(0, 20, size=frame.shape, dtype=np.uint8)
+            if i >= 10:
+                frame[40:120, 60:160] = 255
+            pyramid.build(slot)
+            resized = detectors[0].detect(frame)
+            from_level = detectors[1].detect(frame, pyramid.level(slot, "motion"))
+            self.assertEqual(resized, from_level)
+        self.assertTrue(from_level)
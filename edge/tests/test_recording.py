@@ -0,0 +1,109 @@
+import multiprocessing as mp
+import os
+import queue
+import tempfile
+import time
+import unittest
+import numpy as np
+from edge.config import CameraConfig
+from edge.streams.recording import FrameRecorder, RecordingReader
+from edge.streams.replay import ReplayProvider
+from edge.utils.frame import SharedMemoryFrameManager, frame_name
+from edge.utils.metrics import ROLE_CAPTURER, MetricsRegistry
+
+WIDTH, HEIGHT = 32, 16
+SHAPE = (HEIGHT * 3 // 2, WIDTH)
+
+
+def _frames(count: int):
+    return [np.full(SHAPE, i, dtype=np.uint8) for i in range(count)]
+
+
+class TestRecording(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "cam.raw")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _record(self, count: int, max_frames: int = 10) -> None:
+        recorder = FrameRecorder(self.path, frame_shape=SHAPE, max_frames=max_frames)
+        for i, frame in enumerate(_frames(count)):
+            recorder.write(100.0 + i * 0.2, frame.data)
+        recorder.close()
+
+    def test_round_trip(self):
+        self._record(count=4)
+        reader = RecordingReader(self.path)
+        self.assertEqual(reader.frame_shape, SHAPE)
+        self.assertEqual(len(reader), 4)
+        frame_time, view = reader.frame(2)
+        self.assertEqual(frame_time, 100.4)
+        self.assertTrue(np.all(np.frombuffer(view, dtype=np.uint8) == 2))
+        view.release()
+        reader.close()
+
+    def test_recording_stops_when_full(self):
+        self._record(count=5, max_frames=3)
+        reader = RecordingReader(self.path)
+        self.assertEqual(len(reader), 3)
+        reader.close()
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * 128)
+        with self.assertRaises(ValueError):
+            RecordingReader(self.path)
+
+    def test_replay_fastest_delivers_every_frame(self):
+        self._record(count=6)
+        config = CameraConfig(
+            detect={"width": WIDTH, "height": HEIGHT},
+            replay={"path": self.path, "mode": "fastest", "loop": False})
+        registry = MetricsRegistry(cameras=["cam"])
+        frame_queue = mp.Queue(maxsize=2)
+        provider = ReplayProvider(
+            source_name="cam",
+            metrics=registry.camera("cam", ROLE_CAPTURER),
+            stop_event=mp.Event(),
+            configs=config,
+            frame_queue=frame_queue)
+        provider.start()
+        fm = SharedMemoryFrameManager()
+        values = []
+        for _ in range(6):
+            frame_time = frame_queue.get(timeout=5)
+            name = frame_name("cam", frame_time)
+            values.append(int(fm.get(name=name, shape=SHAPE)[0, 0]))
+            fm.delete(name=name)
+        provider.join(timeout=5)
+        self.assertEqual(values, list(range(6)))
+        self.assertEqual(registry.snapshot()["cam"]["counters"]["skipped_frames"], 0)
+        registry.close()
+
+    def test_replay_realtime_keeps_spacing(self):
+        self._record(count=3)
+        config = CameraConfig(
+            detect={"width": WIDTH, "height": HEIGHT},
+            replay={"path": self.path, "mode": "realtime", "loop": False})
+        registry = MetricsRegistry(cameras=["cam"])
+        frame_queue = mp.Queue(maxsize=4)
+        provider = ReplayProvider(
+            source_name="cam",
+            metrics=registry.camera("cam", ROLE_CAPTURER),
+            stop_event=mp.Event(),
+            configs=config,
+            frame_queue=frame_queue)
+        start = time.monotonic()
+        provider.start()
+        provider.join(timeout=5)
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+        fm = SharedMemoryFrameManager()
+        for _ in range(3):
+            frame_time = frame_queue.get(timeout=1)
+            fm.get(name=frame_name("cam", frame_time), shape=SHAPE)
+            fm.delete(name=frame_name("cam", frame_time))
+        with self.assertRaises(queue.Empty):
+            frame_queue.get(timeout=0.1)
+        registry.close()
@@ -0,0 +1,99 @@
+import multiprocessing as mp
+import unittest
+from edge.config import EdgeConfig
+from edge.utils.configs import (APPLY_CAPTURER, APPLY_DETECTOR, APPLY_FFMPEG,
+                                APPLY_LIVE, ConfigChannel, ConfigDiff)
+from edge.utils.metrics import ROLE_CAPTURER, MetricsRegistry
+
+
+def _config(**cameras) -> EdgeConfig:
+    base = {"source": {"path": "rtsp://camera"},
+            "detect": {"width": 320, "height": 240, "fps": 5}}
+    return EdgeConfig.model_validate({"cameras": {
+        name: {**base, **overrides} for name, overrides in cameras.items()}})
+
+
+def _consume(channel: ConfigChannel, results: mp.Queue) -> None:
+    update = None
+    while update is None:
+        update = channel.poll()
+    results.put(update.motion.threshold)
+
+
+class TestConfigDiff(unittest.TestCase):
+    def test_untouched_cameras_are_left_alone(self):
+        old = _config(front={}, back={})
+        new = _config(front={"motion": {"threshold": 50}}, back={})
+        diff = ConfigDiff(old, new)
+        self.assertFalse(diff.full)
+        self.assertEqual(diff.changed, {"front": {APPLY_LIVE}})
+
+    def test_source_change_restarts_ffmpeg_only(self):
+        old = _config(front={})
+        new = _config(front={"source": {"path": "rtsp://other"}})
+        self.assertEqual(ConfigDiff(old, new).changed, {"front": {APPLY_FFMPEG}})
+
+    def test_motion_height_change_restarts_a_pyramid(self):
+        old = _config(front={"pyramid": {"enabled": True}}, back={})
+        new = _config(front={"pyramid": {"enabled": True}, "motion": {"frame_height": 50}},
+                      back={"motion": {"frame_height": 50}})
+        self.assertEqual(ConfigDiff(old, new).changed,
+                         {"front": {APPLY_LIVE, APPLY_CAPTURER, APPLY_DETECTOR},
+                          "back": {APPLY_LIVE}})
+
+    def test_backend_change_restarts_the_capturer(self):
+        old = _config(front={})
+        new = _config(front={"source": {"path": "rtsp://camera", "backend": "pyav"}})
+        self.assertEqual(ConfigDiff(old, new).changed, {"front": {APPLY_CAPTURER}})
+
+    def test_frame_shape_change_restarts_the_camera(self):
+        old = _config(front={})
+        new = _config(front={"detect": {"width": 640, "height": 480, "fps": 5}})
+        self.assertEqual(ConfigDiff(old, new).changed,
+                         {"front": {APPLY_CAPTURER, APPLY_DETECTOR}})
+
+    def test_cameras_added_removed_and_disabled(self):
+        old = _config(front={}, back={})
+        new = _config(front={"enabled": False}, side={})
+        diff = ConfigDiff(old, new)
+        self.assertEqual(diff.added, ["side"])
+        self.assertEqual(diff.removed, ["back", "front"])
+        self.assertEqual(diff.changed, {})
+
+    def test_global_sections(self):
+        old = _config(front={})
+        new = old.model_copy(update={"logger": {"level": "debug"}})
+        self.assertFalse(ConfigDiff(old, new).full)
+        new = _config(front={})
+        new.database.path = "/tmp/events.db"
+        self.assertTrue(ConfigDiff(old, new).full)
+
+
+class TestConfigChannel(unittest.TestCase):
+    def test_latest_update_reaches_the_process(self):
+        channel = ConfigChannel()
+        self.assertIsNone(channel.poll())
+        results = mp.Queue()
+        proc = mp.Process(target=_consume, args=(channel, results))
+        proc.start()
+        config = _config(front={"motion": {"threshold": 42}}).cameras["front"]
+        channel.publish(config)
+        self.assertEqual(results.get(timeout=5), 42)
+        proc.join(timeout=5)
+
+
+class TestRegistryCapacity(unittest.TestCase):
+    def test_add_and_remove_cameras(self):
+        registry = MetricsRegistry(cameras=["front"], capacity=2)
+        registry.camera("front", ROLE_CAPTURER).inc("frames")
+        self.assertTrue(registry.add_camera("back"))
+        self.assertFalse(registry.add_camera("side"))
+        registry.camera("back", ROLE_CAPTURER).inc("frames", 3)
+        registry.remove_camera("front")
+        self.assertEqual(registry.cameras, ["back"])
+        self.assertTrue(registry.add_camera("side"))
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot["back"]["counters"]["frames"], 3)
+        # a reused slot starts from zero
+        self.assertEqual(snapshot["side"]["counters"]["frames"], 0)
+        registry.close()
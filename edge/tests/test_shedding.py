@@ -0,0 +1,79 @@
+import unittest
+from edge.config import CameraConfig, LoadSheddingConfig
+from edge.utils.metrics import ROLE_CAPTURER, ROLE_DETECTOR, MetricsRegistry
+from edge.utils.shedding import (SHED_FPS, SHED_IDLE, SHED_MOTION,
+                                 FrameThrottle, LoadShedder)
+
+
+def _camera(priority: int = 0) -> CameraConfig:
+    return CameraConfig(
+        detect={"width": 320, "height": 240, "fps": 10},
+        shedding={"priority": priority})
+
+
+class TestLoadShedder(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry(cameras=["front", "back"])
+        self.shedder = LoadShedder(
+            metrics=self.registry,
+            cameras={"front": _camera(priority=1), "back": _camera()},
+            config=LoadSheddingConfig(escalate_after=2, restore_after=10),
+            cpu_times=lambda: None)
+
+    def tearDown(self) -> None:
+        self.registry.close()
+
+    def _level(self, camera: str) -> int:
+        return int(self.registry.camera(camera, ROLE_DETECTOR).get("shed_level"))
+
+    def test_sheds_in_priority_order(self):
+        decisions = [self.shedder.check(now=float(t), cpu_busy=0.95) for t in range(12)]
+        self.assertEqual([d for d in decisions if d is not None], [
+            ("back", "fps", True), ("front", "fps", True),
+            ("back", "idle", True), ("front", "idle", True),
+            ("back", "motion", True), ("front", "motion", True),
+        ])
+        self.assertEqual(self._level("back"), SHED_FPS | SHED_IDLE | SHED_MOTION)
+        # nothing left to shed
+        self.assertIsNone(self.shedder.check(now=12.0, cpu_busy=0.95))
+
+    def test_restores_after_headroom(self):
+        for t in range(4):
+            self.shedder.check(now=float(t), cpu_busy=0.95)
+        self.assertEqual(self.shedder.level, 2)
+        # in between the thresholds nothing changes
+        self.assertIsNone(self.shedder.check(now=4.0, cpu_busy=0.8))
+        self.assertIsNone(self.shedder.check(now=5.0, cpu_busy=0.5))
+        self.assertIsNone(self.shedder.check(now=14.0, cpu_busy=0.5))
+        self.assertEqual(self.shedder.check(now=15.0, cpu_busy=0.5), ("front", "fps", False))
+        self.assertEqual(self._level("front"), 0)
+        self.assertEqual(self._level("back"), SHED_FPS)
+        self.assertEqual(self.shedder.decisions[("front", "fps", "shed")], 1)
+        self.assertEqual(self.shedder.decisions[("front", "fps", "restore")], 1)
+
+    def test_skipped_frames_saturate(self):
+        capturer = self.registry.camera("front", ROLE_CAPTURER)
+        self.shedder.check(now=0.0, cpu_busy=0.1)
+        for t in (1, 2):
+            capturer.inc("frames", 10)
+            capturer.inc("skipped_frames", 5)
+            decision = self.shedder.check(now=float(t), cpu_busy=0.1)
+        self.assertEqual(decision, ("back", "fps", True))
+
+
+class TestFrameThrottle(unittest.TestCase):
+    def setUp(self) -> None:
+        self.throttle = FrameThrottle(_camera())
+
+    def _processed(self, level: int, idle: bool) -> int:
+        return sum(not self.throttle.skip(level, i / 10, idle=idle) for i in range(100))
+
+    def test_levels(self):
+        self.assertEqual(self._processed(0, idle=True), 100)
+        self.assertEqual(self._processed(SHED_FPS, idle=True), 50)
+        self.assertEqual(self._processed(SHED_FPS | SHED_IDLE, idle=False), 50)
+        self.assertEqual(self._processed(SHED_FPS | SHED_IDLE, idle=True), 10)
+
+    def test_motion_resolution(self):
+        self.assertEqual(self.throttle.motion_config(SHED_FPS).frame_height, 100)
+        self.assertEqual(self.throttle.motion_config(SHED_MOTION).frame_height, 50)
@@ -0,0 +1,132 @@
+import json
+import multiprocessing as mp
+import os
+import re
+import tempfile
+import time
+import unittest
+from http.client import HTTPConnection
+from edge.comms.http import StatsServer
+from edge.config import CameraConfig, HttpConfig
+from edge.stats import STALE_FRAME_SECONDS, StatsCollector
+from edge.utils.metrics import ROLE_CAPTURER, ROLE_DETECTOR, MetricsRegistry
+from edge.utils.profiling import check_mode, request_profile
+
+SAMPLE = re.compile(r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? \S+$')
+
+
+class FakeProcess:
+    def __init__(self) -> None:
+        self.pid = os.getpid()
+        self.alive = True
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+
+class FakeProcessor:
+    # the parts of EdgeProcessor the collector reads
+    def __init__(self, cameras) -> None:
+        self.metrics = MetricsRegistry(cameras=cameras)
+        self.traces = None
+        self.dir = tempfile.TemporaryDirectory()
+        self.capturer_info = {
+            name: {"capturer_process": FakeProcess(), "detector_process": FakeProcess(),
+                   "frame_queue": mp.Queue(maxsize=2),
+                   "camera_config": CameraConfig(source={"path": "rtsp://camera"})}
+            for name in cameras}
+
+    def profile(self, camera: str, role: str, mode: str, duration: float) -> str:
+        check_mode(mode, main_thread=role == "detector")
+        return request_profile(os.getpid(), name=f"{role}:{camera}",
+                               output_dir=self.dir.name, mode=mode, duration=duration)
+
+    def close(self) -> None:
+        for info in self.capturer_info.values():
+            info["frame_queue"].close()
+        self.metrics.close()
+        self.dir.cleanup()
+
+
+class TestStatsServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.processor = FakeProcessor(["cam", "other"])
+        self.server = StatsServer(
+            config=HttpConfig(host="127.0.0.1", port=0),
+            collector=StatsCollector(processor=self.processor, cache_ttl=0))
+        self.server.start()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.processor.close()
+
+    def _request(self, path: str, method: str = "GET"):
+        conn = HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+        try:
+            conn.request(method, path)
+            response = conn.getresponse()
+            return response.status, response.getheader("Content-Type"), response.read()
+        finally:
+            conn.close()
+
+    def _beat(self, frame_time: float) -> None:
+        for camera in ("cam", "other"):
+            self.processor.metrics.camera(camera, ROLE_CAPTURER).set("frame_time", frame_time)
+
+    def test_metrics_exposition(self):
+        self.processor.metrics.camera("cam", ROLE_CAPTURER).inc("frames", 3)
+        self.processor.metrics.camera("cam", ROLE_DETECTOR).observe("motion", 0.002)
+        status, content_type, body = self._request("/metrics")
+        self.assertEqual(status, 200)
+        self.assertTrue(content_type.startswith("text/plain; version=0.0.4"))
+        lines = body.decode().splitlines()
+        families = set()
+        for line in lines:
+            if line.startswith("# TYPE "):
+                families.add(line.split()[2])
+            elif not line.startswith("# HELP "):
+                self.assertRegex(line, SAMPLE)
+                # every sample follows the type of its family
+                self.assertIn(re.sub(r"_(bucket|sum|count)$", "", line.split("{")[0].split()[0]),
+                              families)
+        self.assertIn('edge_camera_frames_total{camera="cam"} 3.0', lines)
+        self.assertIn('edge_camera_frames_total{camera="other"} 0.0', lines)
+        self.assertIn('edge_stage_latency_seconds_count{camera="cam",stage="motion"} 1.0',
+                      lines)
+        self.assertTrue(any(line.startswith(
+            'edge_process_cpu_seconds_total{camera="cam",process="detector"}')
+            for line in lines))
+
+    def test_health(self):
+        self._beat(time.time())
+        status, _, body = self._request("/health")
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)["healthy"])
+        # no frame for too long
+        self._beat(time.time() - STALE_FRAME_SECONDS - 1)
+        status, _, body = self._request("/health")
+        self.assertEqual(status, 503)
+        self.assertFalse(json.loads(body)["cameras"]["cam"]["healthy"])
+        self._beat(time.time())
+        self.processor.capturer_info["other"]["detector_process"].alive = False
+        status, _, body = self._request("/health")
+        self.assertEqual(status, 503)
+        cameras = json.loads(body)["cameras"]
+        self.assertTrue(cameras["cam"]["healthy"])
+        self.assertFalse(cameras["other"]["detector"])
+
+    def test_unknown_path(self):
+        self.assertEqual(self._request("/nope")[0], 404)
+        self.assertEqual(self._request("/nope", method="POST")[0], 404)
+
+    def test_profile_rejects_invalid_duration(self):
+        for duration in ("nan", "-1", "abc"):
+            status, _, _ = self._request(f"/profile?camera=cam&duration={duration}",
+                                         method="POST")
+            self.assertEqual(status, 400)
+
+    def test_profile_rejects_cprofile_of_a_capturer(self):
+        status, _, body = self._request("/profile?camera=cam&role=capturer&mode=cprofile",
+                                        method="POST")
+        self.assertEqual(status, 400)
+        self.assertIn(b"sample mode", body)
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from edge.config import DatabaseConfig
+from edge.storage.sqlite import PRUNE_EVENTS, SqliteEventStore
+
+
+class TestSqliteEventStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "edge.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_write_behind(self):
+        store = SqliteEventStore(config=DatabaseConfig(
+            path=self.path, batch_size=10, flush_interval=0.1))
+        store.start()
+        store.ready.wait(timeout=5)
+        now = time.time()
+        for i in range(25):
+            store.put({"id": str(i), "camera": "front" if i % 2 else "back",
+                       "label": "motion", "start_time": now + i})
+        store.put({"id": "3", "camera": "front", "label": "motion",
+                   "start_time": now + 3, "end_time": now + 4,
+                   "data": {"boxes": 2}})
+        store.stop()
+
+        self.assertEqual(store.written, 26)
+        front = store.query(camera="front")
+        self.assertEqual(len(front), 12)
+        self.assertEqual(front[0]["id"], "23")
+        updated = [e for e in front if e["id"] == "3"][0]
+        self.assertEqual(updated["end_time"], now + 4)
+        self.assertEqual(updated["data"], {"boxes": 2})
+        with sqlite3.connect(self.path) as db:
+            mode = db.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_prune_in_chunks(self):
+        store = SqliteEventStore(config=DatabaseConfig(
+            path=self.path, flush_interval=0.05, retain_days=1, prune_chunk=4),
+            prune_interval=3600)
+        old = time.time() - 2 * 86400
+        for i in range(10):
+            store.put({"id": f"old{i}", "camera": "front",
+                       "label": "motion", "start_time": old + i})
+        store.put({"id": "new", "camera": "front",
+                   "label": "motion", "start_time": time.time()})
+        store.start()
+        deadline = time.monotonic() + 5
+        while store.pruned < 10 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        store.stop()
+
+        self.assertEqual(store.pruned, 10)
+        self.assertEqual([e["id"] for e in store.query()], ["new"])
+
+    def test_prune_reads_the_start_time_index(self):
+        store = SqliteEventStore(config=DatabaseConfig(path=self.path))
+        store.start()
+        store.ready.wait(timeout=5)
+        store.stop()
+        with sqlite3.connect(self.path) as db:
+            plan = db.execute(f"EXPLAIN QUERY PLAN {PRUNE_EVENTS}", (0.0, 4)).fetchall()
+        # a search of the index, not a scan of the table
+        details = [row[-1] for row in plan]
+        self.assertTrue(any("USING COVERING INDEX events_start (start_time<?)" in d
+                            for d in details), details)
+        self.assertFalse(any(d.startswith("SCAN") for d in details), details)
+
+
+if __name__ == "__main__":
+    unittest.main()
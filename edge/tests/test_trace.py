@@ -0,0 +1,62 @@
+import multiprocessing as mp
+import unittest
+from edge.utils.trace import TraceRing
+
+
+def _consume(traces: TraceRing, frame_times) -> None:
+    trace = traces.camera("front")
+    for frame_time in frame_times:
+        record = trace.find(frame_time)
+        if record >= 0:
+            trace.mark(record, "picked_up", frame_time + 0.010)
+            trace.mark(record, "motion", frame_time + 0.015)
+            trace.mark(record, "detected", frame_time + 0.020)
+
+
+class TestTraceRing(unittest.TestCase):
+    def setUp(self) -> None:
+        self.traces = TraceRing(
+            cameras=["front", "back"], ring_size=4, sample_every=3)
+
+    def tearDown(self) -> None:
+        self.traces.close()
+
+    def test_sampled_frames_across_processes(self):
+        trace = self.traces.camera("front")
+        frame_times = [100.0 + i for i in range(9)]
+        for frame_time in frame_times:
+            if trace.sample():
+                record = trace.begin(frame_time, read=frame_time)
+                trace.mark(record, "published", frame_time + 0.001)
+        proc = mp.Process(target=_consume, args=(self.traces, frame_times))
+        proc.start()
+        proc.join()
+
+        records = self.traces.records()
+        # only every third frame is sampled
+        self.assertEqual([r["frame_time"] for r in records], [102.0, 105.0, 108.0])
+        self.assertAlmostEqual(records[0]["age"], 0.020)
+        self.assertEqual(self.traces.records(camera="back"), [])
+
+    def test_chrome_trace(self):
+        trace = self.traces.camera("back")
+        for _ in range(3):
+            trace.sample()
+        record = trace.begin(5.0, read=5.0)
+        trace.mark(record, "published", 5.5)
+        events = self.traces.chrome_trace()["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X"]
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]["name"], "publish")
+        self.assertEqual(spans[0]["pid"], 1)
+        self.assertAlmostEqual(spans[0]["dur"], 500000)
+
+    def test_ring_is_bounded(self):
+        trace = self.traces.camera("front")
+        for i in range(30):
+            trace.begin(float(i + 1), read=float(i + 1))
+        self.assertEqual(len(self.traces.records()), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
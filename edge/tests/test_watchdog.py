@@ -0,0 +1,87 @@
+import unittest
+from edge.config import CameraConfig, WatchdogConfig
+from edge.utils.metrics import ROLE_CAPTURER, ROLE_DETECTOR, MetricsRegistry
+from edge.utils.watchdog import Watchdog
+
+
+class TestWatchdog(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry(cameras=["front"])
+        self.capturer = self.registry.camera("front", ROLE_CAPTURER)
+        self.detector = self.registry.camera("front", ROLE_DETECTOR)
+        self.watchdog = Watchdog(
+            metrics=self.registry,
+            cameras={"front": CameraConfig(detect={"fps": 2})},
+            config=WatchdogConfig(startup_grace=1.0, reset_after=30.0))
+        self.watchdog.started("front", now=100.0)
+
+    def tearDown(self) -> None:
+        self.registry.close()
+
+    def _run(self, start: float, end: float, fps: float, detect: bool = True):
+        # beats both stages at fps and checks every second, like the supervisor
+        now, failures = start, []
+        while now < end:
+            now = round(now + 1 / fps, 6)
+            self.capturer.beat("capture", now)
+            if detect:
+                self.detector.beat("detect", now)
+            if int(now) != int(now - 1 / fps):
+                failure = self.watchdog.check("front", now=now)
+                if failure is not None:
+                    failures.append((now, failure))
+        return failures
+
+    def test_thresholds_follow_detect_fps(self):
+        # 10 frames at 2 fps, 4x the fps is an overrun
+        self.assertEqual(self.watchdog.limits["front"], (5.0, 4.0))
+
+    def test_healthy_pipeline(self):
+        self.assertEqual(self._run(100.0, 130.0, fps=2), [])
+
+    def test_detector_stall_is_found_within_seconds(self):
+        self._run(100.0, 110.0, fps=2)
+        failures = self._run(110.0, 130.0, fps=2, detect=False)
+        when, (stage, level) = failures[0]
+        self.assertEqual((stage, level), ("detect", 1))
+        self.assertLessEqual(when - 110.0, 6.0)
+
+    def test_capture_stall_escalates(self):
+        self._run(100.0, 110.0, fps=2)
+        levels = [self.watchdog.check("front", now=t) for t in range(110, 150)]
+        failures = [f for f in levels if f is not None]
+        self.assertEqual(failures[:3], [("capture", 1), ("capture", 2), ("capture", 3)])
+
+    def test_capture_overrun(self):
+        failures = self._run(100.0, 120.0, fps=10)
+        self.assertEqual(failures[0][1], ("capture", 1))
+
+    def test_replay_overrun(self):
+        # as fast as the detector consumes, never an overrun
+        self.watchdog.set_camera("front", CameraConfig(
+            detect={"fps": 2}, replay={"path": "front.raw", "mode": "fastest"}))
+        self.assertEqual(self._run(100.0, 120.0, fps=50), [])
+        # at a fixed rate, the limit follows the replay fps
+        self.watchdog.set_camera("front", CameraConfig(
+            detect={"fps": 2}, replay={"path": "front.raw", "mode": "fixed", "fps": 10}))
+        self.watchdog.started("front", now=120.0)
+        self.assertEqual(self._run(120.0, 140.0, fps=10), [])
+        failures = self._run(140.0, 160.0, fps=50)
+        self.assertEqual(failures[0][1], ("capture", 1))
+
+    def test_level_resets_after_healthy_period(self):
+        self._run(100.0, 110.0, fps=2)
+        self._run(110.0, 118.0, fps=2, detect=False)
+        self.assertEqual(self._run(118.0, 160.0, fps=2), [])
+        failures = self._run(160.0, 170.0, fps=2, detect=False)
+        self.assertEqual(failures[0][1], ("detect", 1))
+
+    def test_no_verdict_over_the_shm_budget(self):
+        self.capturer.set("shm_over_budget", 1)
+        # the capturer drops every frame, nothing beats
+        for now in range(101, 131):
+            self.assertIsNone(self.watchdog.check("front", now=float(now)))
+        self.capturer.set("shm_over_budget", 0)
+        # a grace period from the last check, then the stall is seen again
+        self.assertIsNone(self.watchdog.check("front", now=130.5))
+        self.assertEqual(self.watchdog.check("front", now=137.0), ("capture", 1))
@@ -0,0 +1,38 @@
+import random
+import time
+from typing import Callable, Optional
+
+
+class Backoff:
+    """
+    Exponential restart delays with jitter, per restarted component.
+
+    The first restart happens after about `base` seconds, every failure
+    doubles the delay up to `cap`, and half of each delay is randomized so
+    that cameras going down together do not restart in lockstep. Once the
+    component has been up for `reset_after` seconds it starts over from `base`.
+    """
+
+    def __init__(self,
+                 base: float = 0.1,
+                 cap: float = 30.0,
+                 reset_after: float = 60.0,
+                 rng: Callable[[], float] = random.random) -> None:
+        self.base = base
+        self.cap = cap
+        self.reset_after = reset_after
+        self.rng = rng
+        self.failures = 0
+        self.started_at: Optional[float] = None
+
+    def started(self, now: Optional[float] = None) -> None:
+        self.started_at = time.monotonic() if now is None else now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        # Returns how long to wait before the next restart
+        now = time.monotonic() if now is None else now
+        if self.started_at is not None and now - self.started_at >= self.reset_after:
+            self.failures = 0
+        delay = min(self.cap, self.base * 2 ** self.failures)
+        self.failures += 1
+        return delay / 2 + self.rng() * delay / 2
@@ -1,15 +1,120 @@
-from watchdog.events import FileSystemEvent, FileSystemEventHandler
-from typing import Any, List
+from typing import Any, Dict, List, Optional, Set
+import multiprocessing as mp
+import queue
 import shlex
 
+# What applying a camera change takes, from the least disruptive:
+# the detector picks it up live, the capturer restarts FFmpeg, or a
+# process of the camera is restarted
+APPLY_LIVE = "live"
+APPLY_FFMPEG = "ffmpeg"
+APPLY_DETECTOR = "detector"
+APPLY_CAPTURER = "capturer"
 
-class ConfigChangeHandler(FileSystemEventHandler):
-    def __init__(self, on_modified: any) -> None:
-        self._on_modified = on_modified
-        return
+CAMERA_FIELDS = {
+    "name": {APPLY_LIVE},
+    "best_image_timeout": {APPLY_LIVE},
+    "motion": {APPLY_LIVE},
+    "mqtt": {APPLY_DETECTOR},
+    "source": {APPLY_FFMPEG},
+    "record": {APPLY_CAPTURER},
+    "replay": {APPLY_CAPTURER},
+    "shedding": {APPLY_LIVE},
+    # the layout of the shared memory of the frames
+    "pyramid": {APPLY_CAPTURER, APPLY_DETECTOR},
+}
+DETECT_FIELDS = {
+    # the frame shape is baked into the shared memory and the detector
+    "width": {APPLY_CAPTURER, APPLY_DETECTOR},
+    "height": {APPLY_CAPTURER, APPLY_DETECTOR},
+    "fps": {APPLY_FFMPEG, APPLY_LIVE},
+}
+SOURCE_FIELDS = {
+    # a different provider
+    "backend": {APPLY_CAPTURER},
+}
+# sections of the edge configuration the parent applies by itself,
+# a change anywhere else restarts the whole pipeline
+PARENT_SECTIONS = {"logger", "http", "profiling", "watchdog", "restart",
+                   "load_shedding"}
 
-    def on_modified(self, event: FileSystemEvent) -> None:
-        if event.is_directory:
-            return
-        if self._on_modified is not None:
-            self._on_modified(event.src_path)
\ No newline at end of file
+
+def _changed_fields(old, new) -> List[str]:
+    return [field for field in type(new).model_fields
+            if getattr(old, field) != getattr(new, field)]
+
+
+def diff_camera(old, new) -> Set[str]:
+    # Returns how a change of a running camera must be applied
+    actions = set()
+    for field in _changed_fields(old, new):
+        if field == "detect":
+            for detect_field in _changed_fields(old.detect, new.detect):
+                actions |= DETECT_FIELDS.get(detect_field, {APPLY_LIVE})
+        elif field == "source" and old.source is not None and new.source is not None:
+            for source_field in _changed_fields(old.source, new.source):
+                actions |= SOURCE_FIELDS.get(source_field, {APPLY_FFMPEG})
+        else:
+            actions |= CAMERA_FIELDS.get(field, {APPLY_CAPTURER, APPLY_DETECTOR})
+    # the motion level of the frame pyramid is laid out at the motion frame height
+    if new.pyramid.enabled and old.motion is not None and new.motion is not None \
+            and old.motion.frame_height != new.motion.frame_height:
+        actions |= {APPLY_CAPTURER, APPLY_DETECTOR}
+    return actions
+
+
+class ConfigDiff:
+    def __init__(self, old, new) -> None:
+        self.sections = set(_changed_fields(old, new)) - {"cameras"}
+        # only the cameras in both configurations can restart in place
+        self.full = bool(self.sections - PARENT_SECTIONS)
+        running = {n for n, c in old.cameras.items() if c.enabled}
+        wanted = {n for n, c in new.cameras.items() if c.enabled}
+        self.added = sorted(wanted - running)
+        self.removed = sorted(running - wanted)
+        self.changed: Dict[str, Set[str]] = {}
+        for name in sorted(running & wanted):
+            actions = diff_camera(old.cameras[name], new.cameras[name])
+            if actions:
+                self.changed[name] = actions
+
+    @property
+    def empty(self) -> bool:
+        return not (self.sections or self.added or self.removed or self.changed)
+
+
+class ConfigChannel:
+    """
+    Hands new camera configurations from the parent to a running process.
+
+    The consumer compares a shared version number on every frame and only
+    touches the queue when it moved, so an idle channel costs a memory read.
+    """
+
+    def __init__(self) -> None:
+        self.queue = mp.Queue()
+        self.version = mp.RawValue("i", 0)
+        self.seen = 0
+
+    def publish(self, config: Any) -> None:
+        self.queue.put(config)
+        self.version.value += 1
+
+    def poll(self) -> Optional[Any]:
+        if self.version.value == self.seen:
+            return None
+        # the version is bumped after the put, so the item is on its way
+        return self.wait(timeout=1.0)
+
+    def wait(self, timeout: float) -> Optional[Any]:
+        try:
+            latest = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.seen += 1
+        while True:
+            try:
+                latest = self.queue.get_nowait()
+            except queue.Empty:
+                return latest
+            self.seen += 1
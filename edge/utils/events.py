@@ -1,43 +1,108 @@
-import datetime
-from datetime import datetime as dt
+import time
+from typing import Optional, Sequence
+import numpy as np
+
+# Layout of the float64 buffer: start time, time of the last event and
+# position in the interval ring, then the bucket epochs and counts and
+# finally the ring of the last inter-event intervals
+_START = 0
+_LAST = 1
+_POSITION = 2
+_HEADER = 3
 
 
 class EventsPerSecond:
+    """
+    Rolling event rate over the last `last_n_seconds`.
+
+    Events are counted in time buckets of 1/`resolution` seconds kept in a
+    ring, each bucket tagged with the absolute bucket number it counts. An
+    update touches a single bucket and reading only sums the buckets that
+    are still inside the window, without modifying anything, so the counter
+    has a fixed size and another process can read it while one writes.
+    The last `jitter_samples` intervals between events are kept as well to
+    estimate the jitter with `percentiles()`.
+
+    When `buffer` is given, the counter lives in that float64 memoryview
+    (see `size()`), for example inside a shared memory block.
+    """
+
     def __init__(self,
-                 max_events=1000,
-                 last_n_seconds=10) -> None:
-        self._start = None
-        self._max_events = max_events
+                 last_n_seconds: int = 10,
+                 resolution: int = 4,
+                 jitter_samples: int = 64,
+                 buffer: Optional[memoryview] = None) -> None:
         self._last_n_seconds = last_n_seconds
-        self._timestamps = []
+        self._resolution = resolution
+        self._buckets = last_n_seconds * resolution
+        self._samples = jitter_samples
+        self._epochs = _HEADER
+        self._counts = _HEADER + self._buckets
+        self._intervals = _HEADER + 2 * self._buckets
+        if buffer is None:
+            buffer = memoryview(bytearray(8 * self.size(
+                last_n_seconds, resolution, jitter_samples))).cast("d")
+        self._buf = buffer
 
-    def start(self) -> None:
-        self._start = self.now()
+    @staticmethod
+    def size(last_n_seconds: int = 10,
+             resolution: int = 4,
+             jitter_samples: int = 64) -> int:
+        # number of float64 values needed by the counter
+        return _HEADER + 2 * last_n_seconds * resolution + jitter_samples
 
     def now(self) -> float:
-        return dt.now() \
-            .timestamp()
+        return time.monotonic()
+
+    def start(self) -> None:
+        self._buf[_START] = self.now()
+
+    def reset(self) -> None:
+        for i in range(self._epochs, self._intervals + self._samples):
+            self._buf[i] = 0
+        self._buf[_LAST] = 0
+        self.start()
 
     def update(self) -> None:
         now = self.now()
-        if self._start is None:
-            self._start = now
-        self._timestamps.append(now)
-        if len(self._timestamps) > (self._max_events + 100):
-            self._timestamps[(1-self._max_events):]
-        self.expire_timestamps(now)
+        buf = self._buf
+        if buf[_START] == 0:
+            buf[_START] = now
+        epoch = int(now * self._resolution)
+        slot = epoch % self._buckets
+        if buf[self._epochs + slot] != epoch:
+            buf[self._counts + slot] = 0
+            buf[self._epochs + slot] = epoch
+        buf[self._counts + slot] += 1
+        if buf[_LAST]:
+            position = int(buf[_POSITION])
+            buf[self._intervals + position] = now - buf[_LAST]
+            buf[_POSITION] = (position + 1) % self._samples
+        buf[_LAST] = now
 
     def eps(self) -> float:
         now = self.now()
-        if self._start is None:
-            self._start = now
-        self.expire_timestamps(now)
-        seconds = min(now - self._start, self._last_n_seconds)
-        if seconds == 0:
-            seconds = 1
-        return len(self._timestamps) / seconds
-
-    def expire_timestamps(self, now):
-        threshold = now - self._last_n_seconds
-        while self._timestamps and self._timestamps[0] < threshold:
-            del self._timestamps[0]
+        start = self._buf[_START]
+        if start == 0:
+            return 0.0
+        oldest = int(now * self._resolution) - self._buckets
+        total = 0.0
+        for slot in range(self._buckets):
+            if self._buf[self._epochs + slot] > oldest:
+                total += self._buf[self._counts + slot]
+        # a window shorter than a second would inflate the first readings
+        seconds = max(1.0, min(now - start, self._last_n_seconds))
+        return total / seconds
+
+    def release(self) -> None:
+        self._buf.release()
+
+    def percentiles(self, qs: Sequence[float] = (50, 99)) -> Sequence[float]:
+        # percentiles of the last intervals between events, in seconds
+        intervals = np.frombuffer(
+            self._buf, dtype=np.float64,
+            count=self._samples, offset=self._intervals * 8)
+        intervals = intervals[intervals > 0]
+        if len(intervals) == 0:
+            return [0.0 for _ in qs]
+        return np.percentile(intervals, qs).tolist()
@@ -1,8 +1,18 @@
 from abc import ABC, abstractmethod
-from typing import AnyStr
+import os
+import threading
+import time
+from typing import AnyStr, Dict, Iterable, List, Optional, Tuple
 from multiprocessing import shared_memory
 from loguru import logger
 import numpy as np
+from edge.stats import SHM_PATH
+from edge.utils.metrics import ROLE_CAPTURER, MetricsRegistry
+
+
+def frame_name(camera: str, frame_time: float) -> str:
+    # The name of a frame in the frame store, the frame time never has a dash
+    return f"{camera}-{frame_time}"
 
 
 class FrameManager(ABC):
@@ -27,20 +37,22 @@ class FrameManager(ABC):
 
 
 class SharedMemoryFrameManager(FrameManager):
-    def __init__(self) -> None:
+    def __init__(self, prefix: str = "") -> None:
+        # the segments are named after the edge instance, see FrameMemory
+        self.prefix = prefix
         self.shm_store = {}
         self.stopped = False
 
     def create(self, name: str, size) -> AnyStr:
         if self.stopped:
             return None
-        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm = shared_memory.SharedMemory(name=self.prefix + name, create=True, size=size)
         self.shm_store[name] = shm
         return shm.buf
 
     def get(self, name: str, shape):
         if name not in self.shm_store:
-            shm = shared_memory.SharedMemory(name=name)
+            shm = shared_memory.SharedMemory(name=self.prefix + name)
             self.shm_store[name] = shm
         else:
             shm = self.shm_store[name]
@@ -58,13 +70,171 @@ class SharedMemoryFrameManager(FrameManager):
         if name in self.shm_store:
             shm: shared_memory.SharedMemory = self.shm_store[name]
             shm.close()
-            shm.unlink()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                # swept as an orphan while it was held
+                pass
             del self.shm_store[name]
 
     def clean(self):
         self.stopped = True
         for shm in self.shm_store.values():
             shm.close()
-            shm.unlink()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                # already deleted by the process it was handed to
+                continue
             logger.debug(f"Shared memory {shm.name} unlinked")
         self.shm_store.clear()
+
+
+class LocalFrameManager(FrameManager):
+    """
+    The frames of a camera whose motion is detected in its capturer
+    process, handed from the capturer thread to the detection thread by
+    name. Nothing is mapped or unlinked, the buffer of a deleted frame is
+    kept for the next one.
+    """
+
+    def __init__(self, pool: int = 4) -> None:
+        self.store: Dict[str, bytearray] = {}
+        self.free: List[bytearray] = []
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def create(self, name: str, size) -> AnyStr:
+        if self.stopped:
+            return None
+        with self.lock:
+            if self.free and len(self.free[-1]) == size:
+                buffer = self.free.pop()
+            else:
+                buffer = bytearray(size)
+            self.store[name] = buffer
+        return memoryview(buffer)
+
+    def get(self, name: str, shape):
+        with self.lock:
+            buffer = self.store[name]
+        return np.ndarray(shape=shape, dtype=np.uint8, buffer=buffer)
+
+    # The frame stays in the store for the detection thread
+    def close(self, name: str):
+        pass
+
+    def delete(self, name: str):
+        with self.lock:
+            buffer = self.store.pop(name, None)
+            if buffer is not None and len(self.free) < self.pool:
+                self.free.append(buffer)
+
+    def clean(self):
+        self.stopped = True
+        with self.lock:
+            self.store.clear()
+            self.free.clear()
+
+
+class FrameMemory:
+    """
+    The shared memory of the frames of an edge instance, owned by the parent.
+
+    The segments are named after the instance, the camera and the frame
+    time, so that the usage of every camera can be summed up from SHM_PATH
+    and the segments left behind by a process killed between creating and
+    deleting a frame can be swept. Past the budget, the capturers of every
+    camera stop creating frames until the detectors caught up, told by the
+    shm_over_budget gauge of their metrics.
+    """
+
+    def __init__(self,
+                 instance: str,
+                 metrics: MetricsRegistry,
+                 budget: int = 0,
+                 orphan_age: float = 10.0,
+                 path: str = SHM_PATH) -> None:
+        self.prefix = f"{instance}."
+        self.metrics = metrics
+        # bytes, no limit when zero
+        self.budget = budget
+        self.orphan_age = orphan_age
+        self.path = path
+        self.over_budget = False
+        self.swept = 0
+        # when a process of each camera last crashed, its frames from before
+        # are swept once the live ones among them have been consumed
+        self.crashes: Dict[str, float] = {}
+
+    def segments(self) -> List[Tuple[str, str, float, int]]:
+        # (file name, camera, frame time, bytes) of the frames of the instance
+        segments = []
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError:
+            return segments
+        for entry in entries:
+            if not entry.name.startswith(self.prefix):
+                continue
+            camera, _, frame_time = entry.name[len(self.prefix):].rpartition("-")
+            try:
+                segments.append((entry.name, camera, float(frame_time),
+                                 entry.stat().st_blocks * 512))
+            except (ValueError, OSError):
+                continue
+        return segments
+
+    def usage(self) -> Dict[str, int]:
+        usage: Dict[str, int] = {}
+        for _, camera, _, size in self.segments():
+            usage[camera] = usage.get(camera, 0) + size
+        return usage
+
+    def sweep(self, cameras: Optional[Iterable[str]] = None,
+              before: Optional[float] = None) -> int:
+        # Unlinks the frames of the cameras, of every camera when None, with
+        # a frame time before `before`, all of them when None
+        cameras = set(cameras) if cameras is not None else None
+        swept = 0
+        for name, camera, frame_time, _ in self.segments():
+            if cameras is not None and camera not in cameras:
+                continue
+            if before is not None and frame_time >= before:
+                continue
+            try:
+                os.unlink(os.path.join(self.path, name))
+            except OSError:
+                continue
+            swept += 1
+        if swept:
+            logger.warning(f"FrameMemory: Swept {swept} orphaned frames")
+        self.swept += swept
+        return swept
+
+    def crashed(self, cameras: Iterable[str]) -> None:
+        now = time.time()
+        for camera in cameras:
+            self.crashes[camera] = now
+
+    def check(self, cameras: Iterable[str]) -> Dict[str, int]:
+        # Sweeps after the crashes, reports the usage of every camera and
+        # enforces the budget
+        now = time.time()
+        for camera, crashed in list(self.crashes.items()):
+            if now - crashed >= self.orphan_age:
+                del self.crashes[camera]
+                self.sweep([camera], before=crashed)
+        usage = self.usage()
+        total = sum(usage.values())
+        over_budget = bool(self.budget) and total >= self.budget
+        if over_budget != self.over_budget:
+            logger.warning(f"FrameMemory: {total} bytes of frames, budget of {self.budget} "
+                           + ("exceeded, capturers paused" if over_budget else "respected again"))
+            self.over_budget = over_budget
+        for camera in cameras:
+            metrics = self.metrics.camera(camera, ROLE_CAPTURER)
+            metrics.set("shm_bytes", usage.get(camera, 0))
+            metrics.set("shm_over_budget", int(over_budget))
+        return usage
@@ -0,0 +1,87 @@
+import sys
+import time
+from typing import Callable, Dict, Tuple
+from loguru import logger
+
+DEFAULT_SUMMARY_INTERVAL = 10.0
+
+
+def configure_logging(level: str = "INFO") -> None:
+    # The sink is enqueued: callers only put the record on a queue and the
+    # formatting and writing to stdout happen on loguru's worker thread.
+    # Calling it again stops that thread, so every camera process configures
+    # a sink of its own, see camera_process.
+    logger.remove()
+    logger.add(sys.stdout, colorize=False, enqueue=True, level=level.upper())
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def allow(self) -> bool:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RateLimitedLogger:
+    """
+    Logs repeated messages through a token bucket per key.
+
+    Messages over the limit are counted instead of written, and the number
+    of suppressed messages is reported with the next one that goes through.
+    Arguments are formatted by loguru only when the message is emitted.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.buckets: Dict[str, Tuple[TokenBucket, int]] = {}
+
+    def _log(self, level: str, key: str, message: str, args) -> bool:
+        bucket, suppressed = self.buckets.get(key, (None, 0))
+        if bucket is None:
+            bucket = TokenBucket(rate=self.rate, burst=self.burst, clock=self.clock)
+        if not bucket.allow():
+            self.buckets[key] = (bucket, suppressed + 1)
+            return False
+        self.buckets[key] = (bucket, 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        logger.opt(depth=2).log(level, message, *args)
+        return True
+
+    def error(self, key: str, message: str, *args) -> bool:
+        return self._log("ERROR", key, message, args)
+
+    def warning(self, key: str, message: str, *args) -> bool:
+        return self._log("WARNING", key, message, args)
+
+
+class PeriodicSummary:
+    # Tells the hot loop when it is time to log its summary again
+    def __init__(self, interval: float = DEFAULT_SUMMARY_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.interval = interval
+        self.clock = clock
+        self.next = clock() + interval
+
+    def ready(self) -> bool:
+        now = self.clock()
+        if now < self.next:
+            return False
+        self.next = now + self.interval
+        return True
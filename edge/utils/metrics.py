@@ -0,0 +1,274 @@
+from bisect import bisect_left
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from edge.utils.events import EventsPerSecond
+
+ROLE_CAPTURER = "capturer"
+ROLE_DETECTOR = "detector"
+ROLES = (ROLE_CAPTURER, ROLE_DETECTOR)
+
+# Each gauge and rate is written by a single role, the others leave it at zero.
+# shed_level is written by the parent process into the detector slot,
+# shm_bytes and shm_over_budget into the capturer slot.
+GAUGES = (
+    "ffmpeg_pid",
+    "frame_time",
+    "detection_frame",
+    "shed_level",
+    "shm_bytes",
+    "shm_over_budget",
+    # only known when decoding in process
+    "frame_pts",
+)
+
+COUNTERS = (
+    "frames",
+    "skipped_frames",
+    "read_errors",
+    "decode_restarts",
+    # messages of FFmpeg on its standard error, see edge.utils.pipe
+    "ffmpeg_corrupt_frames",
+    "ffmpeg_reconnects",
+    "ffmpeg_decode_errors",
+    "keyframes",
+    "shm_dropped_frames",
+    "detected_frames",
+    "shed_frames",
+)
+
+# Rolling rates, kept as EventsPerSecond counters inside the slot
+RATES = ("fps", "skipped_fps", "detection_fps")
+
+STAGES = ("read", "publish", "motion", "detect", "publish_event")
+
+# Pipeline stages that report progress to the watchdog, in pipeline order
+HEARTBEATS = ("capture", "detect")
+
+# Upper bounds in seconds, the last bucket catches everything slower
+HISTOGRAM_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float("inf"),
+)
+
+GAUGE_INDEX = {name: i for i, name in enumerate(GAUGES)}
+COUNTER_INDEX = {name: len(GAUGES) + i for i, name in enumerate(COUNTERS)}
+STAGE_INDEX = {name: i for i, name in enumerate(STAGES)}
+
+_HISTOGRAMS_OFFSET = len(GAUGES) + len(COUNTERS)
+# buckets, then the sum and the count of the observations
+_HISTOGRAM_SIZE = len(HISTOGRAM_BUCKETS) + 2
+_RATES_OFFSET = _HISTOGRAMS_OFFSET + len(STAGES) * _HISTOGRAM_SIZE
+_RATE_SIZE = EventsPerSecond.size()
+RATE_INDEX = {name: _RATES_OFFSET + i * _RATE_SIZE
+              for i, name in enumerate(RATES)}
+_HEARTBEATS_OFFSET = _RATES_OFFSET + len(RATES) * _RATE_SIZE
+# beat count and the monotonic time of the last beat
+HEARTBEAT_INDEX = {name: _HEARTBEATS_OFFSET + i * 2
+                   for i, name in enumerate(HEARTBEATS)}
+SLOT_SIZE = _HEARTBEATS_OFFSET + len(HEARTBEATS) * 2
+
+
+class CameraMetrics:
+    # Writer side of a single (camera, role) slot. Only one process writes
+    # to a slot, so updates are plain stores into shared memory without locks.
+    def __init__(self, buf: memoryview, slot: int) -> None:
+        self._buf = buf
+        self._base = slot * SLOT_SIZE
+        self._rates = {
+            name: EventsPerSecond(
+                buffer=buf[self._base + offset:self._base + offset + _RATE_SIZE])
+            for name, offset in RATE_INDEX.items()
+        }
+
+    def release(self) -> None:
+        for rate in self._rates.values():
+            rate.release()
+
+    def rate(self, name: str) -> EventsPerSecond:
+        return self._rates[name]
+
+    def set(self, name: str, value: float) -> None:
+        self._buf[self._base + GAUGE_INDEX[name]] = value
+
+    def get(self, name: str) -> float:
+        if name in self._rates:
+            return self._rates[name].eps()
+        if name in GAUGE_INDEX:
+            return self._buf[self._base + GAUGE_INDEX[name]]
+        return self._buf[self._base + COUNTER_INDEX[name]]
+
+    def inc(self, name: str, value: float = 1) -> None:
+        self._buf[self._base + COUNTER_INDEX[name]] += value
+
+    def beat(self, stage: str, now: float) -> None:
+        index = self._base + HEARTBEAT_INDEX[stage]
+        self._buf[index] += 1
+        self._buf[index + 1] = now
+
+    def observe(self, stage: str, seconds: float) -> None:
+        base = self._base + _HISTOGRAMS_OFFSET + \
+            STAGE_INDEX[stage] * _HISTOGRAM_SIZE
+        bucket = bisect_left(HISTOGRAM_BUCKETS, seconds)
+        self._buf[base + bucket] += 1
+        self._buf[base + len(HISTOGRAM_BUCKETS)] += seconds
+        self._buf[base + len(HISTOGRAM_BUCKETS) + 1] += 1
+
+
+class MetricsRegistry:
+    """
+    Metrics of every camera process, backed by a single shared memory block.
+
+    The block holds one slot per (camera, role). Capturer and detector
+    processes write to their own slot through `camera()`, and the parent
+    process aggregates all of them with `snapshot()`. Room is left for
+    `capacity` cameras, so that cameras can be added without a new block.
+    """
+
+    def __init__(self,
+                 cameras: List[str],
+                 name: Optional[str] = None,
+                 create: bool = True,
+                 capacity: int = 0) -> None:
+        self.slots: List[Optional[str]] = list(cameras) + \
+            [None] * max(0, capacity - len(cameras))
+        self.owner = create
+        size = max(1, len(self.slots) * len(ROLES) * SLOT_SIZE) * 8
+        if create:
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self._attach()
+
+    def _attach(self) -> None:
+        count = len(self.slots) * len(ROLES) * SLOT_SIZE
+        self._buf = self.shm.buf[:count * 8].cast("d")
+        self._slots: Dict[Tuple[str, str], CameraMetrics] = {}
+
+    def __getstate__(self):
+        return {"slots": self.slots, "name": self.shm.name}
+
+    def __setstate__(self, state) -> None:
+        self.slots = state["slots"]
+        self.owner = False
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self._attach()
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def cameras(self) -> List[str]:
+        return [camera for camera in self.slots if camera is not None]
+
+    def add_camera(self, camera: str) -> bool:
+        # False when there is no free slot left
+        if camera in self.slots:
+            return True
+        if None not in self.slots:
+            return False
+        self.slots[self.slots.index(None)] = camera
+        for role in ROLES:
+            self.reset(camera, role)
+        return True
+
+    def remove_camera(self, camera: str) -> None:
+        if camera not in self.slots:
+            return
+        for role in ROLES:
+            self.reset(camera, role)
+            slot = self._slots.pop((camera, role), None)
+            if slot is not None:
+                slot.release()
+        self.slots[self.slots.index(camera)] = None
+
+    def camera(self, camera: str, role: str) -> CameraMetrics:
+        key = (camera, role)
+        if key not in self._slots:
+            slot = self.slots.index(camera) * len(ROLES) + ROLES.index(role)
+            self._slots[key] = CameraMetrics(buf=self._buf, slot=slot)
+        return self._slots[key]
+
+    def reset(self, camera: str, role: str) -> None:
+        slot = self.slots.index(camera) * len(ROLES) + ROLES.index(role)
+        self._values()[slot] = 0
+
+    def _values(self) -> np.ndarray:
+        values = np.frombuffer(self._buf, dtype=np.float64)
+        return values.reshape(len(self.slots) * len(ROLES), SLOT_SIZE)
+
+    def heartbeat(self, camera: str, stage: str) -> Tuple[float, float]:
+        # (beat count, last beat), each stage is written by a single role
+        base = self.slots.index(camera) * len(ROLES) * SLOT_SIZE
+        index = HEARTBEAT_INDEX[stage]
+        return max((self._buf[base + role * SLOT_SIZE + index],
+                    self._buf[base + role * SLOT_SIZE + index + 1])
+                   for role in range(len(ROLES)))
+
+    def snapshot(self) -> Dict[str, dict]:
+        # copy once, so that the aggregation does not race with the writers
+        values = self._values().copy().reshape(
+            len(self.slots), len(ROLES), SLOT_SIZE)
+        result = {}
+        for i, camera in enumerate(self.slots):
+            if camera is None:
+                continue
+            gauges = dict(zip(GAUGES, values[i, :, :len(GAUGES)].max(axis=0).tolist()))
+            for name, offset in RATE_INDEX.items():
+                gauges[name] = max(
+                    EventsPerSecond(buffer=memoryview(
+                        values[i, role, offset:offset + _RATE_SIZE])).eps()
+                    for role in range(len(ROLES)))
+            counters = values[i, :, len(GAUGES):_HISTOGRAMS_OFFSET].sum(axis=0)
+            histograms = values[i, :, _HISTOGRAMS_OFFSET:_RATES_OFFSET].sum(axis=0) \
+                .reshape(len(STAGES), _HISTOGRAM_SIZE)
+            result[camera] = {
+                "gauges": gauges,
+                "counters": dict(zip(COUNTERS, counters.tolist())),
+                "stages": {
+                    stage: {
+                        "buckets": np.cumsum(
+                            histograms[s, :len(HISTOGRAM_BUCKETS)]).tolist(),
+                        "sum": float(histograms[s, -2]),
+                        "count": float(histograms[s, -1]),
+                    }
+                    for s, stage in enumerate(STAGES)
+                },
+            }
+        return result
+
+    def close(self) -> None:
+        if self._buf is None:
+            return
+        for slot in self._slots.values():
+            slot.release()
+        self._slots.clear()
+        self._buf.release()
+        self._buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __del__(self) -> None:
+        # release the views before SharedMemory tries to close its buffer
+        if getattr(self, "_buf", None) is not None:
+            for slot in self._slots.values():
+                slot.release()
+            self._slots.clear()
+            self._buf.release()
+            self._buf = None
+
+
+def percentile(buckets: List[float], q: float) -> float:
+    # Estimates a quantile from cumulative histogram buckets
+    total = buckets[-1] if buckets else 0
+    if total == 0:
+        return 0.0
+    rank = q * total
+    for bound, count in zip(HISTOGRAM_BUCKETS, buckets):
+        if count >= rank:
+            return bound
+    return HISTOGRAM_BUCKETS[-1]
@@ -1,31 +1,196 @@
 from collections import deque
 import os
+import re
+import selectors
 import threading
-import logging
-from typing import Deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+from loguru import logger
+from edge.utils.logs import RateLimitedLogger
+from edge.utils.metrics import CameraMetrics
 
+# FFmpeg messages counted as metrics, by the counter they increment, the
+# first pattern that matches a line wins
+FFMPEG_EVENTS: Tuple[Tuple[str, re.Pattern], ...] = (
+    ("ffmpeg_corrupt_frames", re.compile(
+        r"corrupt|concealing \d+|error while decoding MB|invalid NAL|"
+        r"missing picture|non-existing PPS|left block unavailable", re.IGNORECASE)),
+    ("ffmpeg_reconnects", re.compile(
+        r"reconnect|connection (refused|reset|timed out)|end of file|"
+        r"server returned|no route to host|broken pipe|timed out", re.IGNORECASE)),
+    ("ffmpeg_decode_errors", re.compile(
+        r"error while decoding|decode_slice_header|no frame!|failed to (decode|get)|"
+        r"error (submitting|during decoding)|hwaccel.*(error|fail)", re.IGNORECASE)),
+)
+# lines kept per source across the restarts of its FFmpeg
+LOG_RING_SIZE = 1000
 
-class LogPipe(threading.Thread):
-    def __init__(self, log_name: str):
-        threading.Thread.__init__(self)
-        self.logger = logging.getLogger(log_name)
-        self.level = logging.WARNING
-        self.deque: Deque[str] = deque(maxlen=1000)
-        self.fd_read, self.fd_write = os.pipe()
-        self.pipe_reader = os.fdopen(self.fd_read)
-        self.start()
 
-    def fileno(self) -> int:
-        return self.fd_write
+def classify(line: str) -> Optional[str]:
+    # The counter of an FFmpeg message, None for the other messages
+    for counter, pattern in FFMPEG_EVENTS:
+        if pattern.search(line):
+            return counter
+    return None
 
-    def run(self) -> None:
-        for line in iter(self.pipe_reader.readline, ''):
+
+class LogPipe:
+    """
+    The standard error of the FFmpeg of a source.
+
+    Every FFmpeg started gets a pipe of its own, read by the LogCollector of
+    the process, while the ring of the last lines and the counts of the
+    messages outlive its restarts.
+    """
+
+    def __init__(self,
+                 log_name: str,
+                 metrics: Sequence[CameraMetrics] = (),
+                 collector: Optional["LogCollector"] = None) -> None:
+        self.log_name = log_name
+        self.metrics = list(metrics)
+        self.collector = collector or log_collector()
+        # FFmpeg can print a line per corrupted frame, only a few are logged
+        # as they arrive, everything is kept for dump()
+        self.limiter = RateLimitedLogger(rate=0.2, burst=5)
+        self.lock = threading.Lock()
+        self.deque: Deque[str] = deque(maxlen=LOG_RING_SIZE)
+        self.events: Dict[str, int] = {counter: 0 for counter, _ in FFMPEG_EVENTS}
+        # lines received, and received when dump() last ran
+        self.received = 0
+        self.dumped = 0
+
+    def open(self) -> int:
+        # The write end for a new FFmpeg, to be closed once it is started
+        read, write = os.pipe()
+        self.collector.register(read, self)
+        return write
+
+    def write_line(self, line: str) -> None:
+        # called from the collector thread
+        with self.lock:
             self.deque.append(line)
-        self.pipe_reader.close()
+            self.received += 1
+        counter = classify(line)
+        if counter is not None:
+            self.events[counter] += 1
+            for metrics in self.metrics:
+                metrics.inc(counter)
+        self.limiter.warning(self.log_name, "{}: {}", self.log_name, line)
 
-    def dump(self) -> None:
-        while len(self.deque) > 0:
-            self.logger.log(self.level, self.deque.popleft())
+    def lines(self) -> List[str]:
+        with self.lock:
+            return list(self.deque)
+
+    def dump(self, count: int = 100) -> None:
+        # the last lines received since the previous dump, they stay in the ring
+        with self.lock:
+            fresh = min(self.received - self.dumped, len(self.deque), count)
+            lines = list(self.deque)[len(self.deque) - fresh:]
+            self.dumped = self.received
+        for line in lines:
+            logger.warning("{}: {}", self.log_name, line)
 
     def close(self) -> None:
-        os.close(self.fd_write)
+        # stops reading the pipes of FFmpegs that are still around
+        self.collector.unregister(self)
+
+
+class LogCollector(threading.Thread):
+    """
+    Reads the standard error of every FFmpeg of the process from a single
+    thread, multiplexing their pipes with a selector.
+
+    The pipes are registered and unregistered by the collector thread
+    itself, other threads hand them over and wake it up through a pipe.
+    """
+
+    def __init__(self) -> None:
+        threading.Thread.__init__(self, name="ffmpeg:logs", daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+        self.lock = threading.Lock()
+        self.added: List[Tuple[int, LogPipe]] = []
+        self.removed: List[LogPipe] = []
+        # the unfinished last line of each pipe
+        self.partial: Dict[int, bytes] = {}
+
+    def register(self, fd: int, pipe: LogPipe) -> None:
+        with self.lock:
+            self.added.append((fd, pipe))
+        self._wake()
+
+    def unregister(self, pipe: LogPipe) -> None:
+        with self.lock:
+            self.removed.append(pipe)
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            os.write(self.wakeup_write, b"\0")
+        except BlockingIOError:
+            pass
+
+    def run(self) -> None:
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    self._apply()
+                else:
+                    self._read(key.fd, key.data)
+
+    def _apply(self) -> None:
+        try:
+            os.read(self.wakeup_read, 4096)
+        except BlockingIOError:
+            pass
+        with self.lock:
+            added, self.added = self.added, []
+            removed, self.removed = self.removed, []
+        for fd, pipe in added:
+            self.selector.register(fd, selectors.EVENT_READ, pipe)
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None and key.data in removed:
+                self._close(key.fd, key.data)
+
+    def _read(self, fd: int, pipe: LogPipe) -> None:
+        try:
+            data = os.read(fd, 65536)
+        except OSError:
+            data = b""
+        if not data:
+            # FFmpeg exited
+            self._close(fd, pipe)
+            return
+        *lines, self.partial[fd] = (self.partial.get(fd, b"") + data).split(b"\n")
+        for line in lines:
+            self._line(pipe, line)
+
+    def _line(self, pipe: LogPipe, line: bytes) -> None:
+        text = line.decode(errors="replace").rstrip()
+        if text:
+            pipe.write_line(text)
+
+    def _close(self, fd: int, pipe: LogPipe) -> None:
+        rest = self.partial.pop(fd, b"")
+        if rest:
+            self._line(pipe, rest)
+        self.selector.unregister(fd)
+        os.close(fd)
+
+
+_collector: Optional[LogCollector] = None
+_collector_pid: Optional[int] = None
+_collector_lock = threading.Lock()
+
+
+def log_collector() -> LogCollector:
+    # the collector of this process, a forked child starts its own
+    global _collector, _collector_pid
+    with _collector_lock:
+        if _collector is None or _collector_pid != os.getpid():
+            _collector = LogCollector()
+            _collector_pid = os.getpid()
+            _collector.start()
+        return _collector
@@ -0,0 +1,189 @@
+import os
+import subprocess as sp
+import threading
+from typing import Dict, List, Optional, Set
+from loguru import logger
+from edge.config import CameraConfig, PlacementConfig, PlacementModeEnum
+
+# the roles placed by the policy, from the heaviest in the automatic mode
+PLACED_ROLES = ("ffmpeg", "detector", "capturer")
+
+
+def available_cores() -> Set[int]:
+    return set(os.sched_getaffinity(0))
+
+
+def camera_cost(camera: CameraConfig) -> float:
+    # pixels per second is what both decoding and motion detection scale with
+    return (camera.detect.width or 1) * (camera.detect.height or 1) * camera.detect.fps
+
+
+class Placement:
+    """
+    Where and how a single process is scheduled.
+
+    An empty core set or no nice level leaves the scheduling alone. Linux
+    keeps the affinity and the niceness per thread and hands them down to
+    the threads and the processes created afterwards, so apply() has to run
+    before the process starts any thread.
+    """
+
+    def __init__(self,
+                 cores: Optional[List[int]] = None,
+                 nice: Optional[int] = None,
+                 threads: Optional[int] = None) -> None:
+        self.cores = sorted(cores or [])
+        self.nice = nice
+        self.threads = threads
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Placement) and \
+            (self.cores, self.nice, self.threads) == (other.cores, other.nice, other.threads)
+
+    def __repr__(self) -> str:
+        return f"Placement(cores={self.cores}, nice={self.nice}, threads={self.threads})"
+
+    def apply(self) -> None:
+        # Applies the placement to the calling thread
+        if self.cores:
+            try:
+                os.sched_setaffinity(0, self.cores)
+            except OSError as e:
+                logger.warning(f"Unable to pin to cores {self.cores}: {e}")
+        if self.nice is not None and self.nice != os.getpriority(os.PRIO_PROCESS, 0):
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+            except OSError as e:
+                logger.warning(f"Unable to set the nice level to {self.nice}: {e}")
+
+    def ffmpeg_args(self, cmd: List[str]) -> List[str]:
+        # Replaces every -threads of the command with the budget
+        threads = self.threads or len(self.cores)
+        if not threads:
+            return cmd
+        cmd = list(cmd)
+        found = False
+        for i, arg in enumerate(cmd[:-1]):
+            if arg == "-threads":
+                cmd[i + 1] = str(threads)
+                found = True
+        if not found:
+            cmd[1:1] = ["-threads", str(threads)]
+        return cmd
+
+    def popen(self, cmd: List[str], **kwargs) -> sp.Popen:
+        # the child inherits the affinity and niceness of the thread forking
+        # it, so a throwaway thread is placed and forks instead of this one
+        result = {}
+
+        def spawn():
+            self.apply()
+            try:
+                result["process"] = sp.Popen(cmd, **kwargs)
+            except BaseException as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=spawn, name="placement:popen")
+        thread.start()
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["process"]
+
+
+class CameraPlacement:
+    def __init__(self,
+                 capturer: Optional[Placement] = None,
+                 detector: Optional[Placement] = None,
+                 ffmpeg: Optional[Placement] = None) -> None:
+        self.capturer = capturer or Placement()
+        self.detector = detector or Placement()
+        self.ffmpeg = ffmpeg or Placement()
+
+    def __repr__(self) -> str:
+        return f"CameraPlacement(capturer={self.capturer}, " \
+            f"detector={self.detector}, ffmpeg={self.ffmpeg})"
+
+
+def _role_cores(config: PlacementConfig, role: str, available: Set[int]) -> List[int]:
+    wanted = set(getattr(config, role).cores)
+    cores = sorted(wanted & available) if wanted else sorted(available)
+    if wanted and not cores:
+        logger.warning(f"Placement: none of the {role} cores {sorted(wanted)} is available, "
+                       f"using all of them")
+        cores = sorted(available)
+    return cores
+
+
+def plan_placement(config: PlacementConfig,
+                   cameras: Dict[str, CameraConfig],
+                   available: Optional[Set[int]] = None) -> Dict[str, CameraPlacement]:
+    """
+    Computes the placement of the processes of every enabled camera.
+
+    The manual mode runs every process of a role on all the cores of the
+    role. The automatic mode pins each process to a single core of its
+    role, assigning the costliest cameras first to the least loaded core,
+    where a camera costs its detect pixels per second times the weight of
+    the role. Between equally loaded cores, a core that does not run
+    another process of the same camera is preferred.
+    """
+    cameras = {n: c for n, c in cameras.items() if c.enabled}
+    if config.mode == PlacementModeEnum.disabled:
+        return {name: CameraPlacement() for name in cameras}
+    available = available_cores() if available is None else available
+    threads = config.ffmpeg.threads
+    placements: Dict[str, Dict[str, Placement]] = {name: {} for name in cameras}
+    if config.mode == PlacementModeEnum.manual:
+        for role in PLACED_ROLES:
+            role_config = getattr(config, role)
+            # explicit even when it is every core, FFmpeg would otherwise
+            # inherit the cores of its capturer
+            cores = _role_cores(config, role, available)
+            for name in cameras:
+                placements[name][role] = Placement(
+                    cores=cores, nice=role_config.nice,
+                    threads=threads if role == "ffmpeg" else None)
+        return {name: CameraPlacement(**roles) for name, roles in placements.items()}
+
+    load = {core: 0.0 for core in available}
+    used: Dict[str, Set[int]] = {name: set() for name in cameras}
+    jobs = sorted(
+        ((camera_cost(camera) * getattr(config, role).weight, name, role)
+         for name, camera in cameras.items() for role in PLACED_ROLES),
+        key=lambda job: (-job[0], job[1], PLACED_ROLES.index(job[2])))
+    for cost, name, role in jobs:
+        core = min(_role_cores(config, role, available),
+                   key=lambda c: (load[c], c in used[name], c))
+        load[core] += cost
+        used[name].add(core)
+        placements[name][role] = Placement(
+            cores=[core], nice=getattr(config, role).nice,
+            threads=threads if role == "ffmpeg" else None)
+    return {name: CameraPlacement(**roles) for name, roles in placements.items()}
+
+
+def assign_workers(cameras: Dict[str, CameraConfig],
+                   workers: int,
+                   previous: Optional[Dict[str, int]] = None) -> List[List[str]]:
+    """
+    Spreads the cameras over the motion workers by their cost.
+
+    The costliest cameras are assigned first, each to the least loaded
+    worker. A camera stays on the worker it was on before as long as that
+    worker does not go more than a quarter above an even share, so adding
+    or removing a camera only moves the cameras it has to.
+    """
+    previous = previous or {}
+    costs = {name: camera_cost(camera) for name, camera in cameras.items()}
+    target = sum(costs.values()) / max(1, workers)
+    loads = [0.0] * workers
+    assignment: List[List[str]] = [[] for _ in range(workers)]
+    for name in sorted(costs, key=lambda n: (-costs[n], n)):
+        worker = previous.get(name)
+        if worker is None or worker >= workers or \
+                loads[worker] + costs[name] > max(target * 1.25, costs[name]):
+            worker = min(range(workers), key=lambda w: (loads[w], w))
+        loads[worker] += costs[name]
+        assignment[worker].append(name)
+    return [sorted(names) for names in assignment]
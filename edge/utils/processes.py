@@ -0,0 +1,48 @@
+import multiprocessing as mp
+from multiprocessing import forkserver
+from multiprocessing.context import BaseContext
+from typing import Callable, Optional, Sequence
+from edge.utils.logs import configure_logging
+
+# Imported once by the fork server, every camera process forked from it
+# starts with them loaded instead of importing OpenCV, SciPy and pydantic
+PRELOAD_MODULES = ("edge.capture", "edge.video")
+
+
+def set_start_method(method: str, preload: Sequence[str] = PRELOAD_MODULES) -> None:
+    """
+    Selects how the camera processes are started.
+
+    "fork" copies the parent with its threads and locks, "spawn" starts a
+    fresh interpreter that imports everything again, and "forkserver" forks
+    a single threaded server that was started once with the modules of the
+    camera processes already imported. Queues and events must be created
+    after this is called, they are bound to the start method.
+    """
+    if method == "forkserver":
+        mp.set_forkserver_preload(list(preload))
+    mp.set_start_method(method, force=True)
+    if method == "forkserver":
+        # pays for the preloading now rather than on the first camera start
+        forkserver.ensure_running()
+
+
+def _child_main(log_level: Optional[str], target: Callable, args: tuple) -> None:
+    if log_level is not None:
+        configure_logging(level=log_level)
+    target(*args)
+
+
+def camera_process(target: Callable,
+                   name: str,
+                   args: tuple,
+                   log_level: Optional[str] = None,
+                   context: Optional[BaseContext] = None) -> mp.Process:
+    # the default context is the one chosen by set_start_method()
+    context = context or mp.get_context()
+    # a forked child configures its own sink as well: the enqueued sink it
+    # inherits writes to the worker thread of the parent, which is stopped
+    # whenever the parent reconfigures its logging
+    proc = context.Process(target=_child_main, name=name, args=(log_level, target, args))
+    proc.daemon = True
+    return proc
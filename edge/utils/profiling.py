@@ -0,0 +1,213 @@
+import cProfile
+import json
+import math
+import os
+import signal
+import stat
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Optional
+from loguru import logger
+
+PROFILE_SIGNAL = signal.SIGUSR1
+# output file extension of each mode
+MODES = {
+    # all threads, collapsed stacks for flamegraph.pl or speedscope
+    "sample": "folded",
+    # deterministic profile of the main thread, open with pstats or snakeviz,
+    # only for the processes doing their work there
+    "cprofile": "prof",
+    # a single dump of every thread's stack
+    "stacks": "txt",
+}
+DEFAULT_DURATION = 10.0
+DEFAULT_INTERVAL = 0.005
+
+
+def request_dir() -> str:
+    # Private to the user, so that no one else can plant a request or a
+    # symlink and redirect the profiles
+    path = os.path.join(tempfile.gettempdir(), f"edge-profile-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() \
+            or info.st_mode & 0o077:
+        raise PermissionError(f"{path} is not a private directory")
+    return path
+
+
+def request_path(pid: int) -> str:
+    return os.path.join(request_dir(), f"{pid}.json")
+
+
+def check_mode(mode: str, main_thread: bool) -> None:
+    # cProfile only follows the thread that enables it, the main thread of
+    # the process, and the threads already running cannot be attached to
+    if mode == "cprofile" and not main_thread:
+        raise ValueError("cprofile only profiles the main thread, which does not do the "
+                         "work of this process, use the sample mode")
+
+
+def request_profile(pid: int,
+                    name: str,
+                    output_dir: str,
+                    mode: str = "sample",
+                    duration: float = DEFAULT_DURATION,
+                    interval: float = DEFAULT_INTERVAL) -> str:
+    # Asks the process to profile itself, returns where the result will be
+    if mode not in MODES:
+        raise ValueError(f"unknown profiling mode {mode}")
+    if not math.isfinite(duration) or duration <= 0:
+        raise ValueError(f"invalid profiling duration {duration}")
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.abspath(os.path.join(
+        output_dir, f"{name.replace(':', '-')}-{mode}-{int(time.time())}.{MODES[mode]}"))
+    path = request_path(pid)
+    try:
+        # left behind by an interrupted request
+        os.unlink(f"{path}.tmp")
+    except FileNotFoundError:
+        pass
+    fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"mode": mode, "duration": duration,
+                   "interval": interval, "output": output}, f)
+    os.replace(f"{path}.tmp", path)
+    os.kill(pid, PROFILE_SIGNAL)
+    return output
+
+
+def _describe(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def dump_stacks(output: str) -> None:
+    names = {t.ident: t.name for t in threading.enumerate()}
+    with open(output, "w") as f:
+        for ident, frame in sys._current_frames().items():
+            f.write(f"Thread {names.get(ident, ident)}:\n")
+            f.write("".join(traceback.format_stack(frame)))
+            f.write("\n")
+
+
+class SamplingSession(threading.Thread):
+    # Walks the stack of every other thread each interval, for a bounded time
+    def __init__(self, output: str, duration: float, interval: float) -> None:
+        threading.Thread.__init__(self, name="profiler:sample")
+        self.daemon = True
+        self.output = output
+        self.duration = duration
+        self.interval = interval
+        self.samples: Counter = Counter()
+
+    def run(self) -> None:
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_describe(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        # whole or absent, the output is polled for
+        with open(f"{self.output}.tmp", "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(f"{self.output}.tmp", self.output)
+        logger.info(f"Profile written to {self.output}")
+
+
+class Profiler:
+    """
+    Answers profiling requests sent to this process with PROFILE_SIGNAL.
+
+    Installing it only registers a signal handler, nothing runs until a
+    request arrives. The request file written by request_profile picks the
+    mode, duration and output; a bare signal samples all threads for
+    DEFAULT_DURATION seconds into the private request directory.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.session: Optional[SamplingSession] = None
+        self.profile: Optional[cProfile.Profile] = None
+        self.output: Optional[str] = None
+        self.previous = None
+
+    def install(self) -> None:
+        self.previous = signal.signal(PROFILE_SIGNAL, self._on_signal)
+
+    def uninstall(self) -> None:
+        signal.signal(PROFILE_SIGNAL, self.previous or signal.SIG_DFL)
+
+    @property
+    def active(self) -> bool:
+        return self.profile is not None or (
+            self.session is not None and self.session.is_alive())
+
+    def _read_request(self) -> Optional[dict]:
+        try:
+            path = request_path(os.getpid())
+        except OSError as e:
+            logger.error(f"{self.name}: ignoring the profiling request: {e}")
+            return None
+        try:
+            with open(path) as f:
+                request = json.load(f)
+            os.unlink(path)
+            return request
+        except (OSError, ValueError):
+            output = os.path.join(
+                request_dir(),
+                f"{self.name.replace(':', '-')}-sample-{int(time.time())}.folded")
+            return {"mode": "sample", "duration": DEFAULT_DURATION,
+                    "interval": DEFAULT_INTERVAL, "output": output}
+
+    def _on_signal(self, _, __) -> None:
+        # runs in the main thread, between two bytecodes
+        if self.profile is not None:
+            self._stop_cprofile()
+            return
+        if self.active:
+            logger.warning(f"{self.name}: a profile is already running")
+            return
+        request = self._read_request()
+        if request is None:
+            return
+        mode, output = request["mode"], request["output"]
+        logger.info(f"{self.name}: {mode} profile for {request['duration']}s to {output}")
+        if mode == "stacks":
+            dump_stacks(output)
+        elif mode == "cprofile":
+            self.output = output
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            # the profiler must be stopped from the thread that started it
+            timer = threading.Timer(
+                request["duration"], os.kill, args=(os.getpid(), PROFILE_SIGNAL))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.session = SamplingSession(
+                output=output, duration=request["duration"],
+                interval=request["interval"])
+            self.session.start()
+
+    def _stop_cprofile(self) -> None:
+        self.profile.disable()
+        self.profile.dump_stats(self.output)
+        logger.info(f"Profile written to {self.output}")
+        self.profile = None
@@ -0,0 +1,95 @@
+from typing import Dict, Optional, Tuple
+import cv2
+import numpy as np
+from loguru import logger
+from edge.config import CameraConfig, PyramidLevelEnum
+from edge.motion.api import motion_frame_size
+
+
+class FramePyramid:
+    """
+    The smaller copies of a frame published after it, in the shared memory
+    segment of the frame.
+
+    The full YUV 4:2:0 frame stays at the start of the segment, so readers
+    that do not know about the pyramid are unaffected, and each level
+    follows at an offset derived from the camera configuration alone. The
+    motion level is the frame resized the way the motion detector resizes
+    it, the thumbnail a YUV 4:2:0 frame of its own. The capturer builds the
+    levels once per frame, the consumers read them in place.
+    """
+
+    def __init__(self, config: CameraConfig) -> None:
+        self.frame_shape = config.frame_shape_yuv
+        self.frame_size = self.frame_shape[0] * self.frame_shape[1]
+        # the offset and the shape of each level
+        self.levels: Dict[str, Tuple[int, Tuple[int, int]]] = {}
+        offset = self.frame_size
+        for level in config.pyramid.levels:
+            shape = self._level_shape(config, level)
+            if shape is None or level.value in self.levels:
+                continue
+            if shape[0] <= 0 or shape[1] <= 0:
+                # cv2.resize fails on it, in the capture thread of the camera
+                logger.error(f"The {level.value} level of {self.frame_shape} frames would "
+                             f"be {shape}, not publishing it")
+                continue
+            self.levels[level.value] = (offset, shape)
+            offset += shape[0] * shape[1]
+        self.size = offset
+
+    def _level_shape(self, config: CameraConfig,
+                     level: PyramidLevelEnum) -> Optional[Tuple[int, int]]:
+        if level == PyramidLevelEnum.motion:
+            if config.motion is None or not config.motion.frame_height:
+                return None
+            return motion_frame_size(self.frame_shape, config.motion.frame_height)
+        width, height = config.frame_shape
+        # the YUV 4:2:0 planes need even sizes
+        thumbnail_height = min(config.pyramid.thumbnail_height, height) // 2 * 2
+        thumbnail_width = max(2, round(width * thumbnail_height / height / 2) * 2)
+        return thumbnail_height * 3 // 2, thumbnail_width
+
+    def frame(self, slot) -> np.ndarray:
+        return np.ndarray(shape=self.frame_shape, dtype=np.uint8, buffer=slot)
+
+    def level(self, slot, name: str) -> Optional[np.ndarray]:
+        # a view of the level in the segment, None when it is not published
+        if name not in self.levels:
+            return None
+        offset, shape = self.levels[name]
+        return np.ndarray(shape=shape, dtype=np.uint8, buffer=slot, offset=offset)
+
+    def build(self, slot) -> None:
+        frame = self.frame(slot)
+        for name, (_, shape) in self.levels.items():
+            out = self.level(slot, name)
+            if name == PyramidLevelEnum.motion.value:
+                cv2.resize(frame, dsize=(shape[1], shape[0]), dst=out,
+                           interpolation=cv2.INTER_NEAREST)
+            else:
+                _resize_yuv420(frame, out)
+
+
+def _planes(frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    height, width = frame.shape[0] * 2 // 3, frame.shape[1]
+    flat = frame.reshape(-1)
+    luma = height * width
+    chroma = luma // 4
+    return (flat[:luma].reshape(height, width),
+            flat[luma:luma + chroma].reshape(height // 2, width // 2),
+            flat[luma + chroma:luma + 2 * chroma].reshape(height // 2, width // 2))
+
+
+def _resize_yuv420(frame: np.ndarray, out: np.ndarray) -> None:
+    for plane, out_plane in zip(_planes(frame), _planes(out)):
+        cv2.resize(plane, dsize=(out_plane.shape[1], out_plane.shape[0]), dst=out_plane,
+                   interpolation=cv2.INTER_AREA)
+
+
+def frame_pyramid(config: CameraConfig) -> Optional[FramePyramid]:
+    # the pyramid of a camera, None without any level to publish
+    if not config.pyramid.enabled:
+        return None
+    pyramid = FramePyramid(config)
+    return pyramid if pyramid.levels else None
@@ -0,0 +1,183 @@
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from loguru import logger
+from edge.config import CameraConfig, LoadSheddingConfig, MotionConfig
+from edge.stats import read_cpu_times
+from edge.utils.metrics import ROLE_DETECTOR, MetricsRegistry
+
+# The shedding actions in the order they are taken, as bits of the
+# shed_level gauge of a camera
+SHED_FPS = 1
+SHED_IDLE = 2
+SHED_MOTION = 4
+SHED_ACTIONS = (("fps", SHED_FPS), ("idle", SHED_IDLE), ("motion", SHED_MOTION))
+
+
+class FrameThrottle:
+    """
+    Follows the shed level of a camera in its detector process.
+
+    A shed camera processes a frame every `fps_divisor` frames, an idle
+    camera with paused processing one frame per `1 / idle_fps` seconds
+    until motion shows up again, and the motion detection runs at
+    `motion_frame_height` once its resolution is reduced. Skipped frames
+    are still consumed from the queue, so the capturer never falls behind.
+    """
+
+    def __init__(self, config: CameraConfig) -> None:
+        self.config = config
+        self.last = 0.0
+
+    def motion_config(self, level: int) -> MotionConfig:
+        motion = self.config.motion
+        height = self.config.shedding.motion_frame_height
+        if level & SHED_MOTION and motion.frame_height and motion.frame_height > height:
+            return motion.model_copy(update={"frame_height": height})
+        return motion
+
+    def skip(self, level: int, frame_time: float, idle: bool) -> bool:
+        fps = self.config.detect.fps
+        interval = 0.0
+        if level & SHED_FPS:
+            interval = self.config.shedding.fps_divisor / fps
+        if level & SHED_IDLE and idle:
+            interval = max(interval, 1 / self.config.shedding.idle_fps)
+        # frames arrive with jitter, half a frame early is still on time,
+        # and a clock going backwards does not stall the camera
+        if interval and 0 <= frame_time - self.last < interval - 0.5 / fps:
+            return True
+        self.last = frame_time
+        return False
+
+
+class LoadShedder:
+    """
+    Degrades the cameras one step at a time while the box is saturated,
+    and undoes the last step once there has been headroom for a while.
+
+    The box is saturated when the CPUs are busy above `cpu_high`, or when a
+    camera skips too many frames or its detector is busy detecting motion
+    for too large a share of the time. The steps are taken in order:
+    lowering the detection fps of every camera, lowest priority first, then
+    pausing full-rate processing of idle cameras, then reducing the motion
+    resolution. The parent writes the resulting level of each camera into
+    the shed_level gauge of its detector, which the detector follows.
+    """
+
+    def __init__(self,
+                 metrics: MetricsRegistry,
+                 cameras: Dict[str, CameraConfig],
+                 config: LoadSheddingConfig,
+                 cpu_times: Callable[[], Optional[Tuple[int, int]]] = read_cpu_times) -> None:
+        self.metrics = metrics
+        self.config = config
+        self.cpu_times = cpu_times
+        # the number of steps taken
+        self.level = 0
+        self.saturated_checks = 0
+        self.headroom_since: Optional[float] = None
+        self.previous: Dict[str, Tuple[float, float, float, float]] = {}
+        self.previous_at: Optional[float] = None
+        self.previous_cpu = cpu_times()
+        # (camera, action, "shed" or "restore") -> decisions
+        self.decisions: Dict[Tuple[str, str, str], int] = {}
+        self.set_cameras(cameras)
+
+    def set_cameras(self, cameras: Dict[str, CameraConfig]) -> None:
+        self.cameras = {name: c for name, c in cameras.items() if c.enabled}
+        order = sorted(self.cameras,
+                       key=lambda name: (self.cameras[name].shedding.priority, name))
+        self.steps: List[Tuple[str, str, int]] = [
+            (name, action, bit) for action, bit in SHED_ACTIONS for name in order]
+        self.level = min(self.level, len(self.steps))
+        self.publish()
+
+    def levels(self) -> Dict[str, int]:
+        levels = {name: 0 for name in self.cameras}
+        for name, _, bit in self.steps[:self.level]:
+            levels[name] |= bit
+        return levels
+
+    def publish(self) -> None:
+        for name, level in self.levels().items():
+            if name in self.metrics.cameras:
+                self.metrics.camera(name, ROLE_DETECTOR).set("shed_level", level)
+
+    def clear(self) -> None:
+        self.level = 0
+        self.publish()
+
+    def _cpu_busy(self) -> Optional[float]:
+        current = self.cpu_times()
+        previous, self.previous_cpu = self.previous_cpu, current
+        if current is None or previous is None or current[1] <= previous[1]:
+            return None
+        return (current[0] - previous[0]) / (current[1] - previous[1])
+
+    def _pressure(self, now: float) -> Tuple[float, float]:
+        # The worst skip ratio and detector busy share since the last check
+        snapshot = self.metrics.snapshot()
+        elapsed = now - self.previous_at if self.previous_at is not None else 0.0
+        self.previous_at = now
+        skip, busy = 0.0, 0.0
+        for name in self.cameras:
+            if name not in snapshot:
+                continue
+            counters = snapshot[name]["counters"]
+            motion = snapshot[name]["stages"]["motion"]
+            current = (counters["frames"], counters["skipped_frames"],
+                       motion["sum"], motion["count"])
+            previous = self.previous.get(name)
+            self.previous[name] = current
+            if previous is None or elapsed <= 0:
+                continue
+            frames, skipped, spent, _ = (c - p for c, p in zip(current, previous))
+            if frames > 0:
+                skip = max(skip, skipped / frames)
+            busy = max(busy, spent / elapsed)
+        return skip, busy
+
+    def check(self,
+              now: Optional[float] = None,
+              cpu_busy: Optional[float] = None) -> Optional[Tuple[str, str, bool]]:
+        # Returns the (camera, action, shed) decision taken, if any
+        now = time.monotonic() if now is None else now
+        cpu_busy = self._cpu_busy() if cpu_busy is None else cpu_busy
+        skip, busy = self._pressure(now)
+        config = self.config
+        saturated = (cpu_busy is not None and cpu_busy > config.cpu_high) or \
+            skip > config.max_skip_ratio or busy > config.max_busy
+        headroom = (cpu_busy is None or cpu_busy < config.cpu_low) and \
+            skip <= config.max_skip_ratio / 2 and busy <= config.max_busy / 2
+        if saturated:
+            self.headroom_since = None
+            self.saturated_checks += 1
+            if self.saturated_checks < config.escalate_after or self.level == len(self.steps):
+                return None
+            self.saturated_checks = 0
+            name, action, _ = self.steps[self.level]
+            self.level += 1
+            reason = f"cpu {cpu_busy or 0:.0%}, skipping {skip:.0%}, detector busy {busy:.0%}"
+            return self._decide(name, action, True, reason)
+        self.saturated_checks = 0
+        if not headroom or self.level == 0:
+            self.headroom_since = None
+            return None
+        if self.headroom_since is None:
+            self.headroom_since = now
+        if now - self.headroom_since < config.restore_after:
+            return None
+        self.headroom_since = now
+        self.level -= 1
+        name, action, _ = self.steps[self.level]
+        return self._decide(name, action, False, f"headroom for {config.restore_after:.0f}s")
+
+    def _decide(self, name: str, action: str, shed: bool,
+                reason: str) -> Tuple[str, str, bool]:
+        direction = "shed" if shed else "restore"
+        key = (name, action, direction)
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        self.publish()
+        logger.warning(f"LoadShedder: {direction} {action} of {name} ({reason}), "
+                       f"{self.level}/{len(self.steps)} steps taken")
+        return name, action, shed
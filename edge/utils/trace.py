@@ -0,0 +1,207 @@
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+import numpy as np
+
+# Monotonic timestamps recorded for a sampled frame, in pipeline order
+TRACE_POINTS = ("read", "published", "picked_up", "motion", "detected")
+
+# Spans between two consecutive points, as shown in the Chrome trace
+TRACE_SPANS = (
+    ("publish", "read", "published"),
+    ("queue", "published", "picked_up"),
+    ("motion", "picked_up", "motion"),
+    ("detect", "motion", "detected"),
+)
+
+POINT_INDEX = {name: i + 1 for i, name in enumerate(TRACE_POINTS)}
+# frame time followed by the points
+RECORD_SIZE = 1 + len(TRACE_POINTS)
+# how many of the latest records the consumer checks for its frame
+_LOOKBACK = 4
+
+
+class CameraTrace:
+    # Per camera view on the ring. The capturer samples frames and writes the
+    # first points, the detector finds the record of its frame and writes the
+    # rest, so every field has a single writer.
+    def __init__(self, buf: memoryview, ring_size: int, sample_every: int) -> None:
+        self._buf = buf
+        self.ring_size = ring_size
+        self.sample_every = sample_every
+        self._frames = 0
+
+    def sample(self) -> bool:
+        self._frames += 1
+        return self._frames % self.sample_every == 0
+
+    def begin(self, frame_time: float, read: float) -> int:
+        # must be called before the frame is handed to the consumer
+        head = int(self._buf[0]) + 1
+        base = 1 + (head % self.ring_size) * RECORD_SIZE
+        for i in range(RECORD_SIZE):
+            self._buf[base + i] = 0
+        self._buf[base] = frame_time
+        self._buf[base + POINT_INDEX["read"]] = read
+        self._buf[0] = head
+        return base
+
+    def find(self, frame_time: float) -> int:
+        head = int(self._buf[0])
+        for seq in range(head, max(0, head - _LOOKBACK), -1):
+            base = 1 + (seq % self.ring_size) * RECORD_SIZE
+            if self._buf[base] == frame_time:
+                return base
+        return -1
+
+    def mark(self, record: int, point: str, timestamp: float) -> None:
+        self._buf[record + POINT_INDEX[point]] = timestamp
+
+    def release(self) -> None:
+        self._buf.release()
+
+
+class TraceRing:
+    """
+    Bounded shared memory ring of sampled per-frame traces, one ring per camera.
+
+    Only one frame out of `sample_every` is traced, the others cost a counter
+    increment in the capturer and nothing in the detector. Like the metrics
+    registry, room is left for `capacity` cameras.
+    """
+
+    def __init__(self,
+                 cameras: List[str],
+                 ring_size: int = 256,
+                 sample_every: int = 100,
+                 capacity: int = 0) -> None:
+        self.slots: List[Optional[str]] = list(cameras) + \
+            [None] * max(0, capacity - len(cameras))
+        self.ring_size = ring_size
+        self.sample_every = sample_every
+        size = max(1, len(self.slots) * self._camera_size()) * 8
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.shm.buf[:size] = bytes(size)
+        self.owner = True
+        self._attach()
+
+    def _camera_size(self) -> int:
+        # the head sequence number, then the records
+        return 1 + self.ring_size * RECORD_SIZE
+
+    def _attach(self) -> None:
+        count = len(self.slots) * self._camera_size()
+        self._buf = self.shm.buf[:count * 8].cast("d")
+        self._views: Dict[str, CameraTrace] = {}
+
+    def __getstate__(self):
+        return {"slots": self.slots, "name": self.shm.name,
+                "ring_size": self.ring_size, "sample_every": self.sample_every}
+
+    def __setstate__(self, state) -> None:
+        self.slots = state["slots"]
+        self.ring_size = state["ring_size"]
+        self.sample_every = state["sample_every"]
+        self.owner = False
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self._attach()
+
+    @property
+    def cameras(self) -> List[str]:
+        return [camera for camera in self.slots if camera is not None]
+
+    def add_camera(self, camera: str) -> bool:
+        # False when there is no free ring left
+        if camera in self.slots:
+            return True
+        if None not in self.slots:
+            return False
+        index = self.slots.index(None)
+        size = self._camera_size()
+        self._buf[index * size:(index + 1) * size] = \
+            memoryview(bytes(size * 8)).cast("d")
+        self.slots[index] = camera
+        return True
+
+    def remove_camera(self, camera: str) -> None:
+        if camera not in self.slots:
+            return
+        view = self._views.pop(camera, None)
+        if view is not None:
+            view.release()
+        self.slots[self.slots.index(camera)] = None
+
+    def camera(self, camera: str) -> CameraTrace:
+        if camera not in self._views:
+            size = self._camera_size()
+            base = self.slots.index(camera) * size
+            self._views[camera] = CameraTrace(
+                buf=self._buf[base:base + size],
+                ring_size=self.ring_size,
+                sample_every=self.sample_every)
+        return self._views[camera]
+
+    def records(self, camera: Optional[str] = None) -> List[dict]:
+        values = np.frombuffer(self._buf, dtype=np.float64).copy() \
+            .reshape(len(self.slots), self._camera_size())
+        result = []
+        for i, name in enumerate(self.slots):
+            if name is None or camera is not None and name != camera:
+                continue
+            records = values[i, 1:].reshape(self.ring_size, RECORD_SIZE)
+            for record in records[records[:, 0] > 0]:
+                points = {point: float(record[POINT_INDEX[point]])
+                          for point in TRACE_POINTS if record[POINT_INDEX[point]]}
+                result.append({
+                    "camera": name,
+                    "frame_time": float(record[0]),
+                    "points": points,
+                    "age": points["detected"] - points["read"]
+                    if "detected" in points else None,
+                })
+        result.sort(key=lambda r: r["points"]["read"])
+        return result
+
+    def chrome_trace(self, camera: Optional[str] = None) -> dict:
+        # Trace Event Format, open with chrome://tracing or Perfetto
+        events = []
+        for record in self.records(camera=camera):
+            pid = self.slots.index(record["camera"])
+            points = record["points"]
+            for span, start, end in TRACE_SPANS:
+                if start not in points or end not in points:
+                    continue
+                events.append({
+                    "name": span,
+                    "cat": record["camera"],
+                    "ph": "X",
+                    "ts": points[start] * 1e6,
+                    "dur": (points[end] - points[start]) * 1e6,
+                    "pid": pid,
+                    "tid": 0 if span == "publish" else 1,
+                    "args": {"frame_time": record["frame_time"]},
+                })
+        metadata = [{"name": "process_name", "ph": "M", "pid": i,
+                     "args": {"name": name}}
+                    for i, name in enumerate(self.slots) if name is not None]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+    def close(self) -> None:
+        if self._buf is None:
+            return
+        for view in self._views.values():
+            view.release()
+        self._views.clear()
+        self._buf.release()
+        self._buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __del__(self) -> None:
+        # release the views before SharedMemory tries to close its buffer
+        if getattr(self, "_buf", None) is not None:
+            for view in self._views.values():
+                view.release()
+            self._views.clear()
+            self._buf.release()
+            self._buf = None
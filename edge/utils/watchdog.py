@@ -0,0 +1,117 @@
+import math
+import time
+from typing import Dict, Optional, Tuple
+from loguru import logger
+from edge.config import CameraConfig, ReplayModeEnum, WatchdogConfig
+from edge.utils.metrics import HEARTBEATS, ROLE_CAPTURER, MetricsRegistry
+
+
+class StageState:
+    def __init__(self) -> None:
+        # no verdict is given on the stage before this time
+        self.grace_until = 0.0
+        self.window_start = 0.0
+        self.window_count = 0.0
+        self.level = 0
+        self.failed_at = 0.0
+
+
+class Watchdog:
+    """
+    Decides which stage of a camera needs a restart, from the heartbeats the
+    camera processes write into the metrics registry.
+
+    A stage is stalled when it has not beaten for `stall_frames` frames at
+    the camera's detect fps, and capture overruns when it produces more than
+    `overrun_ratio` times that fps, or than the replay fps of a recording
+    replayed at a fixed rate. A recording replayed as fast as the detector
+    consumes never overruns. Every failure raises the level of the
+    stage so that the supervisor can escalate, and the level goes back to
+    zero once the stage has been healthy for `reset_after` seconds. No
+    verdict is given while the capturer is paused over the shared memory
+    budget, the stages get a new grace period once it is lifted.
+    """
+
+    def __init__(self,
+                 metrics: MetricsRegistry,
+                 cameras: Dict[str, CameraConfig],
+                 config: WatchdogConfig) -> None:
+        self.metrics = metrics
+        self.config = config
+        self.limits: Dict[str, Tuple[float, float]] = {}
+        self.states: Dict[Tuple[str, str], StageState] = {}
+        # the cameras whose frames count against the shared memory budget
+        self.budgeted: Dict[str, bool] = {}
+        for name, camera in cameras.items():
+            self.set_camera(name, camera)
+
+    def set_camera(self, name: str, camera: CameraConfig) -> None:
+        config = self.config
+        self.limits[name] = (
+            max(config.min_stall, config.stall_frames / camera.detect.fps),
+            self._overrun_fps(camera) * config.overrun_ratio)
+        self.budgeted[name] = not camera.colocated
+        for stage in HEARTBEATS:
+            self.states.setdefault((name, stage), StageState())
+
+    @staticmethod
+    def _overrun_fps(camera: CameraConfig) -> float:
+        # the rate capture is expected to produce frames at
+        if camera.replay.path:
+            if camera.replay.mode == ReplayModeEnum.fastest:
+                return math.inf
+            if camera.replay.mode == ReplayModeEnum.fixed:
+                return camera.replay.fps
+        return camera.detect.fps
+
+    def remove_camera(self, name: str) -> None:
+        self.limits.pop(name, None)
+        self.budgeted.pop(name, None)
+        for stage in HEARTBEATS:
+            self.states.pop((name, stage), None)
+
+    def started(self, camera: str, stage: str = HEARTBEATS[0],
+                now: Optional[float] = None) -> None:
+        # a (re)started stage and everything downstream of it get a grace period
+        now = time.monotonic() if now is None else now
+        for name in HEARTBEATS[HEARTBEATS.index(stage):]:
+            state = self.states[(camera, name)]
+            state.grace_until = now + self.config.startup_grace
+            state.window_start = state.grace_until
+            state.window_count = self.metrics.heartbeat(camera, name)[0]
+
+    def check(self, camera: str, now: Optional[float] = None) -> Optional[Tuple[str, int]]:
+        # Returns the first failing stage in pipeline order and its level
+        now = time.monotonic() if now is None else now
+        if self.budgeted[camera] and \
+                self.metrics.camera(camera, ROLE_CAPTURER).get("shm_over_budget"):
+            # throttled, not stalled
+            self.started(camera, now=now)
+            return None
+        stall, overrun = self.limits[camera]
+        for stage in HEARTBEATS:
+            state = self.states[(camera, stage)]
+            count, last = self.metrics.heartbeat(camera, stage)
+            if now < state.grace_until:
+                state.window_start, state.window_count = now, count
+                continue
+            reason = None
+            if now - max(last, state.grace_until) > stall:
+                reason = f"no progress for {now - max(last, state.grace_until):.1f}s"
+            elif stage == "capture" and \
+                    now - state.window_start >= self.config.overrun_window:
+                rate = (count - state.window_count) / (now - state.window_start)
+                state.window_start, state.window_count = now, count
+                if rate > overrun:
+                    reason = f"{rate:.1f} fps, above the limit of {overrun:.1f}"
+            if reason is None:
+                if state.level and now - state.failed_at >= self.config.reset_after:
+                    state.level = 0
+                continue
+            state.level += 1
+            state.failed_at = now
+            logger.warning(f"Watchdog: {stage} of {camera} is failing ({reason}), "
+                           f"escalation level {state.level}")
+            self.started(camera, stage, now=now)
+            return stage, state.level
+        return None
@@ -1,51 +1,321 @@
 import queue
 import threading
-from typing import Tuple
+import time
+from multiprocessing.connection import wait
+from typing import Dict, Optional, Tuple
+from edge.comms.mqtt import MqttPublisher
 from edge.motion.api import MotionDetectorAPI
 from edge.motion.default import DefaultMotionDetector
 import signal
 import multiprocessing as mp
 from loguru import logger
 from edge.config import CameraConfig
+from edge.utils.configs import ConfigChannel
 from edge.utils.events import EventsPerSecond
-from edge.utils.frame import FrameManager, SharedMemoryFrameManager
+from edge.utils.frame import FrameManager, SharedMemoryFrameManager, frame_name
+from edge.utils.logs import PeriodicSummary, RateLimitedLogger
+from edge.utils.trace import CameraTrace, TraceRing
+from edge.utils.metrics import ROLE_DETECTOR, CameraMetrics, MetricsRegistry
+from edge.utils.placement import CameraPlacement
+from edge.utils.shedding import FrameThrottle
+from edge.utils.profiling import Profiler
+from edge.utils.pyramid import frame_pyramid
 
 
 def run_camera_processor(
         name: str,
         config: CameraConfig,
         frame_queue: mp.Queue,
-        current_frame: mp.Value,
-        camera_fps: mp.Value,
-        skipped_fps: mp.Value):
+        metrics: MetricsRegistry,
+        event_queue: Optional[mp.Queue] = None,
+        traces: Optional[TraceRing] = None,
+        channel: Optional[ConfigChannel] = None,
+        placement: Optional[CameraPlacement] = None):
+    if placement is not None:
+        placement.detector.apply()
     exit_signal = mp.Event()
 
-    md = DefaultMotionDetector(
-        frame_shape=config.frame_shape_yuv,
-        config=config.motion,
-        fps=config.detect.fps,
-    )
-
     def _on_exit(_, __):
         exit_signal.set()
         logger.info("Camera processor exiting")
 
     signal.signal(signal.SIGINT, _on_exit)
     signal.signal(signal.SIGTERM, _on_exit)
+    Profiler(name=f"detector:{name}").install()
 
+    camera = create_camera_detector(name, config, metrics, event_queue, traces)
+    _run_camera(camera, frame_queue, exit_signal, event_queue, channel)
+    logger.info("Camera processor exited")
+
+
+def run_colocated_detector(
+        name: str,
+        config: CameraConfig,
+        frame_queue: queue.Queue,
+        frame_manager: FrameManager,
+        metrics: MetricsRegistry,
+        stop_event: mp.Event,
+        event_queue: Optional[mp.Queue] = None,
+        traces: Optional[TraceRing] = None,
+        channel: Optional[ConfigChannel] = None):
+    # Runs the motion detection of a camera in a thread of its capturer
+    # process, from the frames the capturer keeps in frame_manager
+    camera = create_camera_detector(name, config, metrics, event_queue, traces,
+                                    frame_manager=frame_manager)
+    _run_camera(camera, frame_queue, stop_event, event_queue, channel)
+    logger.info(f"Colocated motion detection exited for {name}")
+
+
+def _run_camera(camera: "CameraDetector",
+                frame_queue: mp.Queue,
+                stop_event: mp.Event,
+                event_queue: Optional[mp.Queue],
+                channel: Optional[ConfigChannel]) -> None:
     run_detectors(
-        camera_name=name,
-        config=config,
+        camera_name=camera.camera_name,
+        config=camera.config,
         frame_queue=frame_queue,
-        current_frame=current_frame,
+        metrics=camera.metrics,
+        stop_event=stop_event,
+        detector=camera.detector,
+        frame_shape=camera.shape,
+        frame_manager=camera.frame_manager,
+        fps_counter=camera.fps_counter,
+        publisher=camera.publisher,
+        event_queue=event_queue,
+        trace=camera.trace,
+        channel=channel,
+        camera=camera,
+    )
+    camera.close()
+
+
+def run_motion_worker(
+        name: str,
+        cameras: Dict[str, CameraConfig],
+        frame_queues: Dict[str, mp.Queue],
+        metrics: MetricsRegistry,
+        event_queue: Optional[mp.Queue] = None,
+        traces: Optional[TraceRing] = None,
+        channel: Optional[ConfigChannel] = None,
+        placement: Optional[CameraPlacement] = None):
+    # Runs the motion detection of several cameras from a single thread
+    if placement is not None:
+        placement.detector.apply()
+    exit_signal = mp.Event()
+
+    def _on_exit(_, __):
+        exit_signal.set()
+        logger.info("Motion worker exiting")
+
+    signal.signal(signal.SIGINT, _on_exit)
+    signal.signal(signal.SIGTERM, _on_exit)
+    Profiler(name=f"detector:{name}").install()
+
+    detectors = {
+        camera: create_camera_detector(camera, config, metrics, event_queue, traces)
+        for camera, config in cameras.items()
+    }
+    run_worker_loop(
+        name=name,
+        detectors=detectors,
+        frame_queues=frame_queues,
         stop_event=exit_signal,
-        detector=md,
+        channel=channel)
+    for camera in detectors.values():
+        camera.close()
+    logger.info(f"Motion worker {name} exited")
+
+
+def run_worker_loop(
+        name: str,
+        detectors: Dict[str, "CameraDetector"],
+        frame_queues: Dict[str, mp.Queue],
+        stop_event: mp.Event,
+        channel: Optional[ConfigChannel] = None) -> None:
+    # the pipe behind each queue, to sleep until any camera has a frame
+    readers = {frame_queues[camera]._reader: camera for camera in detectors}
+    summary = PeriodicSummary()
+    logger.info(f"Motion worker {name} started for {', '.join(detectors)}")
+    while not stop_event.is_set():
+        if summary.ready():
+            for camera in detectors.values():
+                camera.log_summary()
+        if channel is not None:
+            update = channel.poll()
+            if update is not None:
+                logger.info("{}: applying the new configuration", name)
+                for camera, config in update.items():
+                    if camera in detectors:
+                        detectors[camera].update_config(config)
+        # a single frame per camera and round, so that no camera starves the others
+        for reader in wait(list(readers), timeout=1.0):
+            camera = readers[reader]
+            try:
+                frame_time = frame_queues[camera].get_nowait()
+            except queue.Empty:
+                continue
+            detectors[camera].process(frame_time, time.monotonic())
+
+
+def create_camera_detector(
+        name: str,
+        config: CameraConfig,
+        metrics: MetricsRegistry,
+        event_queue: Optional[mp.Queue] = None,
+        traces: Optional[TraceRing] = None,
+        frame_manager: Optional[FrameManager] = None) -> "CameraDetector":
+    camera_metrics = metrics.camera(name, ROLE_DETECTOR)
+    publisher = None
+    if config.mqtt.enabled:
+        publisher = MqttPublisher(
+            config=config.mqtt,
+            client_id=f"{config.mqtt.client_id}-{name}")
+        publisher.start()
+    return CameraDetector(
+        camera_name=name,
+        config=config,
+        metrics=camera_metrics,
+        detector=DefaultMotionDetector(
+            frame_shape=config.frame_shape_yuv,
+            config=config.motion,
+            fps=config.detect.fps,
+        ),
         frame_shape=config.frame_shape_yuv,
-        frame_manager=SharedMemoryFrameManager(),
-        fps_counter=EventsPerSecond(max_events=1000),
+        frame_manager=frame_manager or SharedMemoryFrameManager(prefix=config.frames_prefix),
+        fps_counter=camera_metrics.rate("detection_fps"),
+        publisher=publisher,
+        event_queue=event_queue,
+        trace=traces.camera(name) if traces is not None else None,
     )
 
-    logger.info("Camera processor exited")
+
+class CameraDetector:
+    """
+    Motion detection and event publishing of a single camera, one frame at
+    a time. A detector process runs one of them, a motion worker several.
+    """
+
+    def __init__(self,
+                 camera_name: str,
+                 config: CameraConfig,
+                 metrics: CameraMetrics,
+                 detector: MotionDetectorAPI,
+                 frame_shape: Tuple[int, int],
+                 frame_manager: FrameManager,
+                 fps_counter: EventsPerSecond,
+                 publisher: Optional[MqttPublisher] = None,
+                 event_queue: Optional[mp.Queue] = None,
+                 trace: Optional[CameraTrace] = None) -> None:
+        self.camera_name = camera_name
+        self.config = config
+        self.metrics = metrics
+        self.detector = detector
+        self.shape = frame_shape
+        self.frame_manager = frame_manager
+        self.fps_counter = fps_counter
+        self.publisher = publisher
+        self.event_queue = event_queue
+        self.trace = trace
+        self.fc = 0
+        self.motion_active = None
+        self.motion_event = None
+        self.last_published = 0.0
+        self.limiter = RateLimitedLogger()
+        self.throttle = FrameThrottle(config)
+        self.shed_level = 0
+        # the levels the capturer publishes after the frame, fixed until a restart
+        self.pyramid = frame_pyramid(config)
+        self.fps_counter.start()
+
+    def log_summary(self) -> None:
+        logger.info("{}: motion detection {:.1f} fps, {} frames",
+                    self.camera_name, self.fps_counter.eps(), self.fc)
+
+    def update_config(self, config: CameraConfig) -> None:
+        logger.info("{}: applying the new configuration", self.camera_name)
+        self.config = config
+        self.throttle.config = config
+        self.detector.update_config(self.throttle.motion_config(self.shed_level))
+
+    def process(self, frame_time: float, picked_up: float) -> None:
+        camera_name = self.camera_name
+        metrics = self.metrics
+        # set by the load shedder of the parent process
+        level = int(metrics.get("shed_level"))
+        if level != self.shed_level:
+            logger.info("{}: shed level {} -> {}", camera_name, self.shed_level, level)
+            self.shed_level = level
+            self.detector.update_config(self.throttle.motion_config(level))
+        metrics.set("detection_frame", frame_time)
+        k = frame_name(camera_name, frame_time)
+        motion_frame = None
+        try:
+            if self.pyramid is not None:
+                slot = self.frame_manager.get(name=k, shape=(self.pyramid.size,))
+                frame = self.pyramid.frame(slot)
+                motion_frame = self.pyramid.level(slot, "motion")
+            else:
+                frame = self.frame_manager.get(name=k, shape=self.shape)
+        except Exception as e:
+            self.limiter.error(
+                "get", "Error getting frame from the frame manager: {}", e)
+            return
+        if frame is None:
+            self.limiter.error("missing", "Frame is not found in the frame manager")
+            return
+        if self.throttle.skip(self.shed_level, frame_time, idle=self.motion_event is None):
+            self.frame_manager.delete(k)
+            metrics.inc("shed_frames")
+            metrics.beat("detect", picked_up)
+            return
+        # the detector alone, the load shedder reads it as the time it is busy
+        motion_start = time.monotonic()
+        motion_boxes = self.detector.detect(frame, motion_frame)
+        motion_done = time.monotonic()
+        metrics.observe("motion", motion_done - motion_start)
+        logger.debug("Motion boxes: {}", motion_boxes)
+        self.fps_counter.update()
+        metrics.inc("detected_frames")
+        metrics.beat("detect", motion_done)
+        if motion_boxes and self.motion_event is None:
+            self.motion_event = {
+                "id": f"{frame_time}-{camera_name}",
+                "camera": camera_name,
+                "label": "motion",
+                "start_time": frame_time,
+                "end_time": None,
+            }
+            _emit_event(self.motion_event, self.event_queue, self.publisher, metrics)
+        elif not motion_boxes and self.motion_event is not None:
+            self.motion_event["end_time"] = frame_time
+            _emit_event(self.motion_event, self.event_queue, self.publisher, metrics)
+            self.motion_event = None
+        if self.publisher is not None:
+            if bool(motion_boxes) != self.motion_active:
+                self.motion_active = bool(motion_boxes)
+                self.publisher.publish_state(
+                    camera_name, "motion", "ON" if self.motion_active else "OFF")
+            now = time.monotonic()
+            if now - self.last_published >= 1.0:
+                self.last_published = now
+                self.publisher.publish_state(
+                    camera_name, "fps", round(self.fps_counter.eps(), 1))
+        self.frame_manager.delete(k)
+        if self.trace is not None:
+            record = self.trace.find(frame_time)
+            if record >= 0:
+                self.trace.mark(record, "picked_up", picked_up)
+                self.trace.mark(record, "motion", motion_done)
+                self.trace.mark(record, "detected", time.monotonic())
+        self.fc += 1
+
+    def close(self) -> None:
+        self.frame_manager.clean()
+        logger.debug("Frame manager cleaned")
+        if self.publisher is not None:
+            self.publisher.stop()
+            self.publisher.join(timeout=5)
 
 
 def run_detectors(
@@ -53,42 +323,63 @@ def run_detectors(
     config: CameraConfig,
     frame_queue: mp.Queue,
     stop_event: mp.Event,
-    current_frame: mp.Value,
+    metrics: CameraMetrics,
     detector: MotionDetectorAPI,
     frame_shape: Tuple[int, int],
     frame_manager: SharedMemoryFrameManager = SharedMemoryFrameManager(),
-    fps_counter: EventsPerSecond = EventsPerSecond(max_events=1000),
+    fps_counter: EventsPerSecond = EventsPerSecond(),
+    publisher: Optional[MqttPublisher] = None,
+    event_queue: Optional[mp.Queue] = None,
+    trace: Optional[CameraTrace] = None,
+    channel: Optional[ConfigChannel] = None,
+    camera: Optional[CameraDetector] = None,
 ):
     logger.info("Motion detection process started")
-    fps_counter.start()
-    shape = frame_shape
-    fc = 0
+    if camera is None:
+        camera = CameraDetector(
+            camera_name=camera_name,
+            config=config,
+            metrics=metrics,
+            detector=detector,
+            frame_shape=frame_shape,
+            frame_manager=frame_manager,
+            fps_counter=fps_counter,
+            publisher=publisher,
+            event_queue=event_queue,
+            trace=trace)
+    summary = PeriodicSummary()
+    limiter = RateLimitedLogger()
     while not stop_event.is_set():
-        fps = fps_counter.eps()
-        logger.info(f"Motion detection process FPS: {fps}")
-        logger.info(f"Motion detection process frames: {fc}")
+        if summary.ready():
+            camera.log_summary()
+        if channel is not None:
+            update = channel.poll()
+            if update is not None:
+                camera.update_config(update)
         try:
-            frame_time = frame_queue.get(True)
-            current_frame.value = frame_time
-            k = f"{camera_name}{frame_time}"
-            frame = frame_manager.get(name=k, shape=shape)
+            # wake up regularly, so that a stop request is never missed
+            frame_time = frame_queue.get(True, timeout=1.0)
         except queue.Empty:
-            logger.error("Frame queue is empty")
-            continue
-        except Exception as e:
-            logger.error(
-                f"Error getting frame from the frame manager: {e}")
-            continue
-        if frame is None:
-            logger.error("Frame is not found in the frame manager")
+            limiter.warning("empty", "Frame queue is empty")
             continue
-        motion_boxes = detector.detect(frame)
-        logger.debug(f"Motion boxes: {motion_boxes}")
-        fps_counter.update()
-        frame_manager.delete(k)
-        fc += 1
+        camera.process(frame_time, time.monotonic())
 
     frame_manager.clean()
     logger.debug("Frame manager cleaned")
-    logger.debug("Frame queue is empty")
     logger.info("Motion detection process stopped")
+
+
+def _emit_event(
+        event: dict,
+        event_queue: Optional[mp.Queue],
+        publisher: Optional[MqttPublisher],
+        metrics: CameraMetrics) -> None:
+    start = time.monotonic()
+    if event_queue is not None:
+        try:
+            event_queue.put_nowait(dict(event))
+        except queue.Full:
+            logger.warning("Event queue is full, dropping {}", event["id"])
+    if publisher is not None:
+        publisher.publish_event(event)
+    metrics.observe("publish_event", time.monotonic() - start)